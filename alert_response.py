@@ -1,112 +1,478 @@
 #!/usr/bin/python
 import sys, os
+import re
+import glob
+import argparse
+import time
+import threading
 import datetime, pytz
 import voeparse
 import logging
 logging.basicConfig(level=logging.DEBUG)
 
 from pysovo.local import contacts, default_email_account
-from pysovo.formatting import format_datetime
+from pysovo.daemon import PacketListener, interrupt_on_sigterm
+from pysovo.tracing import tracer
 import pysovo as ps
+import pysovo.archive
+import pysovo.crossmatch
+import pysovo.dedup
+import pysovo.ephem
+import pysovo.journal
+import pysovo.observatories
+import pysovo.reports
+import pysovo.rules
+import pysovo.tracing
+import pysovo.triage
+import pysovo.workers
+from pysovo.utils import IvornPrefixes
 import ami
 
-from jinja2 import Environment, PackageLoader
-
 #-------------------------------------------------------------------------------
-notify_contacts = [contacts['tim'],
-                   contacts['rob'],
-                   contacts['rene'], ]
+#Names in the contacts file; looked up per alert, so edits take effect live:
+notify_contacts = ['tim',
+                   'rob',
+                   'rene', ]
 
 notification_email_prefix = "[4 Pi Sky] "
 
-default_archive_root = os.environ["HOME"] + "/comet/voe_archive"
+#Repeat notifications for one trigger / stream within this many seconds are
+#merged into a digest, and each recipient gets at most (count, seconds) mails:
+notification_window = 120.0
+notification_windows = {'stream:' + IvornPrefixes.soton_test: 600.0}
+notification_rate_limits = {}
+
+default_archive_root = os.environ["HOME"] + "/comet/voe_store"
+
+#Enough workers to send to every facility at once:
+outbound_queue = ps.comms.outbound.OutboundQueue(workers=8)
+
+site_caches = ps.ephem.SiteEphemCacheRegistry()
+
+#Every request and notification is journalled before it is sent; any left
+#unfinished (e.g. by a crash) are sent again on the next start-up, unless
+#older than replay_max_age seconds.
+replay_max_age = 3600.0
+journal_path = os.path.join(ps.config_folder, 'action_journal.jsonl')
+journal = ps.journal.ActionJournal(journal_path)
+
+#Follow-up requests are sent to every facility whose predicate accepts the
+#target; each runs concurrently with the others.
+def format_ami_request(target, dtime):
+    return ami.request_email(target['position'], target['name'],
+                             datetime.timedelta(hours=1),
+                             timing='ASAP',
+                             action='QUEUE',
+                             requester=contacts['ami']['requester'],
+                             comment=target['comment'])
+
+def send_ami_request(body):
+    ps.comms.email.send_email(default_email_account,
+                              contacts['ami']['email'],
+                              ami.request_email_subject,
+                              body)
+
+facilities = ps.observatories.FacilityDispatcher([
+    ps.observatories.Facility('ami', ami.site,
+        formatter=format_ami_request,
+        transport=send_ami_request,
+        predicate=lambda target, dtime: target['position'].dec.degrees > -10.0),
+    ], outbound_queue, site_caches=site_caches, journal=journal)
 
-active_sites = [ami.site]
+active_sites = facilities.sites
 
+#Lets us skip visibility calculations for sites that can never see a target:
+sky_index = ps.ephem.SkyIndex(active_sites)
 
-env = Environment(loader=PackageLoader('pysovo', 'templates'),
-                  trim_blocks=True)
-env.filters['datetime'] = format_datetime
+rules = ps.rules.RuleRegistry()
+
+def send_notification(recipients, subject, body):
+    action_id = journal.intent('notification',
+                               dict(recipients=recipients, subject=subject,
+                                    body=body),
+                               description='Notification: ' + subject)
+    submit_notification(recipients, subject, body, action_id)
+
+def submit_notification(recipients, subject, body, action_id):
+    outbound_queue.submit(ps.comms.email.send_email,
+                          (default_email_account, recipients, subject, body),
+                          priority=ps.comms.outbound.Priority.notification,
+                          description='Notification: ' + subject,
+                          callback=lambda handle: journal.finish(action_id,
+                                                                 handle))
+
+notifications = ps.comms.digest.NotificationDigester(send_notification,
+                                    window=notification_window,
+                                    windows=notification_windows,
+                                    rate_limits=notification_rate_limits)
+
+#Known sources to flag if an alert falls on them, as
+#(label, RA deg, Dec deg, radius deg):
+known_repeaters = []
+
+#Positions of earlier alerts, loaded on first use. With --workers, each
+#worker has its own copy, and picks up positions indexed by the others from
+#the shared position log before each query:
+position_index = None
+
+packet_index_path = os.path.join(ps.config_folder, 'packet_index.json')
+packet_index = ps.dedup.PacketIndex(snapshot_path=packet_index_path)
+
+#(Daemon mode, with --workers) pool of processes handling packets:
+worker_pool = None
+worker_shutdown_timeout = 60
+#Packets routed to a worker but not yet handled:
+packets_in_flight = set()
+routing_lock = threading.Lock()
 
 #-------------------------------------------------------------------------------
 def main():
+    parser = argparse.ArgumentParser(
+                description="Respond to a VOEvent packet read from stdin.")
+    parser.add_argument('--daemon', metavar='SOCKET_PATH',
+                help="Run persistently, accepting packets on a unix socket "
+                     "(see forward_packet.py) rather than reading stdin.")
+    parser.add_argument('--trace-log', metavar='PATH',
+                help="Append per-stage timing spans to PATH as JSON lines.")
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                help="(Daemon mode) serve per-stage latency percentiles "
+                     "at http://localhost:PORT/metrics.")
+    parser.add_argument('--workers', type=int, default=0, metavar='N',
+                help="(Daemon mode) handle packets in N worker processes. "
+                     "Packets for the same trigger, or from the same stream, "
+                     "are still handled in order.")
+    args = parser.parse_args()
+    tracer.jsonl_path = args.trace_log
+    if args.daemon:
+        return run_daemon(args.daemon, args.workers, args.metrics_port)
     s = sys.stdin.read()
-    v = voeparse.loads(s)
-    voevent_logic(v)
+    replay_pending_actions()
+    process_packet(s)
+    notifications.flush()
+    outbound_queue.join()
+    journal.close()
+    close_archives()
+    packet_index.save(force=True)
+    return 0
+
+def run_daemon(socket_path, workers=0, metrics_port=None):
+    global worker_pool
+    handler = process_packet
+    #Including any left by a previous run with more workers:
+    for path in glob.glob(worker_file_pattern('packet_index', 'json')):
+        packet_index.merge(path)
+    get_position_index()
+    if workers:
+        #Start before any threads, so the workers are forked clean:
+        worker_pool = ps.workers.ProcessPool(dispatch_packet, workers,
+                                             initializer=init_worker,
+                                             finalizer=finish_worker,
+                                             callback=packet_handled,
+                                             tracer=tracer)
+        worker_pool.start()
+        handler = route_packet
+    #Workers send their spans back, so these cover all packets:
+    if metrics_port:
+        ps.tracing.serve_metrics(tracer, metrics_port)
+    #Keep the SMTP session open between alerts, however far apart:
+    ps.comms.email.default_pool.start_keepalive()
+    replay_pending_actions()
+    replay_orphaned_journals(workers)
+    #Installed after forking any workers, which leave shutdown to us:
+    interrupt_on_sigterm()
+    listener = PacketListener(socket_path, handler=handler)
+    try:
+        listener.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Interrupted, finishing queued packets")
+        listener.shutdown(wait=True)
+        if worker_pool is not None:
+            worker_pool.close(timeout=worker_shutdown_timeout)
+            for index, pid, handled, errors, rate, busy in worker_pool.summary():
+                logging.info("Worker %d (pid %s): %d packets, %d errors, "
+                             "%.2f packets/s, %.0f%% busy",
+                             index, pid, handled, errors, rate, 100 * busy)
+        finish_worker(None)
+        close_archives()
+        logging.info("Stage timings:\n" + tracer.prometheus_text())
     return 0
 
+def worker_index_path(index):
+    return os.path.join(ps.config_folder, 'packet_index.worker%d.json' % index)
+
+def worker_journal_path(index):
+    return os.path.join(ps.config_folder, 'action_journal.worker%d.jsonl'
+                                          % index)
+
+def worker_file_pattern(name, extension):
+    """Glob pattern matching every worker's file, e.g. worker_index_path."""
+    return os.path.join(ps.config_folder, '%s.worker*.%s' % (name, extension))
+
+def replay_orphaned_journals(workers):
+    """Re-send actions left unfinished in the journals of workers that are
+    not running this time, e.g. after a restart with fewer --workers."""
+    global journal
+    own_journal = journal
+    for path in sorted(glob.glob(worker_file_pattern('action_journal',
+                                                     'jsonl'))):
+        index = int(re.search(r'worker(\d+)\.jsonl$', path).group(1))
+        if index < workers:
+            continue    #Replayed by the worker itself
+        journal = ps.journal.ActionJournal(path)
+        facilities.journal = journal
+        try:
+            replay_pending_actions()
+            outbound_queue.join()
+        finally:
+            journal.close()
+            journal = own_journal
+            facilities.journal = journal
+
+def init_worker(index):
+    global journal
+    #Each worker keeps its own trigger state, merged on the next start-up:
+    packet_index.snapshot_path = worker_index_path(index)
+    #...and its own journal; a given trigger always goes to the same worker.
+    journal = ps.journal.ActionJournal(worker_journal_path(index))
+    facilities.journal = journal
+    ps.comms.email.default_pool.start_keepalive()
+    replay_pending_actions()
+
+def finish_worker(index):
+    notifications.flush()
+    outbound_queue.join()
+    journal.close()
+    packet_index.save(force=True)
+    tracer.flush(timeout=5)
+    for name, matches, errors, total_time in rules.stats():
+        logging.info("Rule %s: %d matches, %d errors, %.3f s total",
+                     name, matches, errors, total_time)
+    for name, requests, errors in facilities.stats():
+        logging.info("Facility %s: %d requests, %d errors",
+                     name, requests, errors)
+
+def process_packet(s):
+    """Handle a raw packet, only parsing it in full if a rule may want it."""
+    start = time.time()
+    attrs = ps.triage.peek_root_attributes(s)
+    with tracer.trace(attrs['ivorn']):
+        tracer.record('triage', time.time() - start, start)
+        handle_packet(attrs['ivorn'], attrs.get('role'), s)
+        tracer.record('packet_total', time.time() - start, start)
+
+def replay_pending_actions():
+    """Re-send any requests or notifications left unfinished last time."""
+    def resubmit(record):
+        if record.kind == 'notification':
+            submit_notification(record.payload['recipients'],
+                                record.payload['subject'],
+                                record.payload['body'],
+                                record.action_id)
+        else:
+            facilities.resubmit(record)
+    replayed = journal.replay(resubmit, max_age=replay_max_age)
+    if replayed:
+        logging.warn("Re-sent %d actions left unfinished", replayed)
+
+def route_packet(s):
+    """(Worker pool mode) Drop repeats and archive here, in the parent;
+    the rest is done by a worker process."""
+    ivorn = ps.triage.peek_root_attributes(s)['ivorn']
+    with routing_lock:
+        if ivorn in packet_index or ivorn in packets_in_flight:
+            logging.info("Already handled %s, ignoring repeat delivery", ivorn)
+            return
+        packets_in_flight.add(ivorn)
+    archive_packet(ivorn, s, rootdir=default_archive_root)
+    worker_pool.submit(ivorn, s)
+
+def packet_handled(ivorn, ok):
+    """(Worker pool mode) Record a packet as seen once a worker has handled
+    it, so one still queued when we stop, or whose handling failed, is
+    handled again if redelivered."""
+    with routing_lock:
+        packets_in_flight.discard(ivorn)
+        if ok:
+            packet_index.check_and_add(ivorn)
+            packet_index.save()
+
+def dispatch_packet(s):
+    """(In a worker process) Handle a packet routed by route_packet."""
+    start = time.time()
+    attrs = ps.triage.peek_root_attributes(s)
+    with tracer.trace(attrs['ivorn']):
+        tracer.record('triage', time.time() - start, start)
+        handle_packet(attrs['ivorn'], attrs.get('role'), s, archive=False)
+        tracer.record('packet_total', time.time() - start, start)
+
 def voevent_logic(v):
-    #SWIFT BAT GRB alert:
-    if v.attrib['ivorn'].find("ivo://nasa.gsfc.gcn/SWIFT#BAT_GRB_Pos") == 0:
-        swift_bat_grb_logic(v)
+    """Handle an already-parsed packet."""
+    handle_packet(v.attrib['ivorn'], v.attrib.get('role'), voeparse.dumps(v), v)
 
-    if v.attrib['ivorn'].find("ivo://voevent.astro.soton/TEST#") == 0:
-        test_logic(v)
-    archive_voevent(v, rootdir=default_archive_root)
+def handle_packet(ivorn, role, raw, v=None, archive=True):
+    #Only marked as handled once the rules have run, so a packet whose
+    #handling failed is handled again if redelivered:
+    if not packet_index.handle_once(ivorn, respond_to_packet, ivorn, role,
+                                    raw, v, archive):
+        logging.info("Already handled %s, ignoring repeat delivery", ivorn)
+        return
+    packet_index.save()
 
+def respond_to_packet(ivorn, role, raw, v, archive):
+    with tracer.trace(ivorn):
+        if rules.match(ivorn, role):
+            if v is None:
+                with tracer.span('parse'):
+                    v = voeparse.loads(raw)
+            with tracer.span('dispatch'):
+                rules.dispatch(v)
+        else:
+            logging.debug("No rules match %s", ivorn)
+        if archive:
+            with tracer.span('archive'):
+                archive_packet(ivorn, raw, rootdir=default_archive_root)
 
 
+#SWIFT BAT GRB alert:
+@rules.handler(ivorn_prefix=IvornPrefixes.swift_bat_grb_pos)
 def swift_bat_grb_logic(v):
     now = datetime.datetime.now(pytz.utc)
-    posn = ps.utils.convert_voe_coords_to_fk5(voeparse.pull_astro_coords(v))
+    with tracer.span('convert_coords'):
+        posn = ps.utils.convert_voe_coords_to_fk5(voeparse.pull_astro_coords(v))
     actions_taken = []
     alert_id, alert_id_short = ps.utils.pull_swift_bat_id(v)
     target_name = 'SWIFT_' + alert_id_short
     comment = 'Automated SWIFT ID ' + alert_id
+    description = 'Swift GRB'
 
-    if posn.dec.degrees > -10.0:
-        duration = datetime.timedelta(hours=1)
+    #Updates and retractions share the trigger ID of the original alert:
+    trigger = packet_index.trigger(alert_id_short, v.attrib['ivorn'])
+    requested = [f.name for f in facilities.facilities
+                 if f.name + '_request' in trigger.actions]
 
-        ami_request = ami.request_email(posn, target_name, duration,
-                      timing='ASAP',
-                      action='QUEUE',
-                      requester=contacts['ami']['requester'],
-                      comment=comment)
-        ps.comms.email.send_email(account=default_email_account,
-                                recipient_addresses=contacts['ami']['email'],
-                                subject=ami.request_email_subject,
-                                body_text=ami_request)
+    if ps.utils.is_retraction(v):
+        packet_index.mark_retracted(alert_id_short)
+        description = 'Swift GRB RETRACTION'
+        target_name += ' (retracted)'
+        for name in requested:
+            actions_taken.append('NB an %s observation was requested for '
+                                 'this trigger; cancel it manually.'
+                                 % name.upper())
+    elif requested:
+        description = 'Swift GRB update'
+        target_name += ' (update)'
+        for name in requested:
+            actions_taken.append('%s observation already requested '
+                                 'for this trigger.' % name.upper())
+    else:
+        target = {'position': posn, 'name': target_name, 'comment': comment}
+        for facility, _ in facilities.dispatch(target, now,
+                                               trigger=alert_id_short):
+            packet_index.record_action(alert_id_short,
+                                       facility.name + '_request')
+            actions_taken.append('Observation requested from %s.'
+                                 % facility.name.upper())
 
-        actions_taken.append('Observation requested from AMI.')
+    with tracer.span('crossmatch'):
+        index = get_position_index()
+        index.refresh()
+        #Skip earlier packets about this same trigger:
+        matches = index.query(posn, exclude=trigger.ivorns)
+        index.add(v.attrib['ivorn'], posn)
 
     notify_msg = generate_report_text(
-                                {'position': posn, 'description': 'Swift GRB'},
+                                {'position': posn, 'description': description},
                                 active_sites,
                                 now,
-                                actions_taken)
-    ps.comms.email.send_email(default_email_account,
-                        [p['email'] for p in notify_contacts],
-                        notification_email_prefix + target_name,
-                        notify_msg)
+                                actions_taken,
+                                matches)
+    notifications.add('trigger:SWIFT_' + alert_id_short,
+                      [contacts[name]['email']
+                       for name in notify_contacts],
+                      notification_email_prefix + target_name,
+                      notify_msg)
 
 
 
+@rules.handler(ivorn_prefix=IvornPrefixes.soton_test)
 def test_logic(v):
     now = datetime.datetime.now(pytz.utc)
     msg = "Test packet received at time %s\n" % now.strftime("%y-%m-%d %H:%M:%S")
-    ps.comms.email.send_email(ps.default_email_account,
-                            contacts['test']['email'],
-                            'Test packet received',
-                            msg)
-    archive_voevent(v, rootdir=default_archive_root)
+    notifications.add('stream:' + IvornPrefixes.soton_test,
+                      ps.utils.listify(contacts['test']['email']),
+                      'Test packet received',
+                      msg)
+
+#Packets are written out in the background, one writer per archive root:
+archive_writers = {}
 
 def archive_voevent(v, rootdir):
-    relpath, filename = v.attrib['ivorn'].split('//')[1].split('#')
-    filename += ".xml"
-    fullpath = os.path.sep.join((rootdir, relpath, filename))
-    ps.utils.ensure_dir(fullpath)
-    with open(fullpath, 'w') as f:
-        voeparse.dump(v, f)
-
-def generate_report_text(target_info, sites, dtime, actions_taken):
+    archive_packet(v.attrib['ivorn'], voeparse.dumps(v), rootdir)
+
+def archive_packet(ivorn, packet, rootdir):
+    """Queue raw packet bytes for archiving, avoiding a parse / re-serialize
+    round trip."""
+    if rootdir not in archive_writers:
+        archive_writers[rootdir] = ps.archive.ArchiveWriter(
+                                            ps.archive.ArchiveStore(rootdir))
+    archive_writers[rootdir].submit(ivorn, packet)
+
+def get_position_index():
+    """The cross-match index, loading earlier positions on first call."""
+    global position_index
+    if position_index is None:
+        index = ps.crossmatch.PositionIndex()
+        for label, ra, dec, radius in known_repeaters:
+            index.add_radec(label, ra, dec, radius, label=label)
+        #Kept beside the archive, and appended to as alerts are indexed:
+        log_path = os.path.join(default_archive_root, 'positions.jsonl')
+        if (not os.path.exists(log_path)
+                and os.path.isdir(default_archive_root)):
+            seed_position_log(log_path)
+        index.open_log(log_path)
+        position_index = index
+    return position_index
+
+def seed_position_log(log_path):
+    """Write the positions of all archived packets to a new position log
+    (once, for an archive that predates it)."""
+    if default_archive_root in archive_writers:
+        store = archive_writers[default_archive_root].store
+    else:
+        store = ps.archive.ArchiveStore(default_archive_root)
+    tmp_path = log_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    seed = ps.crossmatch.PositionIndex()
+    seed.open_log(tmp_path)
+    ps.crossmatch.load_archive(seed, store)
+    seed.close_log()
+    if default_archive_root not in archive_writers:
+        store.close()
+    open(tmp_path, 'a').close()   #Even if empty, so we only seed once
+    os.rename(tmp_path, log_path)
+
+def close_archives():
+    """Write out all queued packets, e.g. on shutdown."""
+    for rootdir, writer in archive_writers.items():
+        writer.close()
+        writer.store.close()
+        del archive_writers[rootdir]
+
+def generate_report_text(target_info, sites, dtime, actions_taken,
+                         matches=()):
     posn = target_info['position']
-    site_reports = [(site, ps.ephem.visibility(posn, site, dtime))
-                            for site in sites]
-    notification_template = env.get_template('notify_example.txt')
-    msg = notification_template.render(target=target_info,
+    with tracer.span('visibility'):
+        site_reports = ps.ephem.visibility_reports(posn, sites, dtime,
+                                                   index=sky_index,
+                                                   caches=site_caches)
+    with tracer.span('render'):
+        notification_template = ps.reports.get_template('notify_example.txt')
+        msg = notification_template.render(target=target_info,
                                 note_time=dtime,
                                 site_reports=site_reports,
                                 actions_taken=actions_taken,
+                                matches=matches,
                                 dt_style=ps.formatting.datetime_format_long)
     return msg
 
@@ -0,0 +1,43 @@
+#!/usr/bin/python
+"""Convert between the old one-file-per-packet VOEvent archive layout and
+the segmented pysovo.archive store.
+
+e.g.::
+
+ archive_tool.py migrate ~/comet/voe_archive ~/comet/voe_store
+ archive_tool.py export ~/comet/voe_store ./exported --stream nasa.gsfc.gcn/SWIFT
+"""
+import sys
+import argparse
+import logging
+logging.basicConfig(level=logging.INFO)
+
+from pysovo.archive import ArchiveStore, import_tree, export_tree
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    subparsers = parser.add_subparsers(dest='command')
+    migrate = subparsers.add_parser('migrate',
+                        help="Import a one-file-per-packet tree into a store.")
+    migrate.add_argument('tree_root')
+    migrate.add_argument('store_root')
+    export = subparsers.add_parser('export',
+                        help="Write a store out as a one-file-per-packet tree.")
+    export.add_argument('store_root')
+    export.add_argument('tree_root')
+    export.add_argument('--stream', default=None,
+                        help="Only export IVORNs from this stream (prefix).")
+    args = parser.parse_args()
+
+    store = ArchiveStore(args.store_root)
+    if args.command == 'migrate':
+        n = import_tree(store, args.tree_root)
+        logging.info("Imported %d packets into %s", n, args.store_root)
+    else:
+        n = export_tree(store, args.tree_root, stream=args.stream)
+        logging.info("Exported %d packets to %s", n, args.tree_root)
+    store.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,23 @@
+#!/usr/bin/python
+"""Forward a VOEvent packet from stdin to a running alert_response daemon.
+
+A drop-in replacement for ``alert_response.py`` as the broker's per-packet
+command, e.g. ``forward_packet.py /tmp/pysovo.sock``. Deliberately imports
+nothing from pysovo, so it starts in milliseconds.
+"""
+import sys
+import socket
+
+def main():
+    if len(sys.argv) != 2:
+        print >> sys.stderr, "Usage: forward_packet.py SOCKET_PATH"
+        return 1
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(sys.argv[1])
+    sock.sendall(sys.stdin.read())
+    sock.shutdown(socket.SHUT_WR)
+    sock.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
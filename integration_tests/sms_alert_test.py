@@ -1,6 +1,6 @@
 #!/usr/bin/python
 import pysovo as ps
-import pysovo.sms as sms
+import pysovo.comms.sms as sms
 
 def main():
     acc = sms.load_account_settings_from_file()
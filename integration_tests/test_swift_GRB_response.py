@@ -3,15 +3,24 @@
 
 #Minimal imports here - ensures proper testing of alert_response.
 #(If not careful you might temporarily fix a broken import - which then remains broken)
+import os
+import shutil
+import tempfile
 from pysovo.tests.resources import datapaths
 import alert_response as ar
 import voeparse
 ##We bind the email sender to a dummy function:
 ar.ps.comms.email.send_email = ar.ps.comms.email.dummy_email_send_function
 ar.notification_email_prefix = "[TEST] " + ar.notification_email_prefix
-ar.notify_contacts = [ ar.contacts['test']  ]  # Only notify test contacts
+ar.notify_contacts = ['test']  # Only notify test contacts
 ar.contacts['ami']['email'] = 'DUMMY' + ar.contacts['ami']['email'] #Do NOT email AMI
 ar.default_archive_root = "./"
+ar.packet_index = ar.ps.dedup.PacketIndex() #Don't persist, or re-runs are ignored
+#Nor touch the production action journal:
+journal_dir = tempfile.mkdtemp()
+ar.journal = ar.ps.journal.ActionJournal(os.path.join(journal_dir,
+                                                      'action_journal.jsonl'))
+ar.facilities.journal = ar.journal
 
 def main():
     test_packet = ar.voeparse.load(datapaths.swift_bat_grb_pos_v2)
@@ -20,6 +29,11 @@ def main():
     ar.voevent_logic(test_packet)
     ##Now test one with null follow-up:
     ar.voevent_logic(ar.voeparse.load(datapaths.swift_bat_grb_low_dec))
+    ar.notifications.flush()
+    ar.outbound_queue.join()
+    ar.journal.close()
+    ar.close_archives()
+    shutil.rmtree(journal_dir)
 
 if __name__ == "__main__":
     main()
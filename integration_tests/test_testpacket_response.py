@@ -3,6 +3,9 @@
 
 #Minimal imports here - ensures proper testing of alert_response.
 #(If not careful you might temporarily fix a broken import - which then remains broken)
+import os
+import shutil
+import tempfile
 from pysovo.tests.resources import datapaths
 import voeparse
 import alert_response as ar
@@ -12,12 +15,23 @@ ar.ps.comms.email.send_email = ar.ps.comms.email.dummy_email_send_function
 
 def main():
     ar.default_archive_root = "./"
+    ar.packet_index = ar.ps.dedup.PacketIndex()
+    #Don't touch the production action journal:
+    journal_dir = tempfile.mkdtemp()
+    ar.journal = ar.ps.journal.ActionJournal(os.path.join(journal_dir,
+                                                    'action_journal.jsonl'))
+    ar.facilities.journal = ar.journal
     test_packet = voeparse.Voevent(stream='voevent.astro.soton/TEST',
                                    stream_id='42',
                                    role=voeparse.roles.test)
     print "Packet loaded, ivorn", test_packet.attrib['ivorn']
     print "Logic go!"
     ar.voevent_logic(test_packet)
+    ar.notifications.flush()
+    ar.outbound_queue.join()
+    ar.journal.close()
+    ar.close_archives()
+    shutil.rmtree(journal_dir)
 
 if __name__ == "__main__":
     main()
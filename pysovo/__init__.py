@@ -1,31 +1,48 @@
 from __future__ import absolute_import
 import os
-import json
 import logging
 import sys
+import types
+import imp
+import importlib
 logger = logging.getLogger(__name__)
 
 config_folder = os.path.join(os.environ['HOME'], '.pysovo')
 default_email_config_file = os.path.join(config_folder, "email_acc")
-
-import pysovo.comms
-import pysovo.utils
-import pysovo.observatories
-import pysovo.notify
-
-try:
-    contacts_file = os.path.join(config_folder, 'contacts.json')
-    print( contacts_file )
-    with open(contacts_file) as f:
-        contacts = json.load(f)
-    logger.debug('Contacts loaded from ' + contacts_file)
-except Exception as e:
-    logger.warn("Could not load contacts file; reason:\n" + str(e))
-    contacts = {}
-
-
-
-
-
-
-
+contacts_file = os.path.join(config_folder, 'contacts.json')
+
+#Submodules (pysovo.comms, pysovo.ephem, etc.) and the contacts are loaded
+#on first attribute access, so that `import pysovo` stays cheap - in
+#particular it does not pull in astropysics / scipy.
+
+def _load_contacts():
+    """The contacts, re-loaded from disk whenever the file changes."""
+    from pysovo.config import store, contacts_schema
+    contacts = store.view(contacts_file, contacts_schema, default={})
+    len(contacts) #Load now, so a missing file is reported straight away
+    return contacts
+
+
+class _LazyPackage(types.ModuleType):
+    """Module type for `pysovo`, importing submodules on attribute access."""
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if name == 'contacts':
+            value = _load_contacts()
+        else:
+            try:
+                imp.find_module(name, self.__path__)
+            except ImportError:
+                raise AttributeError("module '%s' has no attribute '%s'"
+                                     % (self.__name__, name))
+            value = importlib.import_module(self.__name__ + '.' + name)
+        setattr(self, name, value)
+        return value
+
+
+_package = _LazyPackage(__name__, __doc__)
+_package.__dict__.update(sys.modules[__name__].__dict__)
+#Keep the original module alive, since its dict holds our functions' globals:
+_package._original_module = sys.modules[__name__]
+sys.modules[__name__] = _package
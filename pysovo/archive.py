@@ -0,0 +1,440 @@
+"""
+An append-only, indexed store for archived VOEvent packets.
+
+Packets are appended to a small number of large segment files, rather than
+one file per packet, and an append-only index records the IVORN, stream,
+archive time and location of each. The index is read into memory on the
+first lookup (appending alone never reads it), so "have we seen this
+IVORN?" or "all packets from this stream last week" are answered without
+touching the disk; packet bodies are read back through memory-mapped
+segments.
+
+Several processes may share a store (e.g. one per packet, when run from a
+broker): appends hold an exclusive flock on the index, and take offsets
+from the segment file's size on disk; lookups pick up index lines appended
+by other processes.
+
+Layout under the store's root directory::
+
+    index.txt           One tab-separated line per packet
+    segments/000000.seg Raw packet bytes, concatenated
+
+:class:`ArchiveWriter` moves archiving off the packet-handling path,
+committing packets to the store in batches from a background thread.
+
+Use :func:`import_tree` and :func:`export_tree` to convert from / to the
+older one-file-per-packet layout (``<root>/<stream>/<id>.xml``).
+"""
+
+import os
+import mmap
+import fcntl
+import threading
+import time
+import datetime
+import calendar
+import collections
+import logging
+logger = logging.getLogger(__name__)
+
+import pytz
+
+from pysovo.utils import ensure_dir
+
+default_max_segment_bytes = 64 * 1024 * 1024
+
+IndexEntry = collections.namedtuple('IndexEntry',
+                            'ivorn stream timestamp segment offset length')
+
+
+def split_ivorn(ivorn):
+    """Split an IVORN into (stream, local id),
+
+    e.g. 'ivo://nasa.gsfc.gcn/SWIFT#BAT_GRB_Pos_1' ->
+    ('nasa.gsfc.gcn/SWIFT', 'BAT_GRB_Pos_1')
+    """
+    stream, local_id = ivorn.split('//', 1)[1].split('#', 1)
+    return stream, local_id
+
+def _stream_matcher(stream):
+    """Return a predicate on IndexEntry for :meth:`ArchiveStore.query`."""
+    if stream is None:
+        return None
+    if stream.startswith('ivo://'):
+        stream = stream[len('ivo://'):]
+    if '#' in stream:
+        ivorn_prefix = 'ivo://' + stream
+        return lambda e: e.ivorn.startswith(ivorn_prefix)
+    stream = stream.rstrip('/')
+    return lambda e: e.stream == stream or e.stream.startswith(stream + '/')
+
+def _to_timestamp(dtime):
+    if dtime is None:
+        return time.time()
+    if dtime.tzinfo is not None:
+        dtime = dtime.astimezone(pytz.utc)
+    return calendar.timegm(dtime.timetuple()) + dtime.microsecond / 1e6
+
+def _from_timestamp(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, pytz.utc)
+
+
+class ArchiveStore(object):
+    """Segmented, indexed packet archive rooted at `rootdir`.
+
+    If the same IVORN is archived more than once, lookups return the most
+    recent copy.
+    """
+    def __init__(self, rootdir, max_segment_bytes=default_max_segment_bytes):
+        self.rootdir = rootdir
+        self.max_segment_bytes = max_segment_bytes
+        self.index_path = os.path.join(rootdir, 'index.txt')
+        self.segment_dir = os.path.join(rootdir, 'segments')
+        self._entries = []
+        self._by_ivorn = {}
+        self._maps = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._index_offset = 0      #Bytes of the index read so far
+        self._segment = None
+        self._segment_file = None
+        ensure_dir(os.path.join(self.segment_dir, 'x'))
+        self._index_file = open(self.index_path, 'a')
+
+    def __len__(self):
+        self._refresh()
+        return len(self._entries)
+
+    def __contains__(self, ivorn):
+        self._refresh()
+        return ivorn in self._by_ivorn
+
+    def append(self, ivorn, packet, archived_at=None):
+        """Append raw packet bytes, returning the new :class:`IndexEntry`.
+
+        `archived_at` (a datetime) defaults to now.
+        """
+        return self.append_many([(ivorn, packet, archived_at)])[0]
+
+    def append_many(self, packets, sync=False):
+        """Append a batch of (ivorn, packet, archived_at) tuples.
+
+        The segment and index files are flushed once for the whole batch,
+        and if `sync` is True, fsync'd. Returns the new entries.
+        """
+        entries = []
+        with self._lock:
+            fcntl.flock(self._index_file, fcntl.LOCK_EX)
+            try:
+                self._repair_torn_index()
+                if self._loaded:
+                    self._read_index()
+                f = self._open_segment(self._latest_segment())
+                offset = os.fstat(f.fileno()).st_size
+                for ivorn, packet, archived_at in packets:
+                    stream, _ = split_ivorn(ivorn)
+                    if offset and offset + len(packet) > self.max_segment_bytes:
+                        self._flush(f, sync=True)
+                        f = self._open_segment(self._segment + 1)
+                        offset = os.fstat(f.fileno()).st_size
+                    f.write(packet)
+                    entries.append(IndexEntry(ivorn, stream,
+                                              _to_timestamp(archived_at),
+                                              self._segment, offset,
+                                              len(packet)))
+                    offset += len(packet)
+                #Packet data goes out before the index lines referring to it:
+                self._flush(f, sync)
+                self._index_file.write(''.join(self._format_entry(e)
+                                               for e in entries))
+                self._flush(self._index_file, sync)
+                if self._loaded:
+                    for entry in entries:
+                        self._add_entry(entry)
+                    self._index_offset = os.fstat(
+                                        self._index_file.fileno()).st_size
+            finally:
+                fcntl.flock(self._index_file, fcntl.LOCK_UN)
+        return entries
+
+    def sync(self):
+        """Flush appended data and index through to disk."""
+        with self._lock:
+            for f in (self._segment_file, self._index_file):
+                self._flush(f, sync=True)
+
+    @staticmethod
+    def _flush(f, sync):
+        if f is not None:
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+
+    def get(self, ivorn):
+        """Return the raw bytes of the packet archived under `ivorn`."""
+        return self.read(self.entry(ivorn))
+
+    def read(self, entry):
+        """Return the raw bytes for an :class:`IndexEntry`."""
+        m = self._map_segment(entry.segment, entry.offset + entry.length)
+        return m[entry.offset:entry.offset + entry.length]
+
+    def entry(self, ivorn):
+        self._refresh()
+        return self._by_ivorn[ivorn]
+
+    def query(self, stream=None, start=None, end=None):
+        """Return index entries in archive order, optionally filtered.
+
+        `stream` matches whole path components, e.g. 'nasa.gsfc.gcn/SWIFT'
+        matches that stream and 'nasa.gsfc.gcn/SWIFT/...', but not
+        'nasa.gsfc.gcn/SWIFTX'. An IVORN prefix including the '#' (e.g.
+        'ivo://nasa.gsfc.gcn/SWIFT#BAT_GRB') matches the IVORNs it prefixes.
+        `start` and `end` are datetimes bounding the archive time.
+        """
+        start = None if start is None else _to_timestamp(start)
+        end = None if end is None else _to_timestamp(end)
+        matches_stream = _stream_matcher(stream)
+        self._refresh()
+        with self._lock:
+            entries = list(self._entries)
+        return [e for e in entries
+                if (matches_stream is None or matches_stream(e))
+                and (start is None or e.timestamp >= start)
+                and (end is None or e.timestamp < end)]
+
+    def close(self):
+        with self._lock:
+            for f in (self._segment_file, self._index_file):
+                if f is not None:
+                    f.close()
+            self._segment_file = self._index_file = None
+            for m in self._maps.values():
+                m.close()
+            self._maps = {}
+
+    def _segment_path(self, segment):
+        return os.path.join(self.segment_dir, '%06d.seg' % segment)
+
+    def _latest_segment(self):
+        segments = [int(name[:-len('.seg')])
+                    for name in os.listdir(self.segment_dir)
+                    if name.endswith('.seg')]
+        return max(segments or [0])
+
+    def _open_segment(self, segment):
+        if self._segment_file is None or segment != self._segment:
+            if self._segment_file is not None:
+                self._segment_file.close()
+            self._segment_file = open(self._segment_path(segment), 'ab')
+            self._segment = segment
+        return self._segment_file
+
+    def _map_segment(self, segment, min_size):
+        m = self._maps.get(segment)
+        if m is None or len(m) < min_size:
+            #Not yet mapped, or appended to since:
+            if m is not None:
+                m.close()
+            with open(self._segment_path(segment), 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return '' #mmap refuses to map an empty file
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = m
+        return m
+
+    @staticmethod
+    def _format_entry(e):
+        return "%s\t%s\t%.6f\t%d\t%d\t%d\n" % e
+
+    def _refresh(self):
+        """Read the index on first use, and after that any lines appended
+        since (e.g. by another process)."""
+        with self._lock:
+            if (self._loaded and
+                    os.path.getsize(self.index_path) == self._index_offset):
+                return
+            fcntl.flock(self._index_file, fcntl.LOCK_SH)
+            try:
+                self._read_index()
+            finally:
+                fcntl.flock(self._index_file, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        with open(self.index_path, 'rb') as f:
+            f.seek(self._index_offset)
+            lines = f.read().split('\n')
+        #Any partial last line is left for the next append to terminate:
+        lines.pop()
+        for line in lines:
+            self._index_offset += len(line) + 1
+            fields = line.split('\t')
+            if len(fields) != 6:
+                #Partially written line, e.g. after a crash.
+                logger.warn("Skipping malformed archive index line: %r",
+                            line)
+                continue
+            self._add_entry(IndexEntry(fields[0], fields[1],
+                                       float(fields[2]), int(fields[3]),
+                                       int(fields[4]), int(fields[5])))
+        self._loaded = True
+
+    def _repair_torn_index(self):
+        """Don't run the next entry on from a line left partially written
+        by a crash. Call with the index locked exclusively."""
+        size = os.fstat(self._index_file.fileno()).st_size
+        if not size:
+            return
+        with open(self.index_path, 'rb') as f:
+            f.seek(size - 1)
+            torn = f.read(1) != '\n'
+        if torn:
+            self._index_file.write('\n')
+            self._index_file.flush()
+
+    def _add_entry(self, entry):
+        self._entries.append(entry)
+        self._by_ivorn[entry.ivorn] = entry
+
+
+class ArchiveWriter(object):
+    """Appends packets to an ArchiveStore from a background thread.
+
+    :meth:`submit` only queues the packet, blocking only if `max_queue`
+    packets are already waiting. The writer thread takes up to `max_batch`
+    queued packets at a time, appends them and fsyncs once per batch
+    (a group commit). :meth:`flush` waits until everything submitted so
+    far is on disk. Packets in a batch that could not be written are
+    dropped, and counted in `errors`.
+    """
+    def __init__(self, store, max_queue=1000, max_batch=256):
+        self.store = store
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.batches = 0
+        self.written = 0
+        self.errors = 0
+        self._queue = collections.deque()
+        self._submitted = 0
+        self._done = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run,
+                                        name='archive-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, ivorn, packet, archived_at=None):
+        """Queue a packet for archiving; `archived_at` defaults to now."""
+        if archived_at is None:
+            archived_at = _from_timestamp(time.time())
+        with self._cond:
+            if self._closed:
+                raise ValueError("ArchiveWriter is closed")
+            while len(self._queue) >= self.max_queue:
+                self._cond.wait()
+            self._queue.append((ivorn, packet, archived_at))
+            self._submitted += 1
+            self._cond.notify_all()
+
+    def pending(self):
+        with self._cond:
+            return self._submitted - self._done
+
+    def flush(self, timeout=None):
+        """Block until all packets submitted before the call are on disk.
+
+        Returns False if `timeout` (seconds) expired first, or if any packet
+        could not be written (see `errors`).
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            target = self._submitted
+            while self._done < target:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return not self.errors
+
+    def close(self):
+        """Write out everything queued and stop the writer thread.
+
+        Returns False if any packet could not be written.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        if self.errors:
+            logger.error("%d packets could not be archived to %s",
+                         self.errors, self.store.rootdir)
+        return not self.errors
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                batch = [self._queue.popleft()
+                         for _ in range(min(self.max_batch, len(self._queue)))]
+                self._cond.notify_all()
+            try:
+                self.store.append_many(batch, sync=True)
+                self.written += len(batch)
+            except Exception:
+                self.errors += len(batch)
+                logger.exception("Failed to archive %d packets; dropped",
+                                 len(batch))
+            self.batches += 1
+            with self._cond:
+                self._done += len(batch)
+                self._cond.notify_all()
+
+
+def import_tree(store, tree_root):
+    """Import a one-file-per-packet archive tree into `store`.
+
+    Files ``<tree_root>/<stream>/<id>.xml`` are archived under the IVORN
+    ``ivo://<stream>#<id>``, timestamped by their modification time.
+    IVORNs already in the store are skipped. Returns the number imported.
+    """
+    n_imported = 0
+    for dirpath, _, filenames in sorted(os.walk(tree_root)):
+        stream = os.path.relpath(dirpath, tree_root).replace(os.path.sep, '/')
+        for filename in sorted(filenames):
+            if not filename.endswith('.xml') or stream == '.':
+                continue
+            ivorn = 'ivo://' + stream + '#' + filename[:-len('.xml')]
+            if ivorn in store:
+                continue
+            path = os.path.join(dirpath, filename)
+            with open(path, 'rb') as f:
+                packet = f.read()
+            store.append(ivorn, packet,
+                         archived_at=_from_timestamp(os.path.getmtime(path)))
+            n_imported += 1
+    store.sync()
+    return n_imported
+
+def export_tree(store, tree_root, stream=None, start=None, end=None):
+    """Write packets out in the one-file-per-packet layout.
+
+    Optionally filtered as per :meth:`ArchiveStore.query`.
+    Returns the number of files written.
+    """
+    entries = store.query(stream, start, end)
+    latest = collections.OrderedDict((e.ivorn, e) for e in entries)
+    created_dirs = set()
+    for ivorn, entry in latest.iteritems():
+        stream_path, local_id = split_ivorn(ivorn)
+        path = os.path.sep.join((tree_root, stream_path, local_id + '.xml'))
+        if stream_path not in created_dirs:
+            ensure_dir(path)
+            created_dirs.add(stream_path)
+        with open(path, 'wb') as f:
+            f.write(store.read(entry))
+        os.utime(path, (entry.timestamp, entry.timestamp))
+    return len(latest)
@@ -0,0 +1,318 @@
+"""
+Benchmarks for each stage of the alert-handling hot path.
+
+Stages are timed on the sample packets in ``pysovo/tests/resources``:
+parsing, coordinate conversion, visibility for 1 / 10 / 100 sites, report
+rendering and archive writes. Others can be registered with :func:`stage`
+(``run_benchmarks.py`` adds alert_response's handling of a Swift alert end
+to end). Each stage is run `repeats` times and the median taken.
+
+Results are saved per commit by a :class:`ResultsStore`, and compared with
+an earlier commit's by :func:`check_regressions`; a stage regresses if it
+gets slower by more than its threshold ratio. See ``run_benchmarks.py``.
+"""
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import datetime
+import platform
+import subprocess
+import collections
+import logging
+logger = logging.getLogger(__name__)
+
+import pytz
+
+from pysovo.config import any_key, store as config_store
+from pysovo.utils import ensure_dir
+
+#Fixed, so visibility results (and timings) don't vary from run to run:
+benchmark_time = datetime.datetime(2012, 3, 20, 5, 14, tzinfo=pytz.utc)
+
+#Allowed slowdown relative to the baseline, as a ratio, per stage:
+default_threshold = 1.25
+default_thresholds = {}
+
+#Changes smaller than this (seconds) are treated as noise:
+noise_floor = 50e-6
+
+thresholds_schema = {any_key: (int, float)}
+
+stages = collections.OrderedDict()
+
+def stage(name):
+    """Decorator registering a benchmark stage.
+
+    The decorated function is called once with a scratch directory, and
+    returns the function to be timed. If that has a `close` attribute, it is
+    called once timing is done.
+    """
+    def register(setup):
+        stages[name] = setup
+        return setup
+    return register
+
+
+def sample_packets():
+    """Raw bytes of the sample packets."""
+    from pysovo.tests.resources import datapaths
+    packets = []
+    for path in (datapaths.swift_bat_grb_pos_v2,
+                 datapaths.swift_bat_grb_low_dec):
+        with open(path, 'rb') as f:
+            packets.append(f.read())
+    return packets
+
+def benchmark_sites(n_sites):
+    """`n_sites` sites spread across latitude and longitude."""
+    import astropysics.obstools
+    sites = []
+    for i in range(n_sites):
+        site = astropysics.obstools.Site(lat=-60 + 120.0 * i / n_sites,
+                                         long=360.0 * i / n_sites,
+                                         name='Site %d' % i)
+        site.target_min_elevation = 0
+        sites.append(site)
+    return sites
+
+def sample_position():
+    import voeparse
+    from pysovo.utils import convert_voe_coords_to_fk5
+    v = voeparse.loads(sample_packets()[0])
+    return convert_voe_coords_to_fk5(voeparse.pull_astro_coords(v))
+
+
+@stage('parse')
+def parse_benchmark(workdir):
+    import voeparse
+    packets = sample_packets()
+    def run():
+        for packet in packets:
+            voeparse.loads(packet)
+    return run
+
+@stage('convert_coords')
+def convert_coords_benchmark(workdir):
+    import voeparse
+    from pysovo.utils import convert_voe_coords_to_fk5
+    packets = [voeparse.loads(p) for p in sample_packets()]
+    def run():
+        for v in packets:
+            convert_voe_coords_to_fk5(voeparse.pull_astro_coords(v))
+    return run
+
+def _visibility_benchmark(n_sites):
+    def setup(workdir):
+        import pysovo.ephem
+        posn = sample_position()
+        sites = benchmark_sites(n_sites)
+        def run():
+            pysovo.ephem.visibility_reports(posn, sites, benchmark_time)
+        return run
+    return setup
+
+for _n in (1, 10, 100):
+    stage('visibility_%d' % _n)(_visibility_benchmark(_n))
+
+@stage('render')
+def render_benchmark(workdir):
+    import pysovo.ephem
+    import pysovo.reports
+    from pysovo.formatting import datetime_format_long
+    posn = sample_position()
+    site_reports = pysovo.ephem.visibility_reports(posn, benchmark_sites(10),
+                                                   benchmark_time)
+    template = pysovo.reports.get_template('notify_example.txt')
+    def run():
+        template.render(target={'position': posn, 'description': 'Benchmark'},
+                        note_time=benchmark_time,
+                        site_reports=site_reports,
+                        actions_taken=[],
+                        matches=[],
+                        dt_style=datetime_format_long)
+    return run
+
+@stage('archive_write')
+def archive_write_benchmark(workdir, batch=100):
+    """Appends `batch` packets per run."""
+    from pysovo.archive import ArchiveStore
+    store = ArchiveStore(os.path.join(workdir, 'archive'))
+    packets = sample_packets()
+    counter = [0]
+    def run():
+        batch_packets = []
+        for i in range(batch):
+            counter[0] += 1
+            batch_packets.append(('ivo://bench/test#%d' % counter[0],
+                                  packets[i % len(packets)], None))
+        store.append_many(batch_packets)
+    return run
+
+def time_stage(run, repeats, warmup=1):
+    """Per-run timings (seconds) of `run`, after `warmup` untimed runs."""
+    for _ in range(warmup):
+        run()
+    timings = []
+    for _ in range(repeats):
+        start = time.time()
+        run()
+        timings.append(time.time() - start)
+    return timings
+
+def _median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return 0.5 * (values[mid - 1] + values[mid])
+
+def run_suite(names=None, repeats=20, warmup=1):
+    """Time the named stages (default all).
+
+    Returns an OrderedDict of stage name -> {'median', 'min', 'repeats'}.
+    """
+    if names is None:
+        names = stages.keys()
+    unknown = [n for n in names if n not in stages]
+    if unknown:
+        raise ValueError("Unknown benchmark stage(s): " + ', '.join(unknown))
+    results = collections.OrderedDict()
+    workdir = tempfile.mkdtemp()
+    try:
+        for name in names:
+            run = stages[name](workdir)
+            try:
+                timings = time_stage(run, repeats, warmup)
+            finally:
+                if hasattr(run, 'close'):
+                    run.close()
+            results[name] = dict(median=_median(timings), min=min(timings),
+                                 repeats=repeats)
+            logger.debug("%s: median %.3f ms", name,
+                         1e3 * results[name]['median'])
+    finally:
+        shutil.rmtree(workdir)
+    return results
+
+
+def _git(args, repo_dir=None):
+    """Output of a git command run in the repository, or None on failure."""
+    if repo_dir is None:
+        repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git'] + args, cwd=repo_dir,
+                                           stderr=devnull).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def current_commit(repo_dir=None):
+    """Short hash of the checked-out commit, with '-dirty' if there are
+    uncommitted changes; 'unknown' outside a git checkout."""
+    commit = _git(['rev-parse', '--short', 'HEAD'], repo_dir)
+    if commit is None:
+        return 'unknown'
+    if _git(['diff', '--quiet', 'HEAD'], repo_dir) is None:
+        return commit + '-dirty'
+    return commit
+
+def merge_base(branch='main', repo_dir=None):
+    """Full hash of the commit where HEAD branched from `branch`, or None
+    (e.g. if there is no such branch)."""
+    return _git(['merge-base', 'HEAD', branch], repo_dir)
+
+
+def current_machine():
+    """Identifies where results were recorded; timings from different
+    machines are not comparable."""
+    return platform.node()
+
+
+class ResultsStore(object):
+    """Benchmark results saved as one JSON file per commit in `directory`."""
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, commit):
+        return os.path.join(self.directory, commit + '.json')
+
+    def save(self, commit, results):
+        record = dict(commit=commit, time=time.time(),
+                      python=platform.python_version(),
+                      machine=current_machine(), results=results)
+        path = self.path(commit)
+        ensure_dir(path)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(record, f, indent=1)
+        os.rename(path + '.tmp', path)
+
+    def load(self, commit):
+        with open(self.path(commit)) as f:
+            return json.load(f)
+
+    def commits(self):
+        """Saved commits, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        records = [self.load(f[:-len('.json')])
+                   for f in os.listdir(self.directory) if f.endswith('.json')]
+        return [r['commit'] for r in sorted(records, key=lambda r: r['time'])]
+
+    def find(self, commit, machine=None):
+        """Saved results for `commit` (full or abbreviated hash), or None.
+
+        Results from uncommitted changes are ignored, as are those recorded
+        on another machine, if `machine` is given.
+        """
+        for saved in self.commits():
+            if saved.endswith('-dirty'):
+                continue
+            if not (commit.startswith(saved) or saved.startswith(commit)):
+                continue
+            record = self.load(saved)
+            if machine is None or record['machine'] == machine:
+                return record
+        return None
+
+
+Regression = collections.namedtuple('Regression',
+                            'stage baseline current ratio threshold')
+
+def load_thresholds(path):
+    """Per-stage thresholds from a JSON file, e.g. ``{"render": 1.5}``."""
+    return config_store.load(path, thresholds_schema)
+
+def check_regressions(results, baseline, thresholds=None,
+                      default=default_threshold):
+    """Stages whose median time exceeds the baseline's by more than their
+    threshold ratio. Stages missing from the baseline are skipped."""
+    if thresholds is None:
+        thresholds = default_thresholds
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['median'], result['median']
+        threshold = thresholds.get(name, default)
+        if after - before > noise_floor and after > before * threshold:
+            regressions.append(Regression(name, before, after,
+                                          after / before if before else
+                                          float('inf'),
+                                          threshold))
+    return regressions
+
+def format_results(results, baseline=None):
+    lines = ['%-16s %12s %12s %8s' % ('Stage', 'Median (ms)', 'Baseline',
+                                      'Ratio')]
+    for name, result in results.items():
+        line = '%-16s %12.3f' % (name, 1e3 * result['median'])
+        if baseline is not None and name in baseline:
+            before = baseline[name]['median']
+            line += ' %12.3f %8.2f' % (1e3 * before,
+                                       result['median'] / before
+                                       if before else float('inf'))
+        lines.append(line)
+    return '\n'.join(lines)
@@ -1,2 +1,3 @@
 import email
-
+import outbound
+import digest
@@ -0,0 +1,185 @@
+"""
+Coalescing of notifications, to avoid mail storms.
+
+The first notification for a given key (e.g. a trigger ID or stream) goes
+out straight away. Further notifications for that key within the coalescing
+window are held back, then sent together as a single digest when the window
+closes. Each recipient is also subject to a rate limit; anything held back
+by it is merged into that recipient's next digest.
+
+e.g.::
+
+    notifications = NotificationDigester(send, window=120)
+    notifications.add('SWIFT_532871', recipients, subject, body)
+    ...
+    notifications.flush()  #On shutdown
+
+where ``send(recipients, subject, body)`` does the actual sending.
+"""
+
+import collections
+import itertools
+import threading
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+digest_template = 'notify_digest.txt'
+
+
+class Notification(object):
+    __slots__ = ('key', 'subject', 'body', 'received', 'seq')
+    def __init__(self, key, subject, body, received, seq):
+        self.key = key
+        self.subject = subject
+        self.body = body
+        self.received = received
+        self.seq = seq
+
+
+class RateLimit(object):
+    """Allows at most `count` sends in any `period` seconds."""
+    def __init__(self, count, period):
+        self.count = count
+        self.period = period
+        self._sent = collections.deque()
+
+    def next_allowed(self, now):
+        while self._sent and self._sent[0] <= now - self.period:
+            self._sent.popleft()
+        if len(self._sent) < self.count:
+            return now
+        return self._sent[0] + self.period
+
+    def record(self, now):
+        self._sent.append(now)
+
+
+def render_digest(key, notifications):
+    """Return (subject, body) of a digest of several notifications."""
+    import pysovo.reports #Deferred, as it pulls in jinja2
+    template = pysovo.reports.get_template(digest_template)
+    body = template.render(key=key, notifications=notifications)
+    subject = "%s [digest of %d]" % (notifications[-1].subject,
+                                     len(notifications))
+    return subject, body
+
+
+class NotificationDigester(object):
+    """Merges notifications per key and rate-limits them per recipient.
+
+    `window` is the default coalescing window in seconds; it can be
+    overridden per key prefix with `windows`, e.g. ``{'test:': 600}``.
+    `rate_limits` maps recipient to a (count, period) limit, overriding
+    `default_rate_limit`.
+    Pending digests are sent from a background thread as they fall due.
+    """
+    def __init__(self, send, window=60.0, windows=None, rate_limits=None,
+                 default_rate_limit=(20, 3600.0)):
+        self.send = send
+        self.window = window
+        self.windows = dict(windows or {})
+        self.rate_limits = dict(rate_limits or {})
+        self.default_rate_limit = default_rate_limit
+        self.sent = 0
+        self.digests_sent = 0
+        self._seq = itertools.count()
+        self._limiters = {}
+        #(key, recipient) -> [Notification], and -> time of last send:
+        self._pending = {}
+        self._last_sent = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def window_for(self, key):
+        best = None
+        for prefix in self.windows:
+            if key.startswith(prefix) and (best is None
+                                           or len(prefix) > len(best)):
+                best = prefix
+        return self.window if best is None else self.windows[best]
+
+    def add(self, key, recipients, subject, body):
+        """Queue a notification; sent now if neither coalescing nor
+        rate limits hold it back."""
+        now = time.time()
+        with self._cond:
+            n = Notification(key, subject, body, now, next(self._seq))
+            for recipient in recipients:
+                self._pending.setdefault((key, recipient), []).append(n)
+            self._start_thread()
+            self._cond.notify_all()
+        self._send_due(now)
+
+    def pending(self):
+        """Number of (key, recipient) digests waiting to be sent."""
+        with self._cond:
+            return len(self._pending)
+
+    def flush(self):
+        """Send everything pending now, regardless of windows and limits."""
+        self._send_due(time.time(), force=True)
+
+    def _limiter(self, recipient):
+        if recipient not in self._limiters:
+            count, period = self.rate_limits.get(recipient,
+                                                 self.default_rate_limit)
+            self._limiters[recipient] = RateLimit(count, period)
+        return self._limiters[recipient]
+
+    def _due_time(self, key, recipient, now):
+        due = now
+        last = self._last_sent.get((key, recipient))
+        if last is not None:
+            due = max(due, last + self.window_for(key))
+        return max(due, self._limiter(recipient).next_allowed(now))
+
+    def _send_due(self, now, force=False):
+        #Recipients with the same pending notifications share a message:
+        groups = collections.OrderedDict()
+        with self._cond:
+            for (key, recipient), notifications in sorted(self._pending.items()):
+                if not force and self._due_time(key, recipient, now) > now:
+                    continue
+                del self._pending[(key, recipient)]
+                self._last_sent[(key, recipient)] = now
+                self._limiter(recipient).record(now)
+                group = (key, tuple(n.seq for n in notifications))
+                groups.setdefault(group, (notifications, []))[1].append(recipient)
+            for pair, last in self._last_sent.items():
+                if (pair not in self._pending
+                        and now - last >= self.window_for(pair[0])):
+                    del self._last_sent[pair]
+        for (key, _), (notifications, recipients) in groups.items():
+            if len(notifications) == 1:
+                subject, body = notifications[0].subject, notifications[0].body
+            else:
+                subject, body = render_digest(key, notifications)
+                self.digests_sent += 1
+            self.sent += 1
+            try:
+                self.send(recipients, subject, body)
+            except Exception:
+                logger.exception("Error sending notification for %s", key)
+
+    def _next_due(self, now):
+        with self._cond:
+            times = [self._due_time(key, recipient, now)
+                     for key, recipient in self._pending]
+        return min(times) if times else None
+
+    def _start_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='digest')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.time()
+                due = self._next_due(now)
+                if due is None or due > now:
+                    self._cond.wait(None if due is None else due - now)
+                    continue
+            self._send_due(now)
@@ -7,9 +7,16 @@ import os
 import sys
 import getpass
 import smtplib
+import socket
 import base64
+import atexit
+import threading
+import time
+import logging
+logger = logging.getLogger(__name__)
 
 import pysovo as ps
+from pysovo.tracing import tracer
 
 
 class EmailConfigKeys():
@@ -69,51 +76,208 @@ def prompt_for_config(config_filename=ps.default_email_config_file):
     return config_filename
 
 def load_account_settings_from_file(config_filename=ps.default_email_config_file):
-    #print "Loading email acc from ", config_filename
+    """Return the account settings, cached until the file changes."""
+    from pysovo.config import store, email_account_schema
     try:
-        with open(config_filename, 'r') as config_file:
-            account = json.loads(config_file.read())
+        return dict(store.load(config_filename, email_account_schema))
     except Exception:
         print "Error: Could not load email account from " + config_filename
         raise
 
-    return account
+class SMTPConnectionPool(object):
+    """Holds one authenticated SMTP session open per account, for reuse.
+
+    Sessions are keyed by (server, port, username). A session that has been
+    idle for longer than `keepalive_interval` seconds is checked with a NOOP
+    before use; sessions idle longer than `max_idle` seconds, or that fail
+    the NOOP or a send, are transparently reconnected. After `max_messages`
+    messages a session is recycled.
+
+    Nothing NOOPs idle sessions unless :meth:`start_keepalive` is called (as
+    in daemon mode), so without it alerts arriving more than `max_idle`
+    seconds apart each pay for a fresh connect, STARTTLS and LOGIN.
+
+    If `require_tls` is False, STARTTLS and LOGIN are only attempted if
+    the server advertises them (useful for local test servers).
+    """
+    def __init__(self, keepalive_interval=60, max_idle=300, max_messages=100,
+                 require_tls=True, timeout=30):
+        self.keepalive_interval = keepalive_interval
+        self.max_idle = max_idle
+        self.max_messages = max_messages
+        self.require_tls = require_tls
+        self.timeout = timeout
+        self.connections_opened = 0
+        self._sessions = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._keepalive_thread = None
+        self._stop_keepalive = threading.Event()
+
+    @staticmethod
+    def account_key(account):
+        return (account[keys.smtp_server], int(account[keys.smtp_port]),
+                account[keys.username])
+
+    def sendmail(self, account, sender, recipient_addresses, msg):
+        """Send `msg` using a pooled session, reconnecting once if needed."""
+        key = self.account_key(account)
+        with self._account_lock(key):
+            session = self._checkout(key, account)
+            try:
+                with tracer.span('smtp_sendmail'):
+                    session.conn.sendmail(sender, recipient_addresses, msg)
+            except (smtplib.SMTPServerDisconnected, socket.error):
+                self._discard(key)
+                session = self._checkout(key, account)
+                with tracer.span('smtp_sendmail'):
+                    session.conn.sendmail(sender, recipient_addresses, msg)
+            session.messages_sent += 1
+            session.last_used = time.time()
+            if session.messages_sent >= self.max_messages:
+                self._discard(key)
+
+    def keepalive(self):
+        """NOOP every session idle for longer than `keepalive_interval`,
+        dropping any that fail to respond."""
+        for key in list(self._sessions.keys()):
+            with self._account_lock(key):
+                session = self._sessions.get(key)
+                if session is None:
+                    continue
+                if time.time() - session.last_used < self.keepalive_interval:
+                    continue
+                if self._alive(session):
+                    session.last_used = time.time()
+                else:
+                    self._discard(key)
+
+    def start_keepalive(self):
+        """Run :meth:`keepalive` every `keepalive_interval` seconds from a
+        background thread, until :meth:`close_all`."""
+        with self._lock:
+            if self._keepalive_thread is not None:
+                return
+            self._stop_keepalive.clear()
+            self._keepalive_thread = threading.Thread(
+                                target=self._run_keepalive, name='smtp-keepalive')
+            self._keepalive_thread.daemon = True
+            self._keepalive_thread.start()
+
+    def _run_keepalive(self):
+        while not self._stop_keepalive.wait(self.keepalive_interval):
+            try:
+                self.keepalive()
+            except Exception:
+                logger.exception("Error in SMTP keepalive")
+
+    def close_all(self):
+        with self._lock:
+            thread, self._keepalive_thread = self._keepalive_thread, None
+        if thread is not None:
+            self._stop_keepalive.set()
+            thread.join()
+        for key in list(self._sessions.keys()):
+            with self._account_lock(key):
+                self._discard(key)
+
+    def _account_lock(self, key):
+        with self._lock:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
+
+    def _checkout(self, key, account):
+        session = self._sessions.get(key)
+        if session is not None:
+            idle = time.time() - session.last_used
+            if idle > self.max_idle:
+                self._discard(key)
+                session = None
+            elif idle > self.keepalive_interval and not self._alive(session):
+                self._discard(key)
+                session = None
+        if session is None:
+            session = _SMTPSession(self._connect(account))
+            self._sessions[key] = session
+        return session
+
+    def _connect(self, account):
+        with tracer.span('smtp_connect'):
+            conn = smtplib.SMTP(account[keys.smtp_server],
+                                account[keys.smtp_port],
+                                timeout=self.timeout)
+            self.connections_opened += 1
+            code, _ = conn.ehlo()
+            if code != 250:
+                conn.helo()
+        if self.require_tls or conn.has_extn('starttls'):
+            with tracer.span('smtp_starttls'):
+                conn.starttls()
+                conn.ehlo()
+        if self.require_tls or conn.has_extn('auth'):
+            with tracer.span('smtp_login'):
+                conn.login(account[keys.username],
+                           base64.b64decode(account[keys.password]))
+        return conn
+
+    @staticmethod
+    def _alive(session):
+        try:
+            code, _ = session.conn.noop()
+        except (smtplib.SMTPException, socket.error):
+            return False
+        return code == 250
+
+    def _discard(self, key):
+        session = self._sessions.pop(key, None)
+        if session is None:
+            return
+        try:
+            session.conn.quit()
+        except (smtplib.SMTPException, socket.error):
+            session.conn.close()
+
+
+class _SMTPSession(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.messages_sent = 0
+        self.last_used = time.time()
+
+
+default_pool = SMTPConnectionPool()
+atexit.register(default_pool.close_all)
 
 def send_email(account,
                 recipient_addresses,
                 subject,
                 body_text,
-                verbose=False
+                verbose=False,
+                pool=None
                 ):
-    if verbose:
-        print "Loaded account, starting SMTP session"
+    """Send a plain-text email, reusing a pooled SMTP session.
 
-    recipient_addresses = ps.utils.listify(recipient_addresses)
-
-    smtpserver = smtplib.SMTP(account[keys.smtp_server],
-                              account[keys.smtp_port])
-    smtpserver.ehlo()
-    smtpserver.starttls()
-    smtpserver.ehlo
-    smtpserver.login(account[keys.username],
-                     base64.b64decode(account[keys.password]))
+    Uses the module-level `default_pool` unless another is supplied.
+    """
+    if pool is None:
+        pool = default_pool
 
+    recipient_addresses = ps.utils.listify(recipient_addresses)
     sender = account[keys.username]
 
     recipients_str = ",".join(recipient_addresses)
     if verbose:
-        print "Logged in, emailing", recipients_str
+        print "Emailing", recipients_str
     header = "".join(['To: ', recipients_str, '\n',
                         'From: ', sender, '\n',
                         'Subject: ', subject, '\n'])
 
     msg = "".join([header, '\n',
                     body_text, '\n\n'])
-    smtpserver.sendmail(sender, recipient_addresses, msg)
+    pool.sendmail(account, sender, recipient_addresses, msg)
     if verbose:
         print 'Message sent'
-    smtpserver.close()
-    pass
 
 def dummy_email_send_function(account,
                 recipient_addresses,
@@ -0,0 +1,179 @@
+"""
+A prioritized queue for outbound messages (emails, SMS, observation requests).
+
+Sends are run by a small pool of worker threads, so a slow or hung server on
+one path (e.g. notification email) never holds up another (e.g. a telescope
+request) or the caller. Failed sends are retried with exponential backoff.
+"""
+
+import itertools
+import threading
+import Queue
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+from pysovo.tracing import tracer
+
+
+class Priority():
+    """Lower values are sent first."""
+    telescope = 0
+    notification = 10
+    sms = 10
+
+
+class DispatchHandle(object):
+    """Returned by :meth:`OutboundQueue.submit`; wait on or poll the send."""
+    def __init__(self, description):
+        self.description = description
+        self.attempts = 0
+        self.exception = None
+        self._result = None
+        self._done = threading.Event()
+
+    def done(self):
+        return self._done.is_set()
+
+    def succeeded(self):
+        return self.done() and self.exception is None
+
+    def wait(self, timeout=None):
+        """Block until the send completes or finally fails.
+
+        Returns True if finished, False on timeout.
+        """
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Return the send function's result, re-raising any final error."""
+        if not self.wait(timeout):
+            raise RuntimeError("Timed out waiting for " + self.description)
+        if self.exception is not None:
+            raise self.exception
+        return self._result
+
+    def _finish(self, result=None, exception=None):
+        self._result = result
+        self.exception = exception
+        self._done.set()
+
+
+class _Job(object):
+    def __init__(self, func, args, kwargs, priority, retries, handle,
+                 callback):
+        #Sends are traced against the packet that caused them:
+        self.trace_id = tracer.current_trace()
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.retries = retries
+        self.handle = handle
+        self.callback = callback
+
+
+class OutboundQueue(object):
+    """Runs submitted send functions on worker threads, in priority order.
+
+    Each job is attempted up to ``1 + retries`` times; the n'th retry waits
+    ``backoff * 2**(n-1)`` seconds (capped at `max_backoff`) before being
+    re-queued, without occupying a worker in the meantime.
+    """
+    def __init__(self, workers=4, retries=3, backoff=2.0, max_backoff=60.0):
+        self.n_workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._queue = Queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._workers = []
+        self._outstanding = 0
+        self._cond = threading.Condition()
+
+    def submit(self, func, args=(), kwargs=None, priority=Priority.notification,
+               retries=None, description=None, callback=None):
+        """Queue ``func(*args, **kwargs)`` for sending.
+
+        Returns a :class:`DispatchHandle`. If given, ``callback(handle)`` is
+        called once the send has succeeded or finally failed.
+        """
+        if retries is None:
+            retries = self.retries
+        if description is None:
+            description = getattr(func, '__name__', repr(func))
+        handle = DispatchHandle(description)
+        job = _Job(func, args, kwargs or {}, priority, retries, handle,
+                   callback)
+        with self._cond:
+            self._outstanding += 1
+            self._start_workers()
+        self._put(job)
+        return handle
+
+    def pending(self):
+        """Number of jobs submitted but not yet finished."""
+        with self._cond:
+            return self._outstanding
+
+    def join(self, timeout=None):
+        """Wait until every submitted job has finished (or finally failed).
+
+        Returns True if the queue drained, False on timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._outstanding:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _put(self, job):
+        self._queue.put((job.priority, next(self._seq), job))
+
+    def _start_workers(self):
+        while len(self._workers) < self.n_workers:
+            t = threading.Thread(target=self._work,
+                                 name='outbound-%d' % len(self._workers))
+            t.daemon = True
+            t.start()
+            self._workers.append(t)
+
+    def _work(self):
+        while True:
+            _, _, job = self._queue.get()
+            self._attempt(job)
+
+    def _attempt(self, job):
+        handle = job.handle
+        handle.attempts += 1
+        try:
+            with tracer.trace(job.trace_id), tracer.span('outbound_send'):
+                result = job.func(*job.args, **job.kwargs)
+        except Exception as e:
+            if handle.attempts <= job.retries:
+                delay = min(self.backoff * 2 ** (handle.attempts - 1),
+                            self.max_backoff)
+                logger.warn("Send '%s' failed (attempt %d), retrying in %.1fs: %s",
+                            handle.description, handle.attempts, delay, e)
+                timer = threading.Timer(delay, self._put, (job,))
+                timer.daemon = True
+                timer.start()
+                return
+            logger.error("Send '%s' failed after %d attempts: %s",
+                         handle.description, handle.attempts, e)
+            handle._finish(exception=e)
+        else:
+            handle._finish(result=result)
+        if job.callback is not None:
+            try:
+                job.callback(handle)
+            except Exception:
+                logger.exception("Error in callback for '%s'",
+                                 handle.description)
+        with self._cond:
+            self._outstanding -= 1
+            self._cond.notify_all()
@@ -1,38 +1,37 @@
-"""A few subroutines written to interface with the SMS API.
-Currently not in use and so un-maintained,
-but I think it should all basically still work.
+"""Sending SMS alerts via the TextMagic HTTP API.
+
+A shared :class:`SMSClient` per account holds a keep-alive connection and
+batches recipients / message IDs into as few requests as possible.
+:class:`DeliveryTracker` polls delivery status in the background and
+escalates texts that are not delivered.
 """
-import simplejson as json
+import json
 import os
 import sys
 import getpass
-import warnings
-
+import threading
 import time
-import glob
 import httplib
 import urllib
+import urlparse
+import logging
+logger = logging.getLogger(__name__)
 
 import pysovo.utils as utils
 
 default_sms_config_file = "".join((os.environ['HOME'], "/.pysovo/sms_acc"))
 
+default_api_url = "https://www.textmagic.com/app/api"
+
 class SMSConfigKeys():
     user = 'username'
     pw = 'api_password'
+    #Optional, e.g. to point at a local stand-in for testing:
+    api_url = 'api_url'
 
 keys = SMSConfigKeys()
 
 
-try:
-    import textmagic
-    import textmagic.client
-    sms_available = True
-except ImportError:
-    warnings.warn("NB textmagic not found, SMS alerts not available.", ImportWarning)
-    sms_available = False
-
-
 # http://api.textmagic.com/https-api/sms-delivery-notification-codes
 delivery_status_key = {
                      'q': 'Queued',
@@ -70,22 +69,136 @@ def prompt_for_config(config_filename=default_sms_config_file):
     return config_filename
 
 def load_account_settings_from_file(config_filename=default_sms_config_file):
-    if sms_available:
-        try:
-            with open(config_filename, 'r') as config_file:
-                account = json.loads(config_file.read())
-        except Exception:
-            print "Error: Could not load email account from " + config_filename
-            raise
-        return account
-    else:
-        return None
+    """Return the account settings, cached until the file changes."""
+    from pysovo.config import store, sms_account_schema
+    try:
+        return dict(store.load(config_filename, sms_account_schema))
+    except Exception:
+        print "Error: Could not load SMS account from " + config_filename
+        raise
+
+
+class SMSError(Exception):
+    """An error response from the SMS API."""
+    def __init__(self, code, message):
+        Exception.__init__(self, "SMS API error %s: %s" % (code, message))
+        self.code = code
+
+
+class SMSClient(object):
+    """Client for the TextMagic HTTP API, reusing one keep-alive connection.
+
+    Calls taking many recipients or message IDs are split into batches of
+    at most `batch_size` per request. The client is thread-safe; requests
+    are serialized over its connection.
+    """
+    def __init__(self, username, api_password, api_url=default_api_url,
+                 batch_size=100, timeout=30):
+        self.username = username
+        self.api_password = api_password
+        self.api_url = api_url
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.requests = 0
+        self.connections_opened = 0
+        url = urlparse.urlsplit(api_url)
+        self._conn_class = (httplib.HTTPSConnection if url.scheme == 'https'
+                            else httplib.HTTPConnection)
+        self._netloc = url.netloc
+        self._path = url.path or '/'
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def call(self, cmd, **params):
+        """Make one API request, returning the decoded JSON response."""
+        params.update(username=self.username, password=self.api_password,
+                      cmd=cmd)
+        body = urllib.urlencode(sorted(params.items()))
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        with self._lock:
+            for attempt in (0, 1):
+                reused = self._conn is not None
+                if not reused:
+                    self._conn = self._conn_class(self._netloc,
+                                                  timeout=self.timeout)
+                    self.connections_opened += 1
+                sent = False
+                try:
+                    self._conn.request('POST', self._path, body, headers)
+                    sent = True
+                    response = self._conn.getresponse()
+                    data = response.read()
+                    break
+                except (httplib.HTTPException, IOError) as e:
+                    self.close_connection()
+                    #Retry once on a fresh connection if the server had
+                    #closed our idle one. Anything else (e.g. a timeout
+                    #awaiting the reply) may have been acted on, and
+                    #must not be sent twice:
+                    stale = reused and (not sent or
+                                        isinstance(e, httplib.BadStatusLine))
+                    if attempt or not stale:
+                        raise
+            self.requests += 1
+        if response.status != 200:
+            raise SMSError(response.status, response.reason)
+        result = json.loads(data)
+        if 'error_code' in result:
+            raise SMSError(result['error_code'], result.get('error_message'))
+        return result
+
+    def send(self, text, phones):
+        """Send `text` to each phone number; returns {message_id: phone}."""
+        phones = utils.listify(phones)
+        message_ids = {}
+        for batch in self._batches(phones):
+            result = self.call('send', text=text.encode('utf-8'),
+                               phone=','.join(batch))
+            message_ids.update(result['message_id'])
+        return message_ids
+
+    def message_status(self, message_ids):
+        """Returns {message_id: status record} for the given IDs."""
+        statuses = {}
+        for batch in self._batches(list(message_ids)):
+            statuses.update(self.call('message_status', ids=','.join(batch)))
+        return statuses
+
+    def balance(self):
+        return self.call('account')['balance']
+
+    def close_connection(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _batches(self, items):
+        for i in range(0, len(items), self.batch_size):
+            yield items[i:i + self.batch_size]
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def client_for(account):
+    """A shared :class:`SMSClient` for an account settings dict."""
+    key = (account[keys.user], account[keys.pw],
+           account.get(keys.api_url, default_api_url))
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = SMSClient(*key)
+        return _clients[key]
+
 
 def send_sms(account,
                 recipients,
                 body_text,
                 debug=False
                 ):
+    """Send one text to all recipients, in as few API calls as possible.
+
+    Returns the list of message IDs.
+    """
     if debug:
         print "Loaded account, starting SMS session"
         if len(body_text) > 155:
@@ -93,21 +206,11 @@ def send_sms(account,
 
     body_text = body_text[:160]
 
-    client = textmagic.client.TextMagicClient(
-                  account[keys.sms_account.username],
-                  account[keys.sms_account.api_password])
-
-    result = client.send(body_text, recipients)
-
-    message_ids = result['message_id'].keys()
-    return message_ids
+    message_ids = client_for(account).send(body_text, recipients)
+    return message_ids.keys()
 
 def check_sms_statuses(account, message_ids):
-    client = textmagic.client.TextMagicClient(
-                  account[keys.user],
-                  account[keys.pw])
-
-    responses = client.message_status(message_ids)
+    responses = client_for(account).message_status(message_ids)
     delivery_status_codes = [ responses[id]['status'] for id in message_ids]
 
     delivery_statuses = []
@@ -120,17 +223,130 @@ def check_sms_statuses(account, message_ids):
     return zip(message_ids, delivery_status_codes, delivery_statuses)
 
 
-
-
 def check_sms_balance(account, debug=False):
-    client = textmagic.client.TextMagicClient(
-                      account[keys.user],
-                      account[keys.pw])
-
-    balance = client.account()['balance']
+    balance = client_for(account).balance()
     if debug:
         print "Balance is:", balance
 
     return balance
 
 
+delivered_codes = frozenset('d')
+failed_codes = frozenset('ef')
+
+class TrackedMessage(object):
+    __slots__ = ('message_id', 'phone', 'text', 'sent_at', 'status',
+                 'escalated')
+    def __init__(self, message_id, phone, text, sent_at):
+        self.message_id = message_id
+        self.phone = phone
+        self.text = text
+        self.sent_at = sent_at
+        self.status = 'q'
+        self.escalated = False
+
+
+class DeliveryTracker(object):
+    """Sends texts and polls their delivery status in the background.
+
+    All undelivered messages are checked in a single status call every
+    `poll_interval` seconds. A message that fails, or is still not
+    delivered `escalate_after` seconds after sending, is passed to
+    `escalate(message)` (e.g. to fall back to email) and no longer tracked.
+    """
+    def __init__(self, client, escalate=None, poll_interval=30.0,
+                 escalate_after=600.0):
+        self.client = client
+        self.escalate = escalate
+        self.poll_interval = poll_interval
+        self.escalate_after = escalate_after
+        self.delivered = 0
+        self.escalated = 0
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def send(self, text, phones):
+        """Send `text` to each of `phones` and track delivery.
+
+        Returns the list of :class:`TrackedMessage`.
+        """
+        text = text[:160]
+        message_ids = self.client.send(text, phones)
+        now = time.time()
+        messages = [TrackedMessage(id, phone, text, now)
+                    for id, phone in message_ids.items()]
+        with self._cond:
+            for m in messages:
+                self._pending[m.message_id] = m
+            self._start_thread()
+        return messages
+
+    def pending(self):
+        with self._cond:
+            return len(self._pending)
+
+    def poll(self):
+        """Check all pending messages now; returns the number still pending."""
+        with self._cond:
+            pending = dict(self._pending)
+        if not pending:
+            return 0
+        try:
+            statuses = self.client.message_status(pending.keys())
+        except Exception:
+            logger.exception("SMS status poll failed")
+            statuses = {}
+        now = time.time()
+        escalations = []
+        with self._cond:
+            for message_id, message in pending.items():
+                record = statuses.get(message_id)
+                if record is not None:
+                    message.status = record['status']
+                if message.status in delivered_codes:
+                    self.delivered += 1
+                elif (message.status in failed_codes or
+                        now - message.sent_at >= self.escalate_after):
+                    message.escalated = True
+                    self.escalated += 1
+                    escalations.append(message)
+                else:
+                    continue
+                del self._pending[message_id]
+            remaining = len(self._pending)
+        for message in escalations:
+            logger.warn("SMS %s to %s not delivered (%s), escalating",
+                        message.message_id, message.phone,
+                        delivery_status_key.get(message.status, message.status))
+            if self.escalate is not None:
+                try:
+                    self.escalate(message)
+                except Exception:
+                    logger.exception("Error escalating SMS %s",
+                                     message.message_id)
+        return remaining
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _start_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,
+                                            name='sms-tracker')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopped:
+                    self._cond.wait(self.poll_interval)
+                if self._stopped:
+                    return
+            self.poll()
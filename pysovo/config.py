@@ -0,0 +1,213 @@
+"""
+Cached, validated access to the JSON config files (contacts, accounts).
+
+Each file is parsed once and held in memory. On access the file is
+re-checked with a cheap ``os.stat`` (at most every `check_interval`
+seconds), and re-loaded if its modification time or size has changed, so a
+long-running process picks up edits without a restart. A new version that
+fails to parse or validate is logged and ignored; the last good version
+stays in use.
+
+e.g.::
+
+    contacts = store.view(contacts_file, contacts_schema)
+    contacts['tim']['email']  #Always the current version of the file
+"""
+
+import os
+import json
+import threading
+import time
+import collections
+import logging
+logger = logging.getLogger(__name__)
+
+
+class ConfigError(ValueError):
+    pass
+
+
+class Optional(object):
+    """Marks a key in a dict schema as optional."""
+    def __init__(self, schema):
+        self.schema = schema
+
+#Key in a dict schema that applies to the value of every key:
+any_key = '*'
+
+string = basestring
+
+_no_default = object()
+
+def validate(value, schema, where='config'):
+    """Check `value` against `schema`, raising ConfigError if it fails.
+
+    A schema is a type (or tuple of types) to check with isinstance; a
+    one-element list, for a list of that schema; a dict mapping keys to
+    schemas, for a dict with at least those keys; or a tuple of any of
+    these, as alternatives. Keys may be wrapped in :class:`Optional`, and
+    the key ``any_key`` applies to every entry.
+    """
+    if isinstance(schema, tuple) and not all(isinstance(s, type)
+                                             for s in schema):
+        for alternative in schema:
+            try:
+                return validate(value, alternative, where)
+            except ConfigError:
+                pass
+        raise ConfigError("%s: unexpected value %r" % (where, value))
+    if isinstance(schema, dict):
+        if not isinstance(value, dict):
+            raise ConfigError("%s: expected a mapping" % where)
+        for key, sub_schema in schema.items():
+            if key == any_key:
+                for k, v in value.items():
+                    validate(v, sub_schema, '%s[%r]' % (where, k))
+                continue
+            optional = isinstance(key, Optional)
+            if optional:
+                key = key.schema
+            if key not in value:
+                if optional:
+                    continue
+                raise ConfigError("%s: missing key %r" % (where, key))
+            validate(value[key], sub_schema, '%s[%r]' % (where, key))
+    elif isinstance(schema, list):
+        if not isinstance(value, list):
+            raise ConfigError("%s: expected a list" % where)
+        for i, v in enumerate(value):
+            validate(v, schema[0], '%s[%d]' % (where, i))
+    elif not isinstance(value, schema):
+        raise ConfigError("%s: unexpected type %s" % (where,
+                                                      type(value).__name__))
+
+
+email_account_schema = {'username': string,
+                        'password': string,
+                        'smtp_server': string,
+                        'smtp_port': (int, string)}
+
+sms_account_schema = {'username': string,
+                      'api_password': string}
+
+contacts_schema = {any_key: {Optional('email'): (string, [string]),
+                             Optional('mobile'): string}}
+
+
+class ConfigFile(object):
+    """A JSON file, parsed once and re-loaded when it changes on disk."""
+    def __init__(self, path, schema=None, check_interval=2.0):
+        self.path = path
+        self.schema = schema
+        self.check_interval = check_interval
+        self.loads = 0
+        self._value = None
+        self._loaded = False
+        self._signature = False #i.e. never checked
+        self._last_check = None
+        self._lock = threading.Lock()
+
+    def get(self, default=_no_default):
+        """The current contents of the file.
+
+        If the file has never loaded successfully, returns `default` if
+        given, else raises ConfigError.
+        """
+        now = time.time()
+        with self._lock:
+            if (self._last_check is None
+                    or now - self._last_check >= self.check_interval):
+                self._last_check = now
+                self._check()
+            if not self._loaded:
+                if default is not _no_default:
+                    return default
+                raise ConfigError("Could not load " + self.path)
+            return self._value
+
+    def reload(self):
+        """Re-check the file now, rather than waiting for `check_interval`."""
+        with self._lock:
+            self._last_check = time.time()
+            self._check()
+
+    def _check(self):
+        try:
+            st = os.stat(self.path)
+            signature = (st.st_mtime, st.st_size, st.st_ino)
+        except OSError as e:
+            signature = None
+            error = e
+        if signature == self._signature:
+            return
+        self._signature = signature
+        try:
+            if signature is None:
+                raise error
+            with open(self.path) as f:
+                value = json.load(f)
+            if self.schema is not None:
+                validate(value, self.schema, os.path.basename(self.path))
+        except Exception as e:
+            if self._loaded:
+                logger.error("Ignoring new version of %s, keeping the "
+                             "previous one; reason:\n%s", self.path, e)
+            else:
+                logger.warn("Could not load %s; reason:\n%s", self.path, e)
+            return
+        self._value = value
+        self._loaded = True
+        self.loads += 1
+        logger.debug("Loaded %s", self.path)
+
+
+class ConfigView(collections.Mapping):
+    """Read-only mapping onto the current contents of a ConfigFile.
+
+    If `default` is given it stands in while the file cannot be loaded.
+    """
+    def __init__(self, config_file, default=_no_default):
+        self.config_file = config_file
+        self.default = default
+
+    def current(self):
+        return self.config_file.get(self.default)
+
+    def __getitem__(self, key):
+        return self.current()[key]
+
+    def __iter__(self):
+        return iter(self.current())
+
+    def __len__(self):
+        return len(self.current())
+
+    def __repr__(self):
+        return 'ConfigView(%r)' % self.config_file.path
+
+
+class ConfigStore(object):
+    """One ConfigFile per path, shared by everything that reads it."""
+    def __init__(self, check_interval=2.0):
+        self.check_interval = check_interval
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def file(self, path, schema=None):
+        path = os.path.abspath(path)
+        with self._lock:
+            if path not in self._files:
+                self._files[path] = ConfigFile(path, schema,
+                                               self.check_interval)
+            return self._files[path]
+
+    def load(self, path, schema=None):
+        """The current contents of `path` (raises if it cannot be loaded)."""
+        return self.file(path, schema).get()
+
+    def view(self, path, schema=None, default=_no_default):
+        return ConfigView(self.file(path, schema), default)
+
+
+#Default, shared store:
+store = ConfigStore()
@@ -0,0 +1,250 @@
+"""
+In-memory cross-matching of alert positions against earlier alerts.
+
+Positions are held as unit vectors in a k-d tree (scipy's cKDTree), so a
+cone search costs microseconds however many positions are indexed. New
+positions go into a buffer that is searched by brute force, and merged
+into the tree once it outgrows `rebuild_threshold` (or an eighth of the
+tree, if larger).
+
+Positions can also be recorded in a JSON-lines log, one line per position,
+so they are reloaded without parsing the packets again (see
+:meth:`PositionIndex.open_log`; :func:`load_archive` seeds one from an
+archive).
+
+e.g.::
+
+    index = PositionIndex()
+    index.open_log(path)
+    matches = index.query(posn)   #posn: FK5Coordinates with errors
+    index.add(ivorn, posn)
+"""
+
+import os
+import json
+import collections
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+import numpy
+import scipy.spatial
+
+from pysovo.utils import ensure_dir
+
+#Used where a position has no error:
+default_error_radius = 0.0
+
+
+class Match(collections.namedtuple('Match',
+                                   'ivorn label ra dec error separation')):
+    """An indexed position within the error circle of a query.
+
+    ra, dec, error and separation are in degrees.
+    """
+    __slots__ = ()
+
+
+def _unit_vectors(ra, dec):
+    ra_r = numpy.radians(ra)
+    dec_r = numpy.radians(dec)
+    return numpy.column_stack((numpy.cos(dec_r) * numpy.cos(ra_r),
+                               numpy.cos(dec_r) * numpy.sin(ra_r),
+                               numpy.sin(dec_r)))
+
+def _chord(angle_deg):
+    """Straight-line distance between unit vectors `angle_deg` apart."""
+    return 2 * numpy.sin(numpy.radians(numpy.minimum(angle_deg, 180.0)) / 2)
+
+def _angle(chord):
+    return numpy.degrees(2 * numpy.arcsin(numpy.clip(chord / 2, 0, 1)))
+
+def error_radius(posn):
+    """Error radius (deg) of FK5Coordinates: the larger of the RA and Dec
+    errors, or `default_error_radius` if they are not set."""
+    errors = [e.degrees for e in (posn.raerr, posn.decerr) if e is not None]
+    return max(errors) if errors else default_error_radius
+
+
+class PositionIndex(object):
+    """Spatial index of (ivorn, position, error radius) entries.
+
+    A query matches every entry whose error circle overlaps the query's,
+    i.e. separation <= query error + entry error. `label` is free text,
+    e.g. the name of a known repeating source.
+    """
+    def __init__(self, rebuild_threshold=1000):
+        self.rebuild_threshold = rebuild_threshold
+        self._ivorns = []
+        self._labels = []
+        self._ra = []
+        self._dec = []
+        self._errors = []
+        self._vectors = []
+        self._tree = None
+        self._n_tree = 0
+        self._max_error = 0.0
+        self._log = None
+        self._log_path = None
+        self._log_offset = 0
+        self._logged = set()    #IVORNs read from, or written to, the log
+        self._torn = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ivorns)
+
+    def add(self, ivorn, posn, label=None):
+        """Index FK5Coordinates `posn`."""
+        self.add_radec(ivorn, posn.ra.degrees, posn.dec.degrees,
+                       error_radius(posn), label)
+
+    def add_radec(self, ivorn, ra, dec, error=default_error_radius,
+                  label=None):
+        with self._lock:
+            self._insert(ivorn, ra, dec, error, label)
+            if self._log_path is not None:
+                self._write(dict(ivorn=ivorn, ra=ra, dec=dec, error=error,
+                                 label=label))
+
+    def open_log(self, path):
+        """Index the positions recorded in JSON-lines file `path`, if it
+        exists, then append there each position added from now on.
+
+        Returns the number of positions loaded.
+        """
+        with self._lock:
+            self._log_path = path
+            self._log_offset = 0
+            n_loaded, self._torn = self._read_log()
+        logger.info("Loaded %d alert positions from %s", n_loaded, path)
+        return n_loaded
+
+    def refresh(self):
+        """Index positions appended to the log by other processes since it
+        was opened (or last refreshed). Returns the number indexed."""
+        with self._lock:
+            if self._log_path is None:
+                return 0
+            return self._read_log()[0]
+
+    def close_log(self):
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+            self._log = None
+            self._log_path = None
+
+    def _read_log(self):
+        """Index complete lines from the log, past those already read.
+
+        Returns (number indexed, whether a partial last line was left).
+        """
+        if not os.path.exists(self._log_path):
+            return 0, False
+        with open(self._log_path, 'rb') as f:
+            f.seek(self._log_offset)
+            lines = f.read().split('\n')
+        partial = lines.pop()
+        n_indexed = 0
+        for line in lines:
+            self._log_offset += len(line) + 1
+            if not line:
+                continue
+            try:
+                p = json.loads(line)
+                if p['ivorn'] in self._logged:
+                    continue
+                self._insert(p['ivorn'], p['ra'], p['dec'], p['error'],
+                             p.get('label'))
+                self._logged.add(p['ivorn'])
+                n_indexed += 1
+            except (ValueError, KeyError, TypeError) as e:
+                #e.g. a line cut short by a crash
+                logger.warn("Skipping bad line in %s: %s", self._log_path, e)
+        return n_indexed, bool(partial)
+
+    def _write(self, position):
+        if self._log is None:
+            ensure_dir(self._log_path)
+            self._log = open(self._log_path, 'a')
+            if self._torn:
+                self._log.write('\n')
+                self._torn = False
+        #One write per line, so lines appended by several (forked) processes
+        #sharing the file are not interleaved:
+        self._log.write(json.dumps(position) + '\n')
+        self._log.flush()
+        self._logged.add(position['ivorn'])
+
+    def _insert(self, ivorn, ra, dec, error, label):
+        self._ivorns.append(ivorn)
+        self._labels.append(label)
+        self._ra.append(ra)
+        self._dec.append(dec)
+        self._errors.append(error)
+        self._vectors.append(_unit_vectors([ra], [dec])[0])
+        self._max_error = max(self._max_error, error)
+        #Rebuilding in proportion to the tree size keeps bulk loading
+        #O(n log n) overall, and the brute-force buffer small:
+        buffered = len(self._ivorns) - self._n_tree
+        if buffered > max(self.rebuild_threshold, self._n_tree // 8):
+            self._tree = scipy.spatial.cKDTree(numpy.array(self._vectors))
+            self._n_tree = len(self._ivorns)
+
+    def query(self, posn, exclude=()):
+        """Matches for FK5Coordinates `posn`, nearest first.
+
+        IVORNs in `exclude` (e.g. the packet itself) are skipped.
+        """
+        return self.query_radec(posn.ra.degrees, posn.dec.degrees,
+                                error_radius(posn), exclude)
+
+    def query_radec(self, ra, dec, error=default_error_radius, exclude=()):
+        target = _unit_vectors([ra], [dec])[0]
+        with self._lock:
+            search_chord = _chord(error + self._max_error)
+            candidates = []
+            if self._tree is not None:
+                candidates.extend(self._tree.query_ball_point(target,
+                                                              search_chord))
+            if len(self._vectors) > self._n_tree:
+                buffered = numpy.array(self._vectors[self._n_tree:])
+                dist = numpy.sqrt(((buffered - target) ** 2).sum(axis=1))
+                candidates.extend(self._n_tree +
+                                  numpy.nonzero(dist <= search_chord)[0])
+            matches = []
+            for i in candidates:
+                if self._ivorns[i] in exclude:
+                    continue
+                chord = numpy.sqrt(((self._vectors[i] - target) ** 2).sum())
+                separation = float(_angle(chord))
+                if separation <= error + self._errors[i]:
+                    matches.append(Match(self._ivorns[i], self._labels[i],
+                                         self._ra[i], self._dec[i],
+                                         self._errors[i], separation))
+        return sorted(matches, key=lambda m: m.separation)
+
+
+def load_archive(index, store, stream=None):
+    """Index the position of each packet in an ArchiveStore.
+
+    This parses every packet, so is slow for a large archive; use it once,
+    to seed a position log (see :meth:`PositionIndex.open_log`).
+
+    Packets without a parseable FK5 position are skipped.
+    Returns the number indexed.
+    """
+    import voeparse
+    from pysovo.utils import convert_voe_coords_to_fk5
+    n_indexed = 0
+    for entry in store.query(stream):
+        try:
+            v = voeparse.loads(store.read(entry))
+            posn = convert_voe_coords_to_fk5(voeparse.pull_astro_coords(v))
+        except Exception:
+            continue
+        index.add(entry.ivorn, posn)
+        n_indexed += 1
+    logger.info("Indexed %d archived alert positions", n_indexed)
+    return n_indexed
@@ -0,0 +1,149 @@
+"""
+A long-running packet listener.
+
+Rather than spawning a fresh interpreter for every received VOEvent (and
+paying for the astropysics / Jinja2 / config start-up each time), a single
+process listens on a local unix socket and dispatches each packet to a
+handler function as it arrives.
+
+Clients connect, write the raw packet, then shut down their end of the
+connection - see :func:`send_packet`.
+"""
+
+import os
+import signal
+import socket
+import threading
+import Queue
+import time
+import collections
+import logging
+logger = logging.getLogger(__name__)
+
+
+class PacketListener(object):
+    """Accepts packets on a unix socket and passes them to `handler`.
+
+    Packets are queued on receipt, then handled one at a time by a worker
+    thread, so a slow handler never blocks the socket. Per-packet latency
+    (receipt to handler completion) and queue depth are logged and recorded.
+    """
+    def __init__(self, socket_path, handler, max_queue=0, latency_history=1000):
+        self.socket_path = socket_path
+        self.handler = handler
+        self.queue = Queue.Queue(maxsize=max_queue)
+        self.latencies = collections.deque(maxlen=latency_history)
+        self.packets_handled = 0
+        self.handler_errors = 0
+        self._sock = None
+        self._stop = threading.Event()
+        self._stopped = threading.Event()
+        self._worker = None
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def start(self):
+        """Bind the socket and start the worker thread (non-blocking)."""
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.socket_path)
+        self._sock.listen(16)
+        self._sock.settimeout(0.5)
+        self._worker = threading.Thread(target=self._work,
+                                        name='packet-worker')
+        self._worker.daemon = True
+        self._worker.start()
+        logger.info("Listening for packets on %s", self.socket_path)
+
+    def serve_forever(self):
+        """Accept packets until :meth:`shutdown` is called."""
+        if self._sock is None:
+            self.start()
+        try:
+            while not self._stop.is_set():
+                try:
+                    conn, _ = self._sock.accept()
+                except socket.timeout:
+                    continue
+                self._receive(conn)
+            #Pick up any connections already waiting in the backlog:
+            self._sock.setblocking(0)
+            while True:
+                try:
+                    conn, _ = self._sock.accept()
+                except socket.error:
+                    break
+                conn.setblocking(1)
+                self._receive(conn)
+        finally:
+            self._close_socket()
+            self._stopped.set()
+
+    def shutdown(self, wait=True):
+        """Stop accepting packets; optionally wait for the queue to drain."""
+        self._stop.set()
+        if wait:
+            if self._sock is not None:
+                self._stopped.wait()
+            self.queue.join()
+
+    def _receive(self, conn):
+        received_at = time.time()
+        chunks = []
+        try:
+            while True:
+                data = conn.recv(65536)
+                if not data:
+                    break
+                chunks.append(data)
+        finally:
+            conn.close()
+        if not chunks:
+            return
+        self.queue.put((received_at, "".join(chunks)))
+        logger.debug("Packet queued, queue depth %d", self.queue.qsize())
+
+    def _work(self):
+        while True:
+            received_at, packet = self.queue.get()
+            try:
+                self.handler(packet)
+            except Exception:
+                self.handler_errors += 1
+                logger.exception("Error handling packet")
+            finally:
+                latency = time.time() - received_at
+                self.latencies.append(latency)
+                self.packets_handled += 1
+                logger.info("Packet handled in %.3f s, queue depth %d",
+                            latency, self.queue.qsize())
+                self.queue.task_done()
+
+    def _close_socket(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def send_packet(socket_path, packet):
+    """Forward a raw packet to a running :class:`PacketListener`."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(packet)
+        sock.shutdown(socket.SHUT_WR)
+    finally:
+        sock.close()
+
+def interrupt_on_sigterm():
+    """Make SIGTERM (as sent by e.g. systemd or supervisord to stop a
+    service) raise KeyboardInterrupt in the main thread, so it gets the
+    same clean shutdown as Ctrl-C. Call from the main thread."""
+    def handler(signum, frame):
+        logger.info("Received SIGTERM, shutting down")
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, handler)
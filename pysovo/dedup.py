@@ -0,0 +1,173 @@
+"""
+Tracks which packets and triggers have already been handled.
+
+Brokers may deliver the same IVORN more than once, and a single trigger may
+be followed by several updates (or a retraction). :class:`PacketIndex` lets
+the alert logic drop repeats before any action runs, and look up what has
+already been done for a trigger so that updates amend the existing response.
+"""
+
+import os
+import json
+import time
+import collections
+import logging
+logger = logging.getLogger(__name__)
+
+from pysovo.utils import ensure_dir
+
+
+class TriggerState(object):
+    """What we know about a trigger, grouped across its packets."""
+    def __init__(self, trigger_id, ivorns=None, actions=None, retracted=False):
+        self.trigger_id = trigger_id
+        self.ivorns = ivorns or []
+        self.actions = actions or []
+        self.retracted = retracted
+
+    def is_new(self):
+        """True until the first packet for this trigger has been handled."""
+        return len(self.ivorns) <= 1 and not self.actions
+
+    def to_dict(self):
+        return dict(ivorns=self.ivorns, actions=self.actions,
+                    retracted=self.retracted)
+
+
+class PacketIndex(object):
+    """Bounded LRU record of seen IVORNs and per-trigger state.
+
+    At most `max_ivorns` IVORNs and `max_triggers` triggers are retained,
+    least recently used first out. If `snapshot_path` is given, the index is
+    loaded from it on creation and written back by :meth:`save`
+    (at most every `snapshot_interval` seconds, unless forced).
+    """
+    def __init__(self, max_ivorns=100000, max_triggers=10000,
+                 snapshot_path=None, snapshot_interval=10.0):
+        self.max_ivorns = max_ivorns
+        self.max_triggers = max_triggers
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self._ivorns = collections.OrderedDict()
+        self._triggers = collections.OrderedDict()
+        self._dirty = False
+        self._last_save = 0
+        if snapshot_path is not None and os.path.exists(snapshot_path):
+            self.load()
+
+    def __contains__(self, ivorn):
+        return ivorn in self._ivorns
+
+    def __len__(self):
+        return len(self._ivorns)
+
+    def check_and_add(self, ivorn):
+        """Record `ivorn` as seen. Returns False if it had already been seen."""
+        if ivorn in self._ivorns:
+            #Refresh LRU position
+            self._ivorns[ivorn] = self._ivorns.pop(ivorn)
+            return False
+        self._ivorns[ivorn] = time.time()
+        while len(self._ivorns) > self.max_ivorns:
+            self._ivorns.popitem(last=False)
+        self._dirty = True
+        return True
+
+    def handle_once(self, ivorn, handler, *args):
+        """Call `handler(*args)` unless `ivorn` has already been handled.
+
+        `ivorn` is only recorded as seen once `handler` returns, so a packet
+        whose handling raised is handled again if redelivered.
+        Returns False (without calling `handler`) for a repeat.
+        """
+        if ivorn in self._ivorns:
+            self.check_and_add(ivorn)   #Refresh LRU position
+            return False
+        handler(*args)
+        self.check_and_add(ivorn)
+        return True
+
+    def trigger(self, trigger_id, ivorn=None):
+        """Get the :class:`TriggerState` for `trigger_id`, creating if needed.
+
+        If given, `ivorn` is recorded against the trigger.
+        """
+        state = self._triggers.pop(trigger_id, None)
+        if state is None:
+            state = TriggerState(trigger_id)
+        self._triggers[trigger_id] = state
+        while len(self._triggers) > self.max_triggers:
+            self._triggers.popitem(last=False)
+        if ivorn is not None and ivorn not in state.ivorns:
+            state.ivorns.append(ivorn)
+            self._dirty = True
+        return state
+
+    def record_action(self, trigger_id, action):
+        self.trigger(trigger_id).actions.append(action)
+        self._dirty = True
+
+    def mark_retracted(self, trigger_id):
+        self.trigger(trigger_id).retracted = True
+        self._dirty = True
+
+    def save(self, force=False):
+        """Write the snapshot file, if changed and due (or forced)."""
+        if self.snapshot_path is None or not self._dirty:
+            return
+        if not force and time.time() - self._last_save < self.snapshot_interval:
+            return
+        snapshot = dict(ivorns=self._ivorns.items(),
+                        triggers=[(k, s.to_dict())
+                                  for k, s in self._triggers.iteritems()])
+        ensure_dir(self.snapshot_path)
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.rename(tmp_path, self.snapshot_path)
+        self._dirty = False
+        self._last_save = time.time()
+
+    def load(self):
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except Exception as e:
+            logger.warn("Could not load packet index snapshot; reason:\n"
+                        + str(e))
+            return
+        self._ivorns = collections.OrderedDict(snapshot['ivorns'])
+        self._triggers = collections.OrderedDict(
+            (k, TriggerState(k, **s)) for k, s in snapshot['triggers'])
+        logger.debug("Loaded %d IVORNs, %d triggers from %s",
+                     len(self._ivorns), len(self._triggers), self.snapshot_path)
+
+    def merge(self, path):
+        """Add the IVORNs and trigger state from another snapshot file,
+        e.g. one written by a worker process."""
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except Exception as e:
+            logger.warn("Could not merge packet index snapshot %s; reason:\n"
+                        "%s", path, e)
+            return
+        for ivorn, seen in snapshot['ivorns']:
+            if ivorn not in self._ivorns:
+                self._ivorns[ivorn] = seen
+                self._dirty = True
+        for trigger_id, s in snapshot['triggers']:
+            state = self.trigger(trigger_id)
+            for ivorn in s['ivorns']:
+                if ivorn not in state.ivorns:
+                    state.ivorns.append(ivorn)
+                    self._dirty = True
+            for action in s['actions']:
+                if action not in state.actions:
+                    state.actions.append(action)
+                    self._dirty = True
+            if s['retracted'] and not state.retracted:
+                state.retracted = True
+                self._dirty = True
+        while len(self._ivorns) > self.max_ivorns:
+            self._ivorns.popitem(last=False)
@@ -3,6 +3,10 @@ Commonly used routines for determining target ephemeris and visibilities.
 """
 
 import datetime, pytz
+import collections
+import threading
+import numpy
+import astropysics.coords
 import astropysics.obstools
 
 #-----------------------------------------------------------------
@@ -17,39 +21,621 @@ class TargetStatusKeys():
     rise_time = 'rise_time'
     set_time = 'set_time'
 
-def visibility(eq_posn, obs_site, current_time):
+class VisibilityReport(object):
+    """Visibility of a target from a site, as returned by :func:`visibility`.
+
+    Attributes are named as per TargetStatusKeys; those not applicable
+    (e.g. rise_time for a circumpolar target) are None. Dict-style access
+    by key is also supported, where inapplicable keys are absent.
+    """
+    __slots__ = ('site_lst', 'type', 'visible_now', 'current_position',
+                 'transit_time', 'transit_position', 'rise_time', 'set_time')
+
+    def __init__(self, site_lst=None, type=None, visible_now=None,
+                 current_position=None, transit_time=None,
+                 transit_position=None, rise_time=None, set_time=None):
+        self.site_lst = site_lst
+        self.type = type
+        self.visible_now = visible_now
+        self.current_position = current_position
+        self.transit_time = transit_time
+        self.transit_position = transit_position
+        self.rise_time = rise_time
+        self.set_time = set_time
+
+    def keys(self):
+        return [k for k in self.__slots__ if getattr(self, k) is not None]
+
+    def items(self):
+        return [(k, getattr(self, k)) for k in self.keys()]
+
+    def __getitem__(self, key):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __eq__(self, other):
+        if isinstance(other, VisibilityReport):
+            other = dict(other.items())
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'VisibilityReport(%s)' % ', '.join('%s=%r' % kv
+                                                   for kv in self.items())
+
+def _without_errors(eq_posn):
+    """astropysics cannot precess coordinates that carry errors (as
+    apparentCoordinates does), and visibility does not depend on them."""
+    if eq_posn.raerr is None and eq_posn.decerr is None:
+        return eq_posn
+    return astropysics.coords.FK5Coordinates(eq_posn.ra.degrees,
+                                             eq_posn.dec.degrees,
+                                             epoch=eq_posn.epoch)
+
+def visibility(eq_posn, obs_site, current_time, cache=None):
     """Get basic information on target visibility for a given site.
 
-    Returns a dict populated with relevant TargetStatusKeys.
+    If a :class:`SiteEphemCache` for `obs_site` is supplied, sidereal time
+    and rise / set / transit times are interpolated from its tables rather
+    than computed afresh.
+
+    Returns a :class:`VisibilityReport`.
     """
-    keys = TargetStatusKeys
     assert isinstance(obs_site, astropysics.obstools.Site)
+    eq_posn = _without_errors(eq_posn)
+    result = VisibilityReport()
     #Get times:
-    rise, set, transit = obs_site.nextRiseSetTransit(eq_posn, current_time,
+    if cache is None:
+        rise, set, transit = obs_site.nextRiseSetTransit(eq_posn, current_time,
                                               alt=obs_site.target_min_elevation)
-    result = {}
-    result[keys.site_lst] = obs_site.localSiderialTime(current_time,
-                                                       returntype='string')
+        result.site_lst = obs_site.localSiderialTime(current_time,
+                                                     returntype='string')
+    else:
+        assert cache.site is obs_site
+        rise, set, transit = cache.next_rise_set_transit(eq_posn, current_time)
+        result.site_lst = format_lst(cache.local_sidereal_time(current_time))
     if transit is None:
         #Wrong hemisphere
-        result[keys.type] = 'never'
+        result.type = 'never'
         return result
 
     if set is None:
         #Circumpolar
-        result[keys.type] = 'always'
+        result.type = 'always'
     else:
         #Regular rise and set
-        result[keys.type] = 'sometimes'
-        result[keys.rise_time] = rise
-        result[keys.set_time] = set
+        result.type = 'sometimes'
+        result.rise_time = rise
+        result.set_time = set
 
-    result[keys.trans_time] = transit
-    result[keys.trans_pos] = obs_site.apparentCoordinates(eq_posn, transit)[0]
-    result[keys.visible_now] = obs_site.onSky(eq_posn, current_time,
-                                      alt=obs_site.target_min_elevation)
+    result.transit_time = transit
+    result.transit_position = obs_site.apparentCoordinates(eq_posn, transit)[0]
+    if cache is None:
+        result.visible_now = obs_site.onSky(eq_posn, current_time,
+                                            alt=obs_site.target_min_elevation)
+    else:
+        result.visible_now = rise is None or rise <= current_time <= set
 
-    if result[keys.visible_now]:
+    if result.visible_now:
         ac_list = obs_site.apparentCoordinates(eq_posn, current_time)
-        result[keys.current_pos] = ac_list[0]
+        result.current_position = ac_list[0]
     return result
+
+def format_lst(lst):
+    """Format decimal hours as per `Site.localSiderialTime(returntype='string')`"""
+    hr = int(lst)
+    min = 60 * (lst - hr)
+    sec = 60 * (min - int(min))
+    return '%02i:%02i:%f' % (hr, int(min), sec)
+
+
+#-----------------------------------------------------------------
+# Vectorized routines for many targets at many sites.
+#-----------------------------------------------------------------
+class VisibilityType():
+    """Integer codes for the `type` array of a :class:`BatchVisibility`."""
+    never = 0
+    sometimes = 1
+    always = 2
+    names = ('never', 'sometimes', 'always')
+
+class BatchVisibility(collections.namedtuple('BatchVisibility',
+        'lst hour_angle altitude type visible_now rise_time set_time transit_time')):
+    """Visibility of N targets at M sites, as arrays.
+
+    lst: Local sidereal time at each site, decimal hours, shape (M,).
+    All other fields have shape (N, M):
+    hour_angle: Current hour angle, decimal hours in [-12, 12).
+    altitude: Current (geometric) altitude, degrees.
+    type: A :class:`VisibilityType` code.
+    visible_now: Boolean, above the site's `target_min_elevation`.
+    rise_time, set_time, transit_time: Seconds relative to the input time,
+        chosen as per :meth:`astropysics.obstools.Site.nextRiseSetTransit`.
+        NaN where not applicable (rise / set for 'always', all for 'never').
+    """
+    __slots__ = ()
+
+    def to_records(self):
+        """The per target-site fields as one (N, M) structured array.
+
+        Times are stored as float32 seconds, i.e. to ~10ms over a day.
+        """
+        records = numpy.empty(self.type.shape, dtype=visibility_record_dtype)
+        for name in visibility_record_dtype.names:
+            records[name] = getattr(self, name)
+        return records
+
+visibility_record_dtype = numpy.dtype([('type', numpy.int8),
+                                       ('visible_now', numpy.bool_),
+                                       ('hour_angle', numpy.float32),
+                                       ('altitude', numpy.float32),
+                                       ('rise_time', numpy.float32),
+                                       ('set_time', numpy.float32),
+                                       ('transit_time', numpy.float32)])
+
+#Ratio of solar to sidereal day lengths:
+_sidereal_rate = 1.0027378507871321
+
+def _target_arrays(targets):
+    """Get RA, Dec in degrees from a list of FK5Coordinates or a (2, N) array."""
+    if len(targets) and hasattr(targets[0], 'ra'):
+        ra = numpy.array([t.ra.degrees for t in targets], dtype=float)
+        dec = numpy.array([t.dec.degrees for t in targets], dtype=float)
+        return ra, dec
+    ra, dec = numpy.asarray(targets, dtype=float)
+    return numpy.atleast_1d(ra), numpy.atleast_1d(dec)
+
+def _site_arrays(sites):
+    """Get latitude, longitude, minimum elevation (degrees) of sites."""
+    lat = numpy.array([s.latitude.degrees for s in sites], dtype=float)
+    lon = numpy.array([s.longitude.degrees for s in sites], dtype=float)
+    min_el = numpy.array([s.target_min_elevation for s in sites], dtype=float)
+    return lat, lon, min_el
+
+def greenwich_sidereal_time(dtime):
+    """Greenwich apparent sidereal time (decimal hours) at `dtime`."""
+    jd = astropysics.obstools.calendar_to_jd(dtime)
+    return float(astropysics.coords.greenwich_sidereal_time(jd))
+
+def visibility_batch(targets, sites, current_time):
+    """Vectorized equivalent of :func:`visibility` for many targets and sites.
+
+    `targets` may be a sequence of FK5Coordinates, or a pair of RA, Dec
+    arrays in degrees. Uses the same hour-angle approximation to rise / set
+    as :meth:`astropysics.obstools.Site.riseSetTransit`.
+
+    Returns a :class:`BatchVisibility`.
+    """
+    ra, dec = _target_arrays(targets)
+    lat, lon, min_el = _site_arrays(sites)
+
+    lst = (greenwich_sidereal_time(current_time) + lon / 15.0) % 24.0
+
+    ra_hrs = (ra / 15.0)[:, numpy.newaxis]
+    ha = (lst[numpy.newaxis, :] - ra_hrs + 12.0) % 24.0 - 12.0
+
+    dec_r = numpy.radians(dec)[:, numpy.newaxis]
+    lat_r = numpy.radians(lat)[numpy.newaxis, :]
+    sin_alt = (numpy.sin(dec_r) * numpy.sin(lat_r) +
+               numpy.cos(dec_r) * numpy.cos(lat_r) *
+               numpy.cos(numpy.radians(ha * 15.0)))
+    altitude = numpy.degrees(numpy.arcsin(numpy.clip(sin_alt, -1.0, 1.0)))
+
+    #Hour angle at which the target crosses the minimum elevation:
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        cos_lha = ((numpy.sin(numpy.radians(min_el))[numpy.newaxis, :] -
+                    numpy.sin(lat_r) * numpy.sin(dec_r)) /
+                   (numpy.cos(lat_r) * numpy.cos(dec_r)))
+    vis_type = numpy.empty(ha.shape, dtype=numpy.int8)
+    vis_type.fill(VisibilityType.sometimes)
+    vis_type[cos_lha < -1] = VisibilityType.always
+    vis_type[cos_lha > 1] = VisibilityType.never
+    lha = numpy.degrees(numpy.arccos(numpy.clip(cos_lha, -1.0, 1.0))) / 15.0
+
+    sometimes = vis_type == VisibilityType.sometimes
+    up_now = sometimes & (numpy.abs(ha) <= lha)
+    visible_now = up_now | (vis_type == VisibilityType.always)
+
+    #Transit bracketed by current rise / set if up, else the next one:
+    hrs_to_transit = numpy.where(up_now, -ha, (-ha) % 24.0) / _sidereal_rate
+    transit = hrs_to_transit * 3600.0
+    lha_secs = lha / _sidereal_rate * 3600.0
+    rise = numpy.where(sometimes, transit - lha_secs, numpy.nan)
+    set = numpy.where(sometimes, transit + lha_secs, numpy.nan)
+    transit[vis_type == VisibilityType.never] = numpy.nan
+
+    return BatchVisibility(lst=lst, hour_angle=ha, altitude=altitude,
+                           type=vis_type, visible_now=visible_now,
+                           rise_time=rise, set_time=set, transit_time=transit)
+
+
+#-----------------------------------------------------------------
+# Per-site lookup tables.
+#-----------------------------------------------------------------
+_unix_epoch = datetime.datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+def _to_seconds(dtime):
+    return (dtime - _unix_epoch).total_seconds()
+
+def _from_seconds(secs):
+    return _unix_epoch + datetime.timedelta(seconds=float(secs))
+
+class SiteEphemCache(object):
+    """Sidereal-time and horizon lookup tables for a single site.
+
+    Holds a table of (unwrapped) local sidereal time, sampled every `step`
+    over a window of `span` starting a day before the most recent query.
+    The window is rebuilt whenever a query falls outside it, so the table
+    memory is bounded by ``span / step`` entries.
+
+    The declination limits for the site's `target_min_elevation` horizon
+    are precomputed, so 'never' / 'always' / 'sometimes' is a pair of
+    comparisons, and rise / set / transit times are found by interpolating
+    the LST table rather than by repeated sidereal-time evaluations.
+
+    `hits` and `misses` count table lookups served from the current window
+    versus those that forced a rebuild.
+    """
+    def __init__(self, site, span=datetime.timedelta(days=4),
+                 step=datetime.timedelta(minutes=10)):
+        assert span >= datetime.timedelta(days=2, hours=12)
+        self.site = site
+        self.span = span.total_seconds()
+        self.step = step.total_seconds()
+        self.hits = 0
+        self.misses = 0
+        self._times = None
+        self._lsts = None
+
+        #Declination limits, with the sign flipped for southern sites:
+        #targets below `never_limit` never rise, above `always_limit` never set.
+        lat = site.latitude.degrees
+        min_el = site.target_min_elevation
+        self._hemisphere = 1 if lat >= 0 else -1
+        self.never_limit = abs(lat) - 90 + min_el
+        self.always_limit = 90 - abs(lat) + min_el
+
+    def classify(self, dec):
+        """Return 'never', 'always' or 'sometimes' for a declination (deg)."""
+        dec = self._hemisphere * dec
+        if dec < self.never_limit:
+            return 'never'
+        if dec > self.always_limit:
+            return 'always'
+        return 'sometimes'
+
+    def local_sidereal_time(self, dtime):
+        """Local apparent sidereal time in decimal hours, in [0, 24)."""
+        secs = _to_seconds(dtime)
+        self._ensure_window(secs)
+        return numpy.interp(secs, self._times, self._lsts) % 24.0
+
+    def next_rise_set_transit(self, eq_posn, dtime):
+        """Equivalent of `Site.nextRiseSetTransit`, using the site's
+        `target_min_elevation`.
+
+        Returns (rise, set, transit) datetimes, with None entries as for
+        the astropysics method.
+        """
+        vis_type = self.classify(eq_posn.dec.degrees)
+        if vis_type == 'never':
+            return None, None, None
+        secs = _to_seconds(dtime)
+        self._ensure_window(secs)
+        lst = numpy.interp(secs, self._times, self._lsts)
+        ha = (lst - eq_posn.ra.hours + 12.0) % 24.0 - 12.0
+        if vis_type == 'always':
+            return None, None, self._time_at_lst(lst + (-ha) % 24.0)
+
+        lat_r = self.site.latitude.radians
+        dec_r = eq_posn.dec.radians
+        cos_lha = ((numpy.sin(numpy.radians(self.site.target_min_elevation)) -
+                    numpy.sin(lat_r) * numpy.sin(dec_r)) /
+                   (numpy.cos(lat_r) * numpy.cos(dec_r)))
+        lha = numpy.degrees(numpy.arccos(numpy.clip(cos_lha, -1, 1))) / 15.0
+        if abs(ha) <= lha:
+            transit_lst = lst - ha
+        else:
+            transit_lst = lst + (-ha) % 24.0
+        return (self._time_at_lst(transit_lst - lha),
+                self._time_at_lst(transit_lst + lha),
+                self._time_at_lst(transit_lst))
+
+    def _time_at_lst(self, lst):
+        return _from_seconds(numpy.interp(lst, self._lsts, self._times))
+
+    def _ensure_window(self, secs):
+        #Rise times may be up to a day before the query, sets ~1.5 days after.
+        if (self._times is not None and
+                self._times[0] <= secs - 86400 and
+                secs + 1.5 * 86400 <= self._times[-1]):
+            self.hits += 1
+            return
+        self.misses += 1
+        start = (secs // self.step) * self.step - 86400
+        self._times = numpy.arange(start, start + self.span + self.step,
+                                   self.step)
+        jds = self._times / 86400.0 + 2440587.5
+        #Mean sidereal time, plus the (near constant) equation of equinoxes:
+        gst = astropysics.coords.greenwich_sidereal_time(jds, apparent=False)
+        mid = len(jds) // 2
+        gst += (astropysics.coords.greenwich_sidereal_time(jds[mid]) - gst[mid])
+        lsts = (gst + self.site.longitude.degrees / 15.0) % 24.0
+        #Unwrap, so the table is monotonic and can be inverted:
+        self._lsts = numpy.degrees(numpy.unwrap(numpy.radians(lsts * 15.0))) / 15.0
+
+
+class SiteEphemCacheRegistry(object):
+    """Holds a :class:`SiteEphemCache` per site, for up to `max_sites` sites.
+
+    The least recently used cache is evicted when the limit is reached.
+    """
+    def __init__(self, max_sites=64, **cache_kwargs):
+        self.max_sites = max_sites
+        self.cache_kwargs = cache_kwargs
+        self._caches = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, site):
+        key = id(site)
+        with self._lock:
+            cache = self._caches.pop(key, None)
+            if cache is None or cache.site is not site:
+                cache = SiteEphemCache(site, **self.cache_kwargs)
+            self._caches[key] = cache
+            while len(self._caches) > self.max_sites:
+                self._caches.popitem(last=False)
+        return cache
+
+    def stats(self):
+        """Total (hits, misses) over all cached sites."""
+        return (sum(c.hits for c in self._caches.values()),
+                sum(c.misses for c in self._caches.values()))
+
+
+#-----------------------------------------------------------------
+# Prefiltering of targets by declination.
+#-----------------------------------------------------------------
+def observable_dec_range(site):
+    """(min, max) declination (deg) that ever rises above the site's
+    `target_min_elevation`. (min > max if none does.)"""
+    lat = site.latitude.degrees
+    reach = 90.0 - site.target_min_elevation
+    return max(-90.0, lat - reach), min(90.0, lat + reach)
+
+class SkyIndex(object):
+    """Which of a list of sites could ever observe a given declination.
+
+    Whether a target ever rises depends only on its declination, so the
+    sky is split into declination bands of `band_width` degrees, each
+    holding the sites that can see all of it and those whose limit falls
+    inside it. A lookup is then one band plus a check of the few sites
+    with a limit in that band.
+    """
+    def __init__(self, sites, band_width=1.0):
+        self.sites = list(sites)
+        self.band_width = float(band_width)
+        self.n_bands = int(numpy.ceil(180.0 / self.band_width))
+        self._site_ids = set(id(s) for s in self.sites)
+        self._limits = [observable_dec_range(s) for s in self.sites]
+        self._bands = []
+        for i in range(self.n_bands):
+            low = -90.0 + i * self.band_width
+            high = min(90.0, low + self.band_width)
+            full, partial = [], []
+            for site, (dec_min, dec_max) in zip(self.sites, self._limits):
+                if dec_min <= low and high <= dec_max:
+                    full.append(site)
+                elif dec_min <= high and low <= dec_max:
+                    partial.append((site, dec_min, dec_max))
+            self._bands.append((full, partial))
+
+    def __contains__(self, site):
+        return id(site) in self._site_ids
+
+    def candidates(self, dec):
+        """Sites (in index order) that can observe declination `dec` (deg)."""
+        band = min(int((dec + 90.0) / self.band_width), self.n_bands - 1)
+        full, partial = self._bands[max(band, 0)]
+        if not partial:
+            return list(full)
+        seen = set(id(s) for s in full)
+        seen.update(id(s) for s, dec_min, dec_max in partial
+                    if dec_min <= dec <= dec_max)
+        return [s for s in self.sites if id(s) in seen]
+
+    def observable(self, dec):
+        """True if any indexed site can ever observe declination `dec`."""
+        return bool(self.candidates(dec))
+
+def visibility_reports(eq_posn, sites, current_time, index=None, caches=None):
+    """Run :func:`visibility` for each site, returning (site, report) pairs.
+
+    If a :class:`SkyIndex` is given, indexed sites that can never see the
+    target get a minimal 'never' report without the full calculation.
+    `caches` may be a :class:`SiteEphemCacheRegistry`.
+    """
+    candidates = None
+    if index is not None:
+        candidates = set(id(s) for s in index.candidates(eq_posn.dec.degrees))
+    reports = []
+    for site in sites:
+        cache = caches[site] if caches is not None else None
+        if (candidates is not None and site in index
+                and id(site) not in candidates):
+            if cache is not None:
+                lst = format_lst(cache.local_sidereal_time(current_time))
+            else:
+                lst = site.localSiderialTime(current_time, returntype='string')
+            report = VisibilityReport(site_lst=lst, type='never')
+        else:
+            report = visibility(eq_posn, site, current_time, cache=cache)
+        reports.append((site, report))
+    return reports
+
+
+#-----------------------------------------------------------------
+# Visibility over a span of time, for scheduling.
+#-----------------------------------------------------------------
+class VisibilityTimeline(collections.namedtuple('VisibilityTimeline',
+        'times lst altitude observable sun_altitude moon_separation windows')):
+    """Visibility of N targets at M sites, sampled at T times.
+
+    times: Seconds relative to the start time, shape (T,).
+    lst: Local sidereal time, decimal hours, shape (M, T).
+    altitude: Geometric altitude in degrees, float32, shape (N, M, T).
+    observable: Boolean, shape (N, M, T): above the site's
+        `target_min_elevation` and passing any sun / moon constraints.
+    sun_altitude: Degrees, shape (M, T); None unless a sun limit was given.
+    moon_separation: Degrees, shape (N, T); None unless a moon limit was given.
+    windows: Structured array of contiguous observable spans, with fields
+        target, site (indices), start, end (seconds, sample resolution).
+    """
+    __slots__ = ()
+
+    @property
+    def airmass(self):
+        return airmass(self.altitude)
+
+window_dtype = numpy.dtype([('target', numpy.int32), ('site', numpy.int32),
+                            ('start', numpy.float64), ('end', numpy.float64)])
+
+def airmass(altitude):
+    """Airmass for altitudes in degrees (Kasten & Young 1989);
+    NaN below the horizon."""
+    alt = numpy.asarray(altitude, dtype=float)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        x = 1.0 / (numpy.sin(numpy.radians(alt)) +
+                   0.50572 * (alt + 6.07995) ** -1.6364)
+    return numpy.where(alt > 0, x, numpy.nan)
+
+def _obliquity(n):
+    return numpy.radians(23.439 - 4e-7 * n)
+
+def _ecliptic_to_equatorial(lon, lat, n):
+    """Ecliptic longitude, latitude (radians) to RA, Dec (degrees)."""
+    eps = _obliquity(n)
+    ra = numpy.arctan2(numpy.sin(lon) * numpy.cos(eps) -
+                       numpy.tan(lat) * numpy.sin(eps), numpy.cos(lon))
+    dec = numpy.arcsin(numpy.sin(lat) * numpy.cos(eps) +
+                       numpy.cos(lat) * numpy.sin(eps) * numpy.sin(lon))
+    return numpy.degrees(ra) % 360.0, numpy.degrees(dec)
+
+def sun_position(jd):
+    """Approximate (~0.01 deg) apparent RA, Dec of the Sun in degrees,
+    for an array of Julian dates."""
+    n = numpy.asarray(jd, dtype=float) - 2451545.0
+    L = 280.460 + 0.9856474 * n
+    g = numpy.radians(357.528 + 0.9856003 * n)
+    lon = numpy.radians(L + 1.915 * numpy.sin(g) + 0.020 * numpy.sin(2 * g))
+    return _ecliptic_to_equatorial(lon, numpy.zeros_like(lon), n)
+
+def moon_position(jd):
+    """Approximate (~0.3 deg, geocentric) RA, Dec of the Moon in degrees,
+    for an array of Julian dates."""
+    n = numpy.asarray(jd, dtype=float) - 2451545.0
+    t = n / 36525.0
+    sin_d = lambda a, b: numpy.sin(numpy.radians(a + b * t))
+    lon = (218.32 + 481267.881 * t
+           + 6.29 * sin_d(134.9, 477198.85) - 1.27 * sin_d(259.2, -413335.38)
+           + 0.66 * sin_d(235.7, 890534.23) + 0.21 * sin_d(269.9, 954397.70)
+           - 0.19 * sin_d(357.5, 35999.05) - 0.11 * sin_d(186.6, 966404.05))
+    lat = (5.13 * sin_d(93.3, 483202.03) + 0.28 * sin_d(228.2, 960400.87)
+           - 0.28 * sin_d(318.3, 6003.18) - 0.17 * sin_d(217.6, -407332.20))
+    return _ecliptic_to_equatorial(numpy.radians(lon), numpy.radians(lat), n)
+
+def _altitude(ra, dec, lat, lst):
+    """Altitude (deg) for broadcastable RA, Dec, latitude (deg), LST (hrs)."""
+    dec_r = numpy.radians(dec)
+    lat_r = numpy.radians(lat)
+    ha_r = numpy.radians(lst * 15.0 - ra)
+    sin_alt = (numpy.sin(dec_r) * numpy.sin(lat_r) +
+               numpy.cos(dec_r) * numpy.cos(lat_r) * numpy.cos(ha_r))
+    return numpy.degrees(numpy.arcsin(numpy.clip(sin_alt, -1.0, 1.0)))
+
+def _separation(ra1, dec1, ra2, dec2):
+    """Angular separation (deg) for broadcastable positions in degrees."""
+    ra1, dec1, ra2, dec2 = map(numpy.radians, (ra1, dec1, ra2, dec2))
+    cos_sep = (numpy.sin(dec1) * numpy.sin(dec2) +
+               numpy.cos(dec1) * numpy.cos(dec2) * numpy.cos(ra1 - ra2))
+    return numpy.degrees(numpy.arccos(numpy.clip(cos_sep, -1.0, 1.0)))
+
+def _windows(observable, times):
+    """Contiguous True spans along the last axis, as a window_dtype array."""
+    n_targets, n_sites, n_times = observable.shape
+    padded = numpy.zeros((n_targets, n_sites, n_times + 2), dtype=numpy.int8)
+    padded[:, :, 1:-1] = observable
+    edges = numpy.diff(padded, axis=2)
+    tgt, site, starts = numpy.nonzero(edges == 1)
+    _, _, ends = numpy.nonzero(edges == -1)
+    windows = numpy.empty(len(starts), dtype=window_dtype)
+    windows['target'] = tgt
+    windows['site'] = site
+    windows['start'] = times[starts]
+    #`ends` index the first unobservable sample; the span ends a step before:
+    windows['end'] = times[ends - 1]
+    return windows
+
+def visibility_timeline(targets, sites, start_time,
+                        span=datetime.timedelta(days=1),
+                        step=datetime.timedelta(minutes=5),
+                        sun_max_altitude=None, moon_min_separation=None):
+    """Altitude and observability of many targets at many sites over time.
+
+    `targets` may be a sequence of FK5Coordinates, or a pair of RA, Dec
+    arrays in degrees. If `sun_max_altitude` (degrees, e.g. -12 for
+    nautical twilight) or `moon_min_separation` (degrees) are given,
+    samples failing them are masked out of `observable`.
+
+    Returns a :class:`VisibilityTimeline`.
+    """
+    ra, dec = _target_arrays(targets)
+    lat, lon, min_el = _site_arrays(sites)
+    step_secs = step.total_seconds()
+    times = numpy.arange(0.0, span.total_seconds() + step_secs / 2, step_secs)
+
+    jds = (_to_seconds(start_time) + times) / 86400.0 + 2440587.5
+    #Mean sidereal time, plus the (near constant) equation of equinoxes:
+    gst = astropysics.coords.greenwich_sidereal_time(jds, apparent=False)
+    gst += greenwich_sidereal_time(start_time) - gst[0]
+    lst = (gst[numpy.newaxis, :] + lon[:, numpy.newaxis] / 15.0) % 24.0
+
+    altitude = _altitude(ra[:, None, None], dec[:, None, None],
+                         lat[None, :, None], lst[None, :, :])
+    observable = altitude >= min_el[None, :, None]
+
+    sun_alt = None
+    if sun_max_altitude is not None:
+        sun_ra, sun_dec = sun_position(jds)
+        sun_alt = _altitude(sun_ra[None, :], sun_dec[None, :],
+                            lat[:, None], lst)
+        observable &= (sun_alt <= sun_max_altitude)[None, :, :]
+        sun_alt = sun_alt.astype(numpy.float32)
+
+    moon_sep = None
+    if moon_min_separation is not None:
+        moon_ra, moon_dec = moon_position(jds)
+        moon_sep = _separation(ra[:, None], dec[:, None],
+                               moon_ra[None, :], moon_dec[None, :])
+        observable &= (moon_sep >= moon_min_separation)[:, None, :]
+        moon_sep = moon_sep.astype(numpy.float32)
+
+    return VisibilityTimeline(times=times, lst=lst,
+                              altitude=altitude.astype(numpy.float32),
+                              observable=observable,
+                              sun_altitude=sun_alt,
+                              moon_separation=moon_sep,
+                              windows=_windows(observable, times))
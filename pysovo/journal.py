@@ -0,0 +1,352 @@
+"""
+A write-ahead journal of outbound actions (observation requests,
+notifications).
+
+Before an action is sent its intent is appended to the journal, together with
+everything needed to send it again, and flushed to disk; once the send
+finishes, its outcome is appended too. If the process dies in between, the
+action is still pending when the journal is next opened, and can be replayed
+- so a request is sent at least once, rather than silently lost.
+
+The journal is a JSON-lines file, one event per line::
+
+    {"event": "intent", "id": "3f2a...", "kind": "ami_request",
+     "trigger": "532871", "description": "...", "payload": {...},
+     "time": 1381500000.0}
+    {"event": "done", "id": "3f2a...", "time": 1381500002.1}
+
+Several processes may append to the same journal (e.g. one per packet, when
+run from a broker), so action IDs are random UUIDs rather than a sequence.
+Each process holds a shared lock (flock) on the file while it has it open
+for writing, and writes each event with a single write() to an O_APPEND
+descriptor, so events from different processes are never interleaved.
+Pending actions are only replayed by a process that can get an exclusive
+lock, i.e. when no other process may still be sending them; it then also
+compacts the file down to the pending intents, so the journal does not
+grow without bound.
+
+Intents are fsync'd before :meth:`ActionJournal.intent` returns, with
+concurrent callers sharing a single fsync (group commit). Outcomes are only
+flushed, and reach the disk with the next sync; at worst, an action is
+replayed after it had in fact been sent.
+
+The history since the last compaction is also held in memory, indexed by
+trigger, so e.g. "what has been requested for this trigger?" needs no disk
+access. Payloads are only kept for pending actions.
+"""
+
+import os
+import json
+import time
+import uuid
+import errno
+import fcntl
+import threading
+import collections
+import logging
+logger = logging.getLogger(__name__)
+
+from pysovo.utils import ensure_dir
+
+
+class ActionState():
+    pending = 'pending'
+    done = 'done'
+    failed = 'failed'
+
+
+class ActionRecord(object):
+    __slots__ = ('action_id', 'kind', 'trigger', 'description', 'payload',
+                 'created', 'state', 'finished', 'error')
+    def __init__(self, action_id, kind, trigger, description, payload,
+                 created):
+        self.action_id = action_id
+        self.kind = kind
+        self.trigger = trigger
+        self.description = description
+        self.payload = payload
+        self.created = created
+        self.state = ActionState.pending
+        self.finished = None
+        self.error = None
+
+    def __repr__(self):
+        return 'ActionRecord(%r, %r, trigger=%r, state=%r)' % (
+                    self.action_id, self.kind, self.trigger, self.state)
+
+
+class ActionJournal(object):
+    """Append-only journal of actions, at `path`.
+
+    Existing entries are loaded on creation; the file is created on the
+    first write.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.syncs = 0
+        self._actions = collections.OrderedDict()
+        self._by_trigger = {}
+        self._fd = None
+        self._written = 0   #Events written, and how many of those are synced
+        self._synced = 0
+        self._syncing = False
+        self._torn = False
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        if os.path.exists(path):
+            self._load()
+
+    def intent(self, kind, payload, trigger=None, description=None):
+        """Record an action about to be taken; returns its ID once durable.
+
+        `payload` (JSON-serializable) should hold whatever is needed to
+        carry out the action again on replay.
+        """
+        with self._lock:
+            action_id = uuid.uuid4().hex
+            record = ActionRecord(action_id, kind, trigger,
+                                  description or kind, payload, time.time())
+            self._add(record)
+            seq = self._write(self._intent_event(record))
+        self._sync_to(seq)
+        return action_id
+
+    def complete(self, action_id):
+        self._finish(action_id, ActionState.done)
+
+    def fail(self, action_id, error):
+        self._finish(action_id, ActionState.failed, str(error))
+
+    def finish(self, action_id, handle):
+        """Record the outcome of an outbound send, from its DispatchHandle.
+
+        For use as an :meth:`OutboundQueue.submit` callback.
+        """
+        if handle.succeeded():
+            self.complete(action_id)
+        else:
+            self.fail(action_id, handle.exception)
+
+    def _finish(self, action_id, state, error=None):
+        with self._lock:
+            record = self._actions[action_id]
+            record.state = state
+            record.finished = time.time()
+            record.error = error
+            record.payload = None
+            event = dict(event=state, id=action_id, time=record.finished)
+            if error is not None:
+                event['error'] = error
+            self._write(event)
+
+    def replay(self, resubmit, max_age=None):
+        """Call `resubmit(record)` for each pending action, e.g. at start-up.
+
+        `resubmit` should carry out the action again, recording its outcome
+        against the same ID. Actions more than `max_age` seconds old are
+        marked failed instead. Nothing is replayed while another process
+        has the journal open for writing, as its pending actions may still
+        be in progress; otherwise, the file is first compacted to just the
+        actions to be replayed. Returns the number of actions replayed.
+        """
+        if not self._lock_exclusive():
+            logger.info("%s is in use by another process, not replaying",
+                        self.path)
+            return 0
+        try:
+            now = time.time()
+            for record in self.pending():
+                if max_age is not None and now - record.created > max_age:
+                    logger.warn("Not replaying action %s, %.0f s old: %s",
+                                record.action_id, now - record.created,
+                                record.description)
+                    self.fail(record.action_id, "Too old to replay")
+            with self._lock:
+                self._compact()
+            replayed = 0
+            for record in self.pending():
+                logger.info("Replaying unfinished action %s: %s",
+                            record.action_id, record.description)
+                replayed += 1
+                try:
+                    resubmit(record)
+                except Exception as e:
+                    logger.exception("Could not replay action %s",
+                                     record.action_id)
+                    self.fail(record.action_id, e)
+        finally:
+            with self._lock:
+                fcntl.flock(self._fd, fcntl.LOCK_SH)
+        return replayed
+
+    def get(self, action_id):
+        with self._lock:
+            return self._actions[action_id]
+
+    def pending(self):
+        """Actions not yet known to have finished, oldest first."""
+        with self._lock:
+            return [r for r in self._actions.itervalues()
+                    if r.state == ActionState.pending]
+
+    def history(self, trigger):
+        """All actions recorded against `trigger`, oldest first."""
+        with self._lock:
+            return list(self._by_trigger.get(trigger, ()))
+
+    def __len__(self):
+        return len(self._actions)
+
+    def sync(self):
+        """Ensure everything written so far is on disk."""
+        with self._lock:
+            seq = self._written
+        self._sync_to(seq)
+
+    def close(self):
+        self.sync()
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    def _add(self, record):
+        self._actions[record.action_id] = record
+        if record.trigger is not None:
+            self._by_trigger.setdefault(record.trigger, []).append(record)
+
+    @staticmethod
+    def _intent_event(record):
+        return dict(event='intent', id=record.action_id, kind=record.kind,
+                    trigger=record.trigger, description=record.description,
+                    payload=record.payload, time=record.created)
+
+    def _open(self):
+        while self._fd is None:
+            ensure_dir(self.path)
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                         0644)
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            #If another process compacted the file while we waited for the
+            #lock, ours is the old one:
+            if (os.path.exists(self.path) and
+                    os.fstat(fd).st_ino == os.stat(self.path).st_ino):
+                self._fd = fd
+            else:
+                os.close(fd)
+        if self._torn:
+            os.write(self._fd, '\n')
+            self._torn = False
+
+    def _lock_exclusive(self):
+        """Try to lock the file for replay; on success, reload it, as other
+        processes may have recorded outcomes since we loaded it."""
+        with self._lock:
+            self._open()
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                #Converting a lock may drop it first:
+                fcntl.flock(self._fd, fcntl.LOCK_SH)
+                return False
+            self._actions.clear()
+            self._by_trigger.clear()
+            self._load()
+            self._open()
+            return True
+
+    def _compact(self):
+        """Replace the file with one holding just the pending intents.
+
+        Call with the lock held, and the file locked exclusively.
+        """
+        pending = [r for r in self._actions.itervalues()
+                   if r.state == ActionState.pending]
+        tmp_path = self.path + '.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT |
+                               os.O_TRUNC, 0644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            os.write(fd, ''.join(json.dumps(self._intent_event(r)) + '\n'
+                                 for r in pending))
+            os.fsync(fd)
+            os.rename(tmp_path, self.path)
+        except:
+            os.close(fd)
+            raise
+        os.close(self._fd)
+        self._fd = fd
+        self._synced = self._written
+        logger.debug("Compacted %s from %d to %d actions", self.path,
+                     len(self._actions), len(pending))
+        self._actions.clear()
+        self._by_trigger.clear()
+        for record in pending:
+            self._add(record)
+
+    def _write(self, event):
+        self._open()
+        #One write(), so lines from several processes never interleave:
+        os.write(self._fd, json.dumps(event) + '\n')
+        self._written += 1
+        return self._written
+
+    def _sync_to(self, seq):
+        """Block until event number `seq` has been fsync'd.
+
+        Whoever finds no sync in progress does one on behalf of everything
+        written so far; anyone arriving meanwhile waits for the next.
+        """
+        with self._cond:
+            while self._synced < seq:
+                if self._syncing:
+                    self._cond.wait()
+                    continue
+                self._syncing = True
+                target = self._written
+                fd = self._fd
+                self._lock.release()
+                try:
+                    os.fsync(fd)
+                finally:
+                    self._lock.acquire()
+                    self._syncing = False
+                    self._cond.notify_all()
+                self._synced = max(self._synced, target)
+                self.syncs += 1
+
+    def _load(self):
+        with open(self.path) as f:
+            lines = f.readlines()
+        self._torn = bool(lines) and not lines[-1].endswith('\n')
+        for n, line in enumerate(lines):
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+                if event['event'] == 'intent':
+                    record = ActionRecord(event['id'], event['kind'],
+                                          event['trigger'],
+                                          event['description'],
+                                          event['payload'], event['time'])
+                    self._add(record)
+                else:
+                    record = self._actions[event['id']]
+                    record.state = event['event']
+                    record.finished = event['time']
+                    record.error = event.get('error')
+            except (ValueError, KeyError) as e:
+                #e.g. a line cut short by a crash
+                logger.warn("Skipping bad line %d in %s: %s", n + 1,
+                            self.path, e)
+        n_pending = 0
+        for record in self._actions.itervalues():
+            if record.state == ActionState.pending:
+                n_pending += 1
+            else:
+                record.payload = None
+
+        logger.debug("Loaded %d actions (%d pending) from %s",
+                     len(self._actions), n_pending, self.path)
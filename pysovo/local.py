@@ -1,24 +1,18 @@
 import os
-import json
 
 import logging
 logger = logging.getLogger(__name__)
 
-from pysovo import contacts_file, default_email_config_file
+from pysovo import contacts, default_email_config_file
 from pysovo import comms
+from pysovo.config import store, email_account_schema
 
+#A live view, so edits to the account file are picked up without a restart:
 try:
-    with open(contacts_file) as f:
-        contacts = json.load(f)
-    logger.debug('Contacts loaded from ' + contacts_file)
-except Exception as e:
-    logger.warn("Could not load contacts file; reason:\n" + str(e))
-    contacts = {}
-
-try:
-    default_email_account = comms.email.load_account_settings_from_file(
-                                                    default_email_config_file)
+    default_email_account = store.view(default_email_config_file,
+                                       email_account_schema)
+    len(default_email_account)
     logger.debug("Default email account loaded from %s", default_email_config_file)
 except Exception as e:
-    logger.warn("Could not load default email account; reason:\n", +str(e))
+    logger.warn("Could not load default email account; reason:\n" + str(e))
     default_email_account = None
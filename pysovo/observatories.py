@@ -0,0 +1,165 @@
+"""
+Adapters for requesting follow-up observations from telescopes.
+
+Each :class:`Facility` wraps an ``astropysics.obstools.Site`` together with
+three functions:
+
+ - a predicate, deciding whether a target is worth requesting,
+ - a formatter, building the request (e.g. an email body), and
+ - a transport, actually sending it.
+
+A :class:`FacilityDispatcher` evaluates every facility concurrently and
+submits the resulting requests to an outbound queue, where they are sent in
+parallel; so a slow facility does not hold up the others. Given a
+:class:`pysovo.journal.ActionJournal`, it records each request there before
+sending, so that unsent requests can be replayed with :meth:`resubmit`.
+
+e.g.::
+
+    ami = Facility('ami', ami_site, formatter=format_ami_request,
+                   transport=send_ami_request_email,
+                   predicate=lambda target, dtime: target['position'].dec.degrees > -10)
+    dispatcher = FacilityDispatcher([ami], outbound_queue)
+    for facility, handle in dispatcher.dispatch(target, now):
+        ...
+
+Targets are dicts, as passed to the report templates, with at least a
+'position' entry (FK5 coordinates).
+"""
+
+import threading
+from multiprocessing.pool import ThreadPool
+import logging
+logger = logging.getLogger(__name__)
+
+from pysovo.comms.outbound import Priority
+
+
+class Facility(object):
+    """An observatory we can request follow-up from.
+
+    `predicate(target, dtime)` defaults to "ever rises above the site's
+    `target_min_elevation`"; `formatter(target, dtime)` returns a request,
+    which is passed to `transport(request)` to send it.
+    """
+    def __init__(self, name, site, formatter, transport, predicate=None,
+                 priority=Priority.telescope, retries=None):
+        self.name = name
+        self.site = site
+        self.formatter = formatter
+        self.transport = transport
+        self.predicate = predicate
+        self.priority = priority
+        self.retries = retries
+        self.requests = 0
+        self.errors = 0
+
+    def accepts(self, target, dtime, cache=None):
+        if self.predicate is not None:
+            return self.predicate(target, dtime)
+        if cache is None:
+            import pysovo.ephem
+            cache = pysovo.ephem.SiteEphemCache(self.site)
+        return cache.classify(target['position'].dec.degrees) != 'never'
+
+    def format_request(self, target, dtime):
+        return self.formatter(target, dtime)
+
+
+class FacilityDispatcher(object):
+    """Evaluates facilities concurrently and queues their requests.
+
+    `site_caches`, if given, is a :class:`pysovo.ephem.SiteEphemCacheRegistry`
+    used by the default visibility predicate. Requests are journalled as
+    actions of kind ``<facility name>_request`` if `journal` is given.
+    """
+    def __init__(self, facilities, outbound_queue, site_caches=None,
+                 threads=8, journal=None):
+        self.facilities = list(facilities)
+        self.outbound_queue = outbound_queue
+        self.site_caches = site_caches
+        self.journal = journal
+        self.threads = threads
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def sites(self):
+        return [f.site for f in self.facilities]
+
+    def add(self, facility):
+        if facility.name in [f.name for f in self.facilities]:
+            raise ValueError("Duplicate facility name: " + facility.name)
+        self.facilities.append(facility)
+
+    def facility(self, name):
+        for f in self.facilities:
+            if f.name == name:
+                return f
+        raise KeyError(name)
+
+    def dispatch(self, target, dtime, exclude=(), trigger=None):
+        """Request `target` from every facility that accepts it.
+
+        Facilities named in `exclude` are skipped; `trigger` is recorded
+        against journalled requests. Returns a list of
+        (facility, DispatchHandle) for the requests submitted.
+        """
+        facilities = [f for f in self.facilities if f.name not in exclude]
+        if not facilities:
+            return []
+        prepared = self._get_pool().map(
+                        lambda f: self._prepare(f, target, dtime), facilities)
+        submitted = []
+        for facility, request in zip(facilities, prepared):
+            if request is None:
+                continue
+            facility.requests += 1
+            action_id = None
+            if self.journal is not None:
+                action_id = self.journal.intent(facility.name + '_request',
+                                dict(request=request), trigger=trigger,
+                                description='%s request' % facility.name)
+            submitted.append((facility,
+                              self._submit(facility, request, action_id)))
+        return submitted
+
+    def resubmit(self, record):
+        """Send a journalled request again (see ActionJournal.replay)."""
+        facility = self.facility(record.kind[:-len('_request')])
+        return self._submit(facility, record.payload['request'],
+                            record.action_id)
+
+    def _submit(self, facility, request, action_id):
+        callback = None
+        if action_id is not None:
+            callback = lambda handle: self.journal.finish(action_id, handle)
+        return self.outbound_queue.submit(facility.transport, (request,),
+                    priority=facility.priority,
+                    retries=facility.retries,
+                    description='%s request' % facility.name,
+                    callback=callback)
+
+    def _prepare(self, facility, target, dtime):
+        """Return the facility's request for `target`, or None."""
+        try:
+            cache = None
+            if self.site_caches is not None:
+                cache = self.site_caches[facility.site]
+            if not facility.accepts(target, dtime, cache):
+                return None
+            return facility.format_request(target, dtime)
+        except Exception:
+            facility.errors += 1
+            logger.exception("Error preparing %s request", facility.name)
+            return None
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.threads)
+            return self._pool
+
+    def stats(self):
+        """Per-facility (name, requests, errors)."""
+        return [(f.name, f.requests, f.errors) for f in self.facilities]
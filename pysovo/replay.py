@@ -0,0 +1,126 @@
+"""
+Replay historical packets through a packet handler, for load testing.
+
+Packets are read from a directory tree of XML files or from an
+:class:`pysovo.archive.ArchiveStore`, and fed to the handler with their
+original spacing, sped up by some factor, or all at once ('burst').
+See ``replay_alerts.py`` for running the full alert pipeline this way,
+with local stand-ins for the SMTP and SMS services.
+"""
+
+import os
+import time
+import bisect
+import resource
+import logging
+logger = logging.getLogger(__name__)
+
+default_latency_bins = (0.001, 0.01, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+
+def packets_from_directory(rootdir):
+    """Yield (timestamp, raw packet) for each ``*.xml`` file under `rootdir`,
+    ordered by modification time."""
+    paths = []
+    for dirpath, _, filenames in os.walk(rootdir):
+        paths.extend(os.path.join(dirpath, f) for f in filenames
+                     if f.endswith('.xml'))
+    for path in sorted(paths, key=os.path.getmtime):
+        with open(path, 'rb') as f:
+            yield os.path.getmtime(path), f.read()
+
+def packets_from_archive(store, stream=None, start=None, end=None):
+    """Yield (timestamp, raw packet) from an ArchiveStore, in archive order."""
+    for entry in store.query(stream, start, end):
+        yield entry.timestamp, store.read(entry)
+
+
+class RecordingSender(object):
+    """Stand-in for a send function (e.g. SMS): records calls, sends nothing."""
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+
+
+class ReplayReport(object):
+    """Results of a replay run.
+
+    `latencies` are per-packet handler times; `lags` are from each packet's
+    scheduled arrival to handler completion, so include any queueing delay
+    when the handler cannot keep up.
+    """
+    def __init__(self):
+        self.latencies = []
+        self.lags = []
+        self.errors = 0
+        self.elapsed = 0.0
+        self.max_rss_kb = 0
+
+    @property
+    def n_packets(self):
+        return len(self.latencies)
+
+    def throughput(self):
+        """Packets handled per second of wall-clock time."""
+        return self.n_packets / self.elapsed if self.elapsed else float('nan')
+
+    def histogram(self, values=None, bins=default_latency_bins):
+        """Count of `values` (default: latencies) up to each bin edge,
+        plus a final overflow count."""
+        if values is None:
+            values = self.latencies
+        counts = [0] * (len(bins) + 1)
+        for v in values:
+            counts[bisect.bisect_left(bins, v)] += 1
+        return counts
+
+    def format(self, bins=default_latency_bins):
+        lines = ["Packets: %d (%d errors) in %.2f s, %.1f packets/s"
+                 % (self.n_packets, self.errors, self.elapsed,
+                    self.throughput()),
+                 "Peak memory: %.1f MB" % (self.max_rss_kb / 1024.0)]
+        for name, values in (('Handler latency', self.latencies),
+                             ('Arrival-to-done lag', self.lags)):
+            lines.append(name + ":")
+            counts = self.histogram(values, bins)
+            edges = ['<= %gs' % b for b in bins] + ['> %gs' % bins[-1]]
+            for edge, count in zip(edges, counts):
+                lines.append("  %10s: %d" % (edge, count))
+        return '\n'.join(lines)
+
+
+def replay(packets, handler, speedup=1.0):
+    """Feed raw packets to `handler`, paced by their timestamps.
+
+    `packets` yields (timestamp, raw packet) pairs in time order.
+    Gaps between packets are divided by `speedup`; if `speedup` is None
+    they are ignored altogether (burst mode).
+    Handler exceptions are logged and counted. Returns a :class:`ReplayReport`.
+    """
+    report = ReplayReport()
+    start = time.time()
+    first_timestamp = None
+    for timestamp, packet in packets:
+        if first_timestamp is None:
+            first_timestamp = timestamp
+        if speedup is None:
+            due = time.time()
+        else:
+            due = start + (timestamp - first_timestamp) / float(speedup)
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        handler_start = time.time()
+        try:
+            handler(packet)
+        except Exception:
+            report.errors += 1
+            logger.exception("Error handling replayed packet")
+        done = time.time()
+        report.latencies.append(done - handler_start)
+        report.lags.append(done - due)
+    report.elapsed = time.time() - start
+    report.max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return report
@@ -0,0 +1,52 @@
+"""
+A shared, pre-compiled Jinja2 environment for the report templates.
+
+Compiled templates are kept in a persistent bytecode cache under the pysovo
+config folder, so a freshly started process loads them without re-parsing
+the template source.
+"""
+
+import os
+import logging
+logger = logging.getLogger(__name__)
+
+import jinja2
+
+from pysovo import config_folder
+from pysovo.formatting import format_datetime
+
+template_cache_dir = os.path.join(config_folder, 'template_cache')
+
+report_templates = ('notify_example.txt', 'notify_digest.txt',
+                    'visibility_report.txt')
+
+_env = None
+
+def make_environment(cache_dir=template_cache_dir):
+    """Build the template environment, with a bytecode cache if possible."""
+    bytecode_cache = None
+    if cache_dir is not None:
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            bytecode_cache = jinja2.FileSystemBytecodeCache(cache_dir)
+        except OSError as e:
+            logger.warn("Template bytecode cache disabled; reason:\n" + str(e))
+    env = jinja2.Environment(loader=jinja2.PackageLoader('pysovo', 'templates'),
+                             trim_blocks=True,
+                             auto_reload=False,
+                             bytecode_cache=bytecode_cache)
+    env.filters['datetime'] = format_datetime
+    return env
+
+def environment():
+    """The shared environment, created and pre-compiled on first use."""
+    global _env
+    if _env is None:
+        _env = make_environment()
+        for name in report_templates:
+            _env.get_template(name)
+    return _env
+
+def get_template(name):
+    return environment().get_template(name)
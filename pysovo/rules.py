@@ -0,0 +1,122 @@
+"""
+Routing of incoming packets to handler functions.
+
+Handlers are registered with a :class:`RuleRegistry`, declaring the IVORN
+prefix they respond to, and optionally the packet roles and a predicate on
+the parsed packet. The registry compiles the prefixes into a trie, so
+routing a packet costs a single walk along its IVORN however many rules are
+registered.
+
+e.g.::
+
+    rules = RuleRegistry()
+
+    @rules.handler(ivorn_prefix="ivo://nasa.gsfc.gcn/SWIFT#BAT_GRB_Pos")
+    def swift_bat_grb_logic(v):
+        ...
+
+    rules.dispatch(voevent)
+"""
+
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Rule(object):
+    """A handler plus the conditions under which it should be run.
+
+    `roles`, if given, is a collection of VOEvent roles (e.g. 'observation')
+    the handler accepts; `predicate`, if given, is called with the parsed
+    packet and must return True for the handler to run.
+    """
+    def __init__(self, name, handler, ivorn_prefix, roles=None, predicate=None):
+        self.name = name
+        self.handler = handler
+        self.ivorn_prefix = ivorn_prefix
+        self.roles = None if roles is None else frozenset(roles)
+        self.predicate = predicate
+        self.matches = 0
+        self.errors = 0
+        self.total_time = 0.0
+
+    def accepts_role(self, role):
+        return self.roles is None or role in self.roles
+
+
+class RuleRegistry(object):
+    def __init__(self):
+        self.rules = []
+        self._trie = None
+
+    def add(self, rule):
+        if rule.name in [r.name for r in self.rules]:
+            raise ValueError("Duplicate rule name: " + rule.name)
+        self.rules.append(rule)
+        self._trie = None
+        return rule
+
+    def handler(self, ivorn_prefix, roles=None, predicate=None, name=None):
+        """Decorator registering a function as a rule handler."""
+        def register(func):
+            self.add(Rule(name or func.__name__, func, ivorn_prefix,
+                          roles, predicate))
+            return func
+        return register
+
+    def match(self, ivorn, role=None):
+        """Rules whose IVORN prefix (and role, if given) match.
+
+        Predicates are not checked, so this can be used for triage before a
+        packet is fully parsed.
+        """
+        if self._trie is None:
+            self._compile()
+        matched = []
+        node = self._trie
+        for char in ivorn:
+            matched.extend(node[1])
+            node = node[0].get(char)
+            if node is None:
+                break
+        else:
+            matched.extend(node[1])
+        return [r for r in matched if role is None or r.accepts_role(role)]
+
+    def dispatch(self, voevent):
+        """Run all matching handlers on a parsed packet, in registration order.
+
+        Returns the list of rules that were run.
+        """
+        matched = self.match(voevent.attrib['ivorn'],
+                             voevent.attrib.get('role'))
+        run = []
+        for rule in sorted(matched, key=self.rules.index):
+            if rule.predicate is not None and not rule.predicate(voevent):
+                continue
+            rule.matches += 1
+            start = time.time()
+            try:
+                rule.handler(voevent)
+            except Exception:
+                rule.errors += 1
+                raise
+            finally:
+                rule.total_time += time.time() - start
+            run.append(rule)
+        return run
+
+    def stats(self):
+        """Per-rule (name, matches, errors, total handler seconds)."""
+        return [(r.name, r.matches, r.errors, r.total_time)
+                for r in self.rules]
+
+    def _compile(self):
+        #Each node is a pair ({char: child_node}, [rules ending here])
+        root = ({}, [])
+        for rule in self.rules:
+            node = root
+            for char in rule.ivorn_prefix:
+                node = node[0].setdefault(char, ({}, []))
+            node[1].append(rule)
+        self._trie = root
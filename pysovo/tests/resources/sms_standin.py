@@ -0,0 +1,98 @@
+"""A minimal local HTTP server standing in for the TextMagic SMS API."""
+
+import BaseHTTPServer
+import SocketServer
+import itertools
+import json
+import threading
+import time
+import urlparse
+
+
+class StandinSMSServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Records API calls; runs in a background thread.
+
+    Sent messages start with status 'r' (sent); set entries in
+    :attr:`statuses` to change what status checks report.
+    Set :attr:`delay` to hold each response for that many seconds, or
+    :attr:`drop_connections` to close each connection after one response
+    (as a server timing out idle keep-alive connections would).
+    Listens on an OS-assigned localhost port, see :meth:`account`.
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), _Handler)
+        self.calls = []
+        self.connections = 0
+        self.statuses = {}
+        self.balance = 100.0
+        self.delay = 0
+        self.drop_connections = False
+        self._ids = itertools.count(1000)
+        self._lock = threading.Lock()
+
+    def account(self):
+        """A pysovo SMS account dict pointing at this server."""
+        return {'username': 'test', 'api_password': 'secret',
+                'api_url': 'http://127.0.0.1:%d/app/api'
+                           % self.server_address[1]}
+
+    def sent(self):
+        """(text, [phones]) for each 'send' call received."""
+        return [(c['text'], c['phone'].split(',')) for c in self.calls
+                if c['cmd'] == 'send']
+
+    def handle_api_call(self, params):
+        with self._lock:
+            self.calls.append(params)
+            if params.get('password') != 'secret':
+                return {'error_code': 5, 'error_message': 'Invalid password'}
+            if params['cmd'] == 'send':
+                ids = {}
+                for phone in params['phone'].split(','):
+                    message_id = str(next(self._ids))
+                    ids[message_id] = phone
+                    self.statuses[message_id] = 'r'
+                return {'message_id': ids, 'sent_text': params['text'],
+                        'parts_count': 1}
+            if params['cmd'] == 'message_status':
+                return dict((i, {'status': self.statuses.get(i, 'u')})
+                            for i in params['ids'].split(','))
+            if params['cmd'] == 'account':
+                return {'balance': self.balance}
+            return {'error_code': 3, 'error_message': 'Command undefined'}
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length', 0))
+        params = dict(urlparse.parse_qsl(self.rfile.read(length)))
+        body = json.dumps(self.server.handle_api_call(params))
+        time.sleep(self.server.delay)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.server.drop_connections:
+            self.close_connection = 1
+
+    def log_message(self, format, *args):
+        pass
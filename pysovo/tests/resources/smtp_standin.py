@@ -0,0 +1,60 @@
+"""A minimal local SMTP server, standing in for the real thing in tests."""
+
+import asyncore
+import smtpd
+import threading
+
+
+class StandinSMTPServer(smtpd.SMTPServer):
+    """Records received messages; runs its asyncore loop in a thread.
+
+    Listens on an OS-assigned localhost port, see :attr:`port`.
+    """
+    def __init__(self, host='127.0.0.1', port=0):
+        smtpd.SMTPServer.__init__(self, (host, port), None)
+        self.messages = []
+        self.connections = 0
+        self._channels = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.socket.getsockname()[1]
+
+    def account(self):
+        """A pysovo email account dict pointing at this server."""
+        return {'smtp_server': '127.0.0.1', 'smtp_port': self.port,
+                'username': 'pysovo@localhost', 'password': ''}
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            conn, addr = pair
+            self.connections += 1
+            self._channels.append(smtpd.SMTPChannel(self, conn, addr))
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append((mailfrom, rcpttos, data))
+
+    def drop_connections(self):
+        """Close all client sessions from the server side."""
+        for channel in self._channels:
+            channel.close()
+        self._channels = []
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.drop_connections()
+        self.close()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            asyncore.loop(timeout=0.01, count=1)
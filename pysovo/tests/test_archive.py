@@ -0,0 +1,211 @@
+import unittest
+import os
+import shutil
+import tempfile
+import datetime
+import multiprocessing
+import pytz
+from pysovo.archive import ArchiveStore, ArchiveWriter, import_tree, export_tree
+from pysovo.tests.resources import datapaths
+
+swift_ivorn = 'ivo://nasa.gsfc.gcn/SWIFT#BAT_GRB_Pos_532871-729'
+test_ivorn = 'ivo://voevent.astro.soton/TEST#42'
+
+class TestArchiveStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store_root = os.path.join(self.tmpdir, 'store')
+        with open(datapaths.swift_bat_grb_pos_v2) as f:
+            self.packet = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_append_and_read(self):
+        store = ArchiveStore(self.store_root)
+        store.append(swift_ivorn, self.packet)
+        store.append(test_ivorn, '<test/>')
+        self.assertTrue(swift_ivorn in store)
+        self.assertFalse('ivo://unknown#1' in store)
+        self.assertEqual(store.get(swift_ivorn), self.packet)
+        self.assertEqual(store.get(test_ivorn), '<test/>')
+        store.close()
+
+    def test_index_persists(self):
+        store = ArchiveStore(self.store_root)
+        store.append(swift_ivorn, self.packet)
+        store.close()
+        reopened = ArchiveStore(self.store_root)
+        self.assertEqual(len(reopened), 1)
+        self.assertEqual(reopened.get(swift_ivorn), self.packet)
+        reopened.append(test_ivorn, '<test/>')
+        self.assertEqual(reopened.get(test_ivorn), '<test/>')
+        reopened.close()
+
+    def test_segments_roll_over(self):
+        store = ArchiveStore(self.store_root,
+                             max_segment_bytes=2 * len(self.packet))
+        for i in range(5):
+            store.append('ivo://test/stream#%d' % i, self.packet)
+        self.assertEqual(store.entry('ivo://test/stream#4').segment, 2)
+        for i in range(5):
+            self.assertEqual(store.get('ivo://test/stream#%d' % i),
+                             self.packet)
+        store.close()
+
+    def test_query(self):
+        store = ArchiveStore(self.store_root)
+        t0 = datetime.datetime(2013, 1, 1, tzinfo=pytz.utc)
+        day = datetime.timedelta(days=1)
+        store.append(swift_ivorn, self.packet, archived_at=t0)
+        store.append(test_ivorn, '<test/>', archived_at=t0 + day)
+        store.append('ivo://nasa.gsfc.gcn/SWIFT#2', '<2/>',
+                     archived_at=t0 + 2 * day)
+        swift = store.query(stream='nasa.gsfc.gcn/SWIFT')
+        self.assertEqual([e.ivorn for e in swift],
+                         [swift_ivorn, 'ivo://nasa.gsfc.gcn/SWIFT#2'])
+        recent = store.query(start=t0 + day)
+        self.assertEqual(len(recent), 2)
+        swift_early = store.query(stream='nasa.gsfc.gcn/SWIFT', end=t0 + day)
+        self.assertEqual([e.ivorn for e in swift_early], [swift_ivorn])
+        store.close()
+
+    def test_query_stream_boundary(self):
+        store = ArchiveStore(self.store_root)
+        store.append(swift_ivorn, self.packet)
+        store.append('ivo://nasa.gsfc.gcn/SWIFTX#1', '<x/>')
+        store.append('ivo://nasa.gsfc.gcn/SWIFT/sub#1', '<sub/>')
+        for stream in ('nasa.gsfc.gcn/SWIFT', 'ivo://nasa.gsfc.gcn/SWIFT'):
+            self.assertEqual([e.ivorn for e in store.query(stream)],
+                             [swift_ivorn, 'ivo://nasa.gsfc.gcn/SWIFT/sub#1'])
+        self.assertEqual([e.ivorn for e in
+                          store.query('ivo://nasa.gsfc.gcn/SWIFT#BAT_GRB')],
+                         [swift_ivorn])
+        store.close()
+
+    def test_torn_index_line(self):
+        store = ArchiveStore(self.store_root)
+        store.append(swift_ivorn, self.packet)
+        store.close()
+        with open(os.path.join(self.store_root, 'index.txt'), 'a') as f:
+            f.write('ivo://test/stream#crashed\ttest/str') #Crash mid-write
+        store = ArchiveStore(self.store_root)
+        store.append(test_ivorn, '<test/>')
+        store.close()
+        reopened = ArchiveStore(self.store_root)
+        self.assertEqual([e.ivorn for e in reopened.query()],
+                         [swift_ivorn, test_ivorn])
+        reopened.close()
+
+    def test_shared_store(self):
+        #Two stores on one root stand in for two processes:
+        a = ArchiveStore(self.store_root)
+        b = ArchiveStore(self.store_root)
+        a.append('ivo://test/stream#1', 'AAAA')
+        b.append('ivo://test/stream#2', 'BBBBBBBB')
+        a.append('ivo://test/stream#3', 'CC')
+        for store in (a, b):
+            self.assertEqual([store.get('ivo://test/stream#%d' % i)
+                              for i in (1, 2, 3)], ['AAAA', 'BBBBBBBB', 'CC'])
+        a.close()
+        b.close()
+
+    def test_index_read_lazily(self):
+        store = ArchiveStore(self.store_root)
+        store.append(swift_ivorn, self.packet)
+        store.close()
+        #e.g. a one-shot run, which only appends:
+        store = ArchiveStore(self.store_root)
+        store.append(test_ivorn, '<test/>')
+        self.assertFalse(store._loaded)
+        self.assertEqual(len(store), 2)
+        store.close()
+
+    def test_processes_appending(self):
+        def append(label):
+            store = ArchiveStore(self.store_root, max_segment_bytes=1024)
+            for i in range(100):
+                store.append('ivo://test/%s#%d' % (label, i),
+                              '<%s %d/>' % (label, i) * (i % 7 + 1))
+            store.close()
+        workers = [multiprocessing.Process(target=append, args=(label,))
+                   for label in ('a', 'b', 'c')]
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join()
+            self.assertEqual(p.exitcode, 0)
+        store = ArchiveStore(self.store_root)
+        self.assertEqual(len(store), 300)
+        for label in ('a', 'b', 'c'):
+            for i in range(100):
+                self.assertEqual(store.get('ivo://test/%s#%d' % (label, i)),
+                                 '<%s %d/>' % (label, i) * (i % 7 + 1))
+        self.assertTrue(store.entry('ivo://test/a#99').segment > 0)
+        store.close()
+
+    def test_empty_packet_in_empty_segment(self):
+        store = ArchiveStore(self.store_root)
+        store.append(test_ivorn, '')
+        self.assertEqual(store.get(test_ivorn), '')
+        store.close()
+
+    def test_migration_round_trip(self):
+        store = ArchiveStore(self.store_root)
+        store.append(swift_ivorn, self.packet)
+        store.append(test_ivorn, '<test/>')
+        tree = os.path.join(self.tmpdir, 'tree')
+        self.assertEqual(export_tree(store, tree), 2)
+        self.assertTrue(os.path.exists(
+            os.path.join(tree, 'voevent.astro.soton', 'TEST', '42.xml')))
+        store.close()
+
+        migrated = ArchiveStore(os.path.join(self.tmpdir, 'migrated'))
+        self.assertEqual(import_tree(migrated, tree), 2)
+        self.assertEqual(migrated.get(swift_ivorn), self.packet)
+        self.assertEqual(migrated.get(test_ivorn), '<test/>')
+        #Re-running skips packets already imported:
+        self.assertEqual(import_tree(migrated, tree), 0)
+        migrated.close()
+
+
+class TestArchiveWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = ArchiveStore(os.path.join(self.tmpdir, 'store'))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_flush_is_barrier(self):
+        writer = ArchiveWriter(self.store)
+        for i in range(50):
+            writer.submit('ivo://test/stream#%d' % i, '<packet %d/>' % i)
+        self.assertTrue(writer.flush(timeout=5))
+        self.assertEqual(writer.pending(), 0)
+        self.assertEqual(len(self.store), 50)
+        self.assertEqual(self.store.get('ivo://test/stream#7'), '<packet 7/>')
+        writer.close()
+        reopened = ArchiveStore(self.store.rootdir)
+        self.assertEqual(len(reopened), 50)
+        reopened.close()
+
+    def test_failed_batch(self):
+        def append_many(packets, sync=False):
+            raise IOError("No space left on device")
+        self.store.append_many = append_many
+        writer = ArchiveWriter(self.store)
+        writer.submit(test_ivorn, '<p/>')
+        self.assertFalse(writer.flush(timeout=5))
+        self.assertEqual((writer.pending(), writer.errors), (0, 1))
+        self.assertFalse(writer.close())
+        self.assertFalse(test_ivorn in self.store)
+
+    def test_bounded_queue_and_close(self):
+        writer = ArchiveWriter(self.store, max_queue=2, max_batch=1)
+        for i in range(10):
+            writer.submit('ivo://test/stream#%d' % i, '<p/>')
+        writer.close()
+        self.assertEqual(writer.written, 10)
+        self.assertRaises(ValueError, writer.submit, 'ivo://test/s#x', '<p/>')
@@ -0,0 +1,74 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+import time
+import pysovo.benchmarks as bench
+import pysovo.reports
+from pysovo.config import ConfigError
+
+def result(median):
+    return dict(median=median, min=median, repeats=1)
+
+class TestBenchmarks(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        #Keep the template bytecode cache out of the real config folder:
+        self.shared_env = pysovo.reports._env
+        pysovo.reports._env = pysovo.reports.make_environment(
+                                cache_dir=os.path.join(self.tmpdir, 'cache'))
+
+    def tearDown(self):
+        pysovo.reports._env = self.shared_env
+        shutil.rmtree(self.tmpdir)
+
+    def test_run_suite(self):
+        stages = ['parse', 'convert_coords', 'render', 'archive_write']
+        results = bench.run_suite(stages, repeats=2)
+        self.assertEqual(results.keys(), stages)
+        for r in results.values():
+            self.assertTrue(0 < r['min'] <= r['median'])
+            self.assertEqual(r['repeats'], 2)
+        self.assertRaises(ValueError, bench.run_suite, ['no_such_stage'])
+
+    def test_check_regressions(self):
+        baseline = {'parse': result(0.010), 'render': result(0.010),
+                    'tiny': result(1e-6)}
+        current = {'parse': result(0.012), 'render': result(0.020),
+                   'tiny': result(1e-5), 'new': result(1.0)}
+        regressions = bench.check_regressions(current, baseline, {})
+        self.assertEqual([r.stage for r in regressions], ['render'])
+        self.assertAlmostEqual(regressions[0].ratio, 2.0)
+        #Per-stage thresholds override the default:
+        regressions = bench.check_regressions(current, baseline,
+                                              {'parse': 1.1, 'render': 3.0})
+        self.assertEqual([r.stage for r in regressions], ['parse'])
+
+    def test_results_store(self):
+        store = bench.ResultsStore(os.path.join(self.tmpdir, 'results'))
+        self.assertEqual(store.commits(), [])
+        store.save('abc123', {'parse': result(0.01)})
+        time.sleep(0.01)
+        store.save('def456', {'parse': result(0.02)})
+        self.assertEqual(store.commits(), ['abc123', 'def456'])
+        self.assertEqual(store.load('def456')['results']['parse']['median'],
+                         0.02)
+        #By full hash, only if recorded on the given machine:
+        self.assertEqual(store.find('abc123f00d')['commit'], 'abc123')
+        self.assertEqual(store.find('abc123f00d',
+                                    machine=bench.current_machine())['commit'],
+                         'abc123')
+        self.assertEqual(store.find('abc123', machine='elsewhere'), None)
+        store.save('fed789-dirty', {'parse': result(0.01)})
+        self.assertEqual(store.find('fed789'), None)
+
+    def test_load_thresholds(self):
+        path = os.path.join(self.tmpdir, 'thresholds.json')
+        with open(path, 'w') as f:
+            json.dump({'render': 1.5}, f)
+        self.assertEqual(bench.load_thresholds(path), {'render': 1.5})
+        bad_path = os.path.join(self.tmpdir, 'bad_thresholds.json')
+        with open(bad_path, 'w') as f:
+            json.dump({'render': 'fast'}, f)
+        self.assertRaises(ConfigError, bench.load_thresholds, bad_path)
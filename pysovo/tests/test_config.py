@@ -0,0 +1,68 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+from pysovo.config import (ConfigStore, ConfigError, validate, Optional,
+                           any_key, contacts_schema, email_account_schema)
+
+class TestValidate(unittest.TestCase):
+    def test_contacts(self):
+        validate({'tim': {'email': 'tim@example.com', 'mobile': '447'},
+                  'ami': {'email': ['a@example.com'], 'requester': 'X'}},
+                 contacts_schema)
+        self.assertRaises(ConfigError, validate,
+                          {'tim': {'email': 42}}, contacts_schema)
+        self.assertRaises(ConfigError, validate, ['tim'], contacts_schema)
+
+    def test_required_keys(self):
+        schema = {'a': int, Optional('b'): int}
+        validate({'a': 1}, schema)
+        self.assertRaises(ConfigError, validate, {'b': 1}, schema)
+        self.assertRaises(ConfigError, validate, {'a': 1, 'b': 'x'}, schema)
+
+
+class TestConfigStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'contacts.json')
+        self.store = ConfigStore(check_interval=0)
+        self.write({'tim': {'email': 'tim@example.com'}})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, contents):
+        #Write then rename, so the file's inode (and signature) changes:
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(contents, f)
+        os.rename(self.path + '.tmp', self.path)
+
+    def test_loaded_once(self):
+        cfg = self.store.file(self.path, contacts_schema)
+        for _ in range(10):
+            self.assertEqual(cfg.get()['tim']['email'], 'tim@example.com')
+        self.assertEqual(cfg.loads, 1)
+        self.assertTrue(self.store.file(self.path) is cfg)
+
+    def test_hot_reload(self):
+        contacts = self.store.view(self.path, contacts_schema)
+        self.assertEqual(contacts['tim']['email'], 'tim@example.com')
+        self.write({'tim': {'email': 'new@example.com'}, 'rob': {}})
+        self.assertEqual(contacts['tim']['email'], 'new@example.com')
+        self.assertEqual(sorted(contacts), ['rob', 'tim'])
+
+    def test_invalid_edit_keeps_previous(self):
+        contacts = self.store.view(self.path, contacts_schema)
+        self.assertEqual(len(contacts), 1)
+        self.write({'tim': {'email': 42}})
+        self.assertEqual(contacts['tim']['email'], 'tim@example.com')
+        with open(self.path, 'w') as f:
+            f.write('{not json')
+        self.assertEqual(contacts['tim']['email'], 'tim@example.com')
+
+    def test_missing_file(self):
+        missing = os.path.join(self.tmpdir, 'email_acc')
+        self.assertEqual(len(self.store.view(missing, default={})), 0)
+        self.assertRaises(ConfigError, self.store.load, missing,
+                          email_account_schema)
@@ -0,0 +1,109 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy
+import voeparse
+from astropysics.coords.coordsys import FK5Coordinates
+from pysovo.archive import ArchiveStore
+from pysovo.crossmatch import PositionIndex, load_archive, error_radius
+from pysovo.utils import convert_voe_coords_to_fk5
+from pysovo.tests.resources import datapaths
+
+class TestPositionIndex(unittest.TestCase):
+    def test_matches_across_tree_and_buffer(self):
+        index = PositionIndex(rebuild_threshold=10)
+        rng = numpy.random.RandomState(42)
+        ras = rng.uniform(0, 360, 500)
+        decs = numpy.degrees(numpy.arcsin(rng.uniform(-1, 1, 500)))
+        for i, (ra, dec) in enumerate(zip(ras, decs)):
+            index.add_radec('ivo://test#%d' % i, ra, dec, 0.5)
+        self.assertTrue(index._n_tree > 0)
+        self.assertTrue(index._n_tree < len(index))
+        for i in (0, 499):
+            matches = index.query_radec(ras[i] + 0.1, decs[i], 0.1)
+            self.assertEqual(matches[0].ivorn, 'ivo://test#%d' % i)
+            self.assertTrue(matches[0].separation < 0.11)
+
+    def test_error_circles(self):
+        index = PositionIndex()
+        index.add_radec('ivo://test#wide', 10.0, 0.0, 2.0)
+        index.add_radec('ivo://test#narrow', 10.0, 1.5, 0.1,
+                        label='Repeater')
+        names = [m.ivorn for m in index.query_radec(10.0, 0.0, 0.01)]
+        self.assertEqual(names, ['ivo://test#wide'])
+        matches = index.query_radec(10.0, 0.0, 1.5)
+        self.assertEqual([m.label for m in matches], [None, 'Repeater'])
+        self.assertEqual(index.query_radec(10.0, 0.0, 1.5,
+                            exclude=['ivo://test#wide'])[0].label, 'Repeater')
+        #Across RA = 0:
+        index.add_radec('ivo://test#zero', 359.95, 0.0, 0.1)
+        self.assertEqual(index.query_radec(0.05, 0.0, 0.1)[0].ivorn,
+                         'ivo://test#zero')
+
+    def test_load_archive(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            store = ArchiveStore(tmpdir)
+            with open(datapaths.swift_bat_grb_pos_v2) as f:
+                packet = f.read()
+            v = voeparse.loads(packet)
+            store.append(v.attrib['ivorn'], packet)
+            store.append('ivo://test/stream#1', '<not a voevent/>')
+            index = PositionIndex()
+            self.assertEqual(load_archive(index, store), 1)
+            store.close()
+        finally:
+            shutil.rmtree(tmpdir)
+        posn = convert_voe_coords_to_fk5(voeparse.pull_astro_coords(v))
+        self.assertAlmostEqual(error_radius(posn), 0.05)
+        self.assertEqual(index.query(posn)[0].ivorn, v.attrib['ivorn'])
+        self.assertEqual(index.query(posn, exclude=[v.attrib['ivorn']]), [])
+
+    def test_position_log(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'positions', 'positions.jsonl')
+            index = PositionIndex()
+            index.add_radec('Repeater', 10.0, 0.0, 0.5, label='Repeater')
+            self.assertEqual(index.open_log(path), 0)
+            index.add_radec('ivo://test#1', 20.0, 10.0, 0.1)
+            index.close_log()
+            with open(path, 'a') as f:
+                f.write('{"ivorn": "ivo://test#2", "ra": ') #Crashed mid-write
+            reloaded = PositionIndex()
+            self.assertEqual(reloaded.open_log(path), 1)
+            self.assertEqual(reloaded.query_radec(20.0, 10.0)[0].ivorn,
+                             'ivo://test#1')
+            #Positions added before opening the log are not recorded:
+            self.assertEqual(reloaded.query_radec(10.0, 0.0), [])
+            reloaded.add_radec('ivo://test#3', 30.0, 10.0, 0.1)
+            reloaded.close_log()
+            index = PositionIndex()
+            self.assertEqual(index.open_log(path), 2)
+            self.assertEqual(index.query_radec(30.0, 10.0)[0].ivorn,
+                             'ivo://test#3')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_refresh(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'positions.jsonl')
+            #e.g. two worker processes sharing the log:
+            first, second = PositionIndex(), PositionIndex()
+            first.open_log(path)
+            second.open_log(path)
+            first.add_radec('ivo://test#1', 20.0, 10.0, 0.1)
+            second.add_radec('ivo://test#2', 30.0, 10.0, 0.1)
+            self.assertEqual(first.refresh(), 1)
+            self.assertEqual(second.refresh(), 1)
+            self.assertEqual(first.refresh(), 0)
+            for index in (first, second):
+                self.assertEqual(len(index), 2)
+                self.assertEqual(index.query_radec(30.0, 10.0)[0].ivorn,
+                                 'ivo://test#2')
+            first.close_log()
+            second.close_log()
+        finally:
+            shutil.rmtree(tmpdir)
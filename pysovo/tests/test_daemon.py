@@ -0,0 +1,55 @@
+import unittest
+import os
+import tempfile
+import shutil
+import threading
+import signal
+from pysovo.daemon import PacketListener, send_packet, interrupt_on_sigterm
+
+class TestPacketListener(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmpdir, 'pysovo.sock')
+        self.received = []
+        def handler(packet):
+            if packet == 'bad':
+                raise ValueError(packet)
+            self.received.append(packet)
+        self.listener = PacketListener(self.socket_path, handler)
+        self.listener.start()
+        self.server = threading.Thread(target=self.listener.serve_forever)
+        self.server.start()
+
+    def tearDown(self):
+        self.listener.shutdown()
+        self.server.join()
+        shutil.rmtree(self.tmpdir)
+
+    def test_packets_handled_in_order(self):
+        packets = ['<packet %d/>' % i for i in range(5)]
+        for p in packets:
+            send_packet(self.socket_path, p)
+        self.listener.shutdown(wait=True)
+        self.server.join()
+        self.assertEqual(self.received, packets)
+        self.assertEqual(self.listener.packets_handled, 5)
+        self.assertEqual(len(self.listener.latencies), 5)
+        self.assertEqual(self.listener.queue_depth(), 0)
+
+    def test_handler_error_does_not_stop_listener(self):
+        send_packet(self.socket_path, 'bad')
+        send_packet(self.socket_path, 'good')
+        self.listener.shutdown(wait=True)
+        self.server.join()
+        self.assertEqual(self.received, ['good'])
+        self.assertEqual(self.listener.handler_errors, 1)
+
+class TestSigterm(unittest.TestCase):
+    def test_sigterm_interrupts(self):
+        previous = signal.getsignal(signal.SIGTERM)
+        try:
+            interrupt_on_sigterm()
+            self.assertRaises(KeyboardInterrupt, os.kill, os.getpid(),
+                              signal.SIGTERM)
+        finally:
+            signal.signal(signal.SIGTERM, previous)
@@ -0,0 +1,96 @@
+import unittest
+import os
+import shutil
+import tempfile
+from pysovo.dedup import PacketIndex
+
+class TestPacketIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.snapshot = os.path.join(self.tmpdir, 'index.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_repeats_detected(self):
+        index = PacketIndex()
+        self.assertTrue(index.check_and_add('ivo://test#1'))
+        self.assertFalse(index.check_and_add('ivo://test#1'))
+        self.assertTrue('ivo://test#1' in index)
+
+    def test_redelivered_after_error(self):
+        index = PacketIndex()
+        handled = []
+        def handler(packet):
+            if not handled:
+                handled.append(None)
+                raise ValueError("Rule failed")
+            handled.append(packet)
+        with self.assertRaises(ValueError):
+            index.handle_once('ivo://test#1', handler, 'packet')
+        self.assertFalse('ivo://test#1' in index)
+        self.assertTrue(index.handle_once('ivo://test#1', handler, 'packet'))
+        self.assertFalse(index.handle_once('ivo://test#1', handler, 'packet'))
+        self.assertEqual(handled, [None, 'packet'])
+
+    def test_lru_eviction(self):
+        index = PacketIndex(max_ivorns=2)
+        index.check_and_add('ivo://test#1')
+        index.check_and_add('ivo://test#2')
+        index.check_and_add('ivo://test#1') #Refreshes 1
+        index.check_and_add('ivo://test#3')
+        self.assertTrue('ivo://test#1' in index)
+        self.assertFalse('ivo://test#2' in index)
+        self.assertEqual(len(index), 2)
+
+    def test_trigger_grouping(self):
+        index = PacketIndex()
+        first = index.trigger('532871', 'ivo://nasa.gsfc.gcn/SWIFT#BAT_GRB_Pos_532871-729')
+        self.assertTrue(first.is_new())
+        index.record_action('532871', 'ami_request')
+        update = index.trigger('532871', 'ivo://nasa.gsfc.gcn/SWIFT#BAT_GRB_Pos_532871-730')
+        self.assertTrue(update is first)
+        self.assertFalse(update.is_new())
+        self.assertEqual(len(update.ivorns), 2)
+        self.assertEqual(update.actions, ['ami_request'])
+
+    def test_snapshot_round_trip(self):
+        index = PacketIndex(snapshot_path=self.snapshot)
+        index.check_and_add('ivo://test#1')
+        index.trigger('532871', 'ivo://test#1')
+        index.record_action('532871', 'ami_request')
+        index.mark_retracted('532871')
+        index.save(force=True)
+        reloaded = PacketIndex(snapshot_path=self.snapshot)
+        self.assertTrue('ivo://test#1' in reloaded)
+        state = reloaded.trigger('532871')
+        self.assertEqual(state.actions, ['ami_request'])
+        self.assertTrue(state.retracted)
+
+    def test_save_rate_limited(self):
+        index = PacketIndex(snapshot_path=self.snapshot, snapshot_interval=60)
+        index.check_and_add('ivo://test#1')
+        index.save()
+        self.assertTrue(os.path.exists(self.snapshot))
+        index.check_and_add('ivo://test#2')
+        index.save()
+        self.assertFalse('ivo://test#2' in PacketIndex(snapshot_path=self.snapshot))
+
+    def test_merge_worker_snapshot(self):
+        worker_path = os.path.join(self.tmpdir, 'index.worker0.json')
+        worker = PacketIndex(snapshot_path=worker_path)
+        worker.check_and_add('ivo://test#2')
+        worker.trigger('532871', 'ivo://test#2')
+        worker.record_action('532871', 'ami_request')
+        worker.save(force=True)
+        index = PacketIndex()
+        index.check_and_add('ivo://test#1')
+        index.trigger('532871', 'ivo://test#1')
+        index.merge(worker_path)
+        self.assertTrue('ivo://test#1' in index)
+        self.assertTrue('ivo://test#2' in index)
+        state = index.trigger('532871')
+        self.assertEqual(state.ivorns, ['ivo://test#1', 'ivo://test#2'])
+        self.assertEqual(state.actions, ['ami_request'])
+        index.merge(worker_path) #Idempotent
+        self.assertEqual(state.actions, ['ami_request'])
@@ -0,0 +1,69 @@
+import unittest
+import shutil
+import tempfile
+import time
+import pysovo.reports
+from pysovo.comms.digest import NotificationDigester, RateLimit
+
+class TestNotificationDigester(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+        self.digester = NotificationDigester(self.send, window=0.2,
+                                             default_rate_limit=(100, 60))
+        #Digests are rendered with the shared template environment; keep
+        #its cache out of the real config folder:
+        self.cache_dir = tempfile.mkdtemp()
+        self.shared_env = pysovo.reports._env
+        pysovo.reports._env = pysovo.reports.make_environment(
+                                                    cache_dir=self.cache_dir)
+
+    def tearDown(self):
+        pysovo.reports._env = self.shared_env
+        shutil.rmtree(self.cache_dir)
+
+    def send(self, recipients, subject, body):
+        self.sent.append((sorted(recipients), subject, body))
+
+    def test_first_notification_sent_immediately(self):
+        self.digester.add('trigger:1', ['a', 'b'], 'Alert', 'Body')
+        self.assertEqual(self.sent, [(['a', 'b'], 'Alert', 'Body')])
+        self.assertEqual(self.digester.pending(), 0)
+
+    def test_repeats_coalesced_into_digest(self):
+        self.digester.add('trigger:1', ['a', 'b'], 'Alert', 'First')
+        self.digester.add('trigger:1', ['a', 'b'], 'Alert (update)', 'Second')
+        self.digester.add('trigger:1', ['a', 'b'], 'Alert (update)', 'Third')
+        self.digester.add('trigger:2', ['a'], 'Other', 'Unrelated')
+        self.assertEqual(len(self.sent), 2)
+        time.sleep(0.4)
+        self.assertEqual(len(self.sent), 3)
+        recipients, subject, body = self.sent[-1]
+        self.assertEqual(recipients, ['a', 'b'])
+        self.assertEqual(subject, 'Alert (update) [digest of 2]')
+        self.assertTrue(body.index('Third') < body.index('Second'))
+        self.assertTrue('First' not in body)
+        self.assertEqual(self.digester.digests_sent, 1)
+
+    def test_per_recipient_rate_limit(self):
+        self.digester.rate_limits['limited'] = (1, 60)
+        self.digester.add('trigger:1', ['limited', 'b'], 'One', 'Body')
+        self.digester.add('trigger:2', ['limited', 'b'], 'Two', 'Body')
+        self.assertEqual([s[:2] for s in self.sent],
+                         [(['b', 'limited'], 'One'), (['b'], 'Two')])
+        self.assertEqual(self.digester.pending(), 1)
+        self.digester.flush()
+        self.assertEqual(self.sent[-1][:2], (['limited'], 'Two'))
+        self.assertEqual(self.digester.pending(), 0)
+
+    def test_window_per_key_prefix(self):
+        self.digester.windows['stream:'] = 100
+        self.assertEqual(self.digester.window_for('stream:test'), 100)
+        self.assertEqual(self.digester.window_for('trigger:1'), 0.2)
+
+class TestRateLimit(unittest.TestCase):
+    def test_sliding_window(self):
+        limit = RateLimit(2, 10)
+        limit.record(0)
+        limit.record(1)
+        self.assertEqual(limit.next_allowed(5), 10)
+        self.assertEqual(limit.next_allowed(10.5), 10.5)
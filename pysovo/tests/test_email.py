@@ -0,0 +1,64 @@
+import unittest
+import time
+from pysovo.comms import email
+from pysovo.tests.resources.smtp_standin import StandinSMTPServer
+
+class TestSMTPConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.server = StandinSMTPServer().start()
+        self.account = self.server.account()
+        self.pool = email.SMTPConnectionPool(require_tls=False, timeout=5)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.server.stop()
+
+    def send(self, subject):
+        email.send_email(self.account, 'someone@localhost', subject,
+                         'Body text', pool=self.pool)
+
+    def test_session_reused(self):
+        for i in range(3):
+            self.send('Message %d' % i)
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(self.pool.connections_opened, 1)
+        self.assertEqual(self.server.connections, 1)
+        mailfrom, rcpttos, data = self.server.messages[0]
+        self.assertEqual(rcpttos, ['someone@localhost'])
+        self.assertTrue('Subject: Message 0' in data)
+
+    def test_reconnect_after_server_drop(self):
+        self.send('First')
+        self.server.drop_connections()
+        self.send('Second')
+        self.assertEqual(len(self.server.messages), 2)
+        self.assertEqual(self.pool.connections_opened, 2)
+
+    def test_keepalive_detects_stale_session(self):
+        self.pool.keepalive_interval = 0
+        self.send('First')
+        self.pool.keepalive()
+        self.assertEqual(len(self.pool._sessions), 1)
+        self.server.drop_connections()
+        self.pool.keepalive()
+        self.assertEqual(len(self.pool._sessions), 0)
+        self.send('Second')
+        self.assertEqual(len(self.server.messages), 2)
+
+    def test_background_keepalive(self):
+        self.pool.keepalive_interval = 0.05
+        self.pool.max_idle = 0.2
+        self.send('First')
+        self.pool.start_keepalive()
+        time.sleep(0.5) #Longer than max_idle, but NOOPs keep it fresh
+        self.send('Second')
+        self.assertEqual(self.pool.connections_opened, 1)
+        self.pool.close_all()
+        self.assertEqual(self.pool._keepalive_thread, None)
+
+    def test_session_recycled_after_max_messages(self):
+        self.pool.max_messages = 2
+        for i in range(3):
+            self.send('Message %d' % i)
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(self.pool.connections_opened, 2)
@@ -1,6 +1,9 @@
 import unittest
+import datetime
+import numpy
 from pysovo.tests.resources import greenwich
 import pysovo.ephem as ephem
+from astropysics.coords.coordsys import FK5Coordinates
 
 from pysovo.ephem import TargetStatusKeys as tkeys
 
@@ -28,6 +31,26 @@ class TestSiteVisibilityCalcs(unittest.TestCase):
                                     self.site, self.time)
         self.assertEqual(e[tkeys.type], 'always')
 
+    def test_report_dict_access(self):
+        vis = ephem.visibility(self.target, self.site, self.time)
+        self.assertTrue(isinstance(vis, ephem.VisibilityReport))
+        self.assertEqual(vis[tkeys.type], vis.type)
+        self.assertTrue(tkeys.rise_time in vis)
+        never = ephem.visibility(greenwich.never_visible_source, self.site,
+                                 self.time)
+        self.assertFalse(tkeys.rise_time in never)
+        self.assertRaises(KeyError, never.__getitem__, tkeys.rise_time)
+        self.assertEqual(sorted(never.keys()), ['site_lst', 'type'])
+        self.assertRaises(AttributeError, setattr, never, 'extra', 1)
+
+    def test_position_with_errors(self):
+        #e.g. as converted from a VOEvent, see utils.convert_voe_coords_to_fk5
+        target = FK5Coordinates(ra=self.target.ra.degrees,
+                                dec=self.target.dec.degrees,
+                                raerr=0.05, decerr=0.05)
+        self.assertEqual(ephem.visibility(target, self.site, self.time),
+                         ephem.visibility(self.target, self.site, self.time))
+
     def test_never_visible(self):
         e = ephem.visibility(greenwich.never_visible_source,
                                     self.site, self.time)
@@ -43,3 +66,198 @@ class TestSiteVisibilityCalcs(unittest.TestCase):
 
 
 
+class TestBatchVisibility(unittest.TestCase):
+    """Check the vectorized calcs against the per-target `visibility`."""
+    def setUp(self):
+        self.time = greenwich.vernal_equinox_2012
+        self.sites = [greenwich.greenwich_site, greenwich.anti_site]
+        self.targets = [FK5Coordinates(ra, dec)
+                        for ra in range(0, 360, 30)
+                        for dec in range(-80, 90, 20)]
+        self.batch = ephem.visibility_batch(self.targets, self.sites, self.time)
+
+    def offset(self, dtime):
+        return (dtime - self.time).total_seconds()
+
+    def test_shapes(self):
+        shape = (len(self.targets), len(self.sites))
+        self.assertEqual(self.batch.lst.shape, (len(self.sites),))
+        for field in ('hour_angle', 'altitude', 'type', 'visible_now',
+                      'rise_time', 'set_time', 'transit_time'):
+            self.assertEqual(getattr(self.batch, field).shape, shape)
+
+    def test_matches_per_target_visibility(self):
+        #NB astropysics' date handling for sites away from UTC can shift its
+        #rise / set / transit times by up to one day's sidereal drift (~4 min).
+        tolerances = [1.0, 240.0]
+        for i, tgt in enumerate(self.targets):
+            for j, site in enumerate(self.sites):
+                vis = ephem.visibility(tgt, site, self.time)
+                tol = tolerances[j]
+                type_name = ephem.VisibilityType.names[self.batch.type[i, j]]
+                self.assertEqual(type_name, vis[tkeys.type])
+                if type_name == 'never':
+                    continue
+                self.assertEqual(bool(self.batch.visible_now[i, j]),
+                                 bool(vis[tkeys.visible_now]))
+                self.assertAlmostEqual(self.batch.transit_time[i, j],
+                                       self.offset(vis[tkeys.trans_time]),
+                                       delta=tol)
+                if type_name == 'sometimes':
+                    self.assertAlmostEqual(self.batch.rise_time[i, j],
+                                           self.offset(vis[tkeys.rise_time]),
+                                           delta=tol)
+                    self.assertAlmostEqual(self.batch.set_time[i, j],
+                                           self.offset(vis[tkeys.set_time]),
+                                           delta=tol)
+
+    def test_records(self):
+        records = self.batch.to_records()
+        self.assertEqual(records.shape, self.batch.type.shape)
+        self.assertTrue((records['type'] == self.batch.type).all())
+        self.assertTrue(numpy.allclose(records['altitude'],
+                                       self.batch.altitude, atol=1e-4))
+        self.assertTrue(records.itemsize <= 32)
+
+    def test_lst(self):
+        self.assertAlmostEqual(self.batch.lst[0],
+                               greenwich.greenwish_lst_at_ve, places=3)
+
+    def test_altitude_at_transit(self):
+        b = ephem.visibility_batch([greenwich.equatorial_transiting_at_ve],
+                                   [greenwich.greenwich_site], self.time)
+        self.assertAlmostEqual(b.altitude[0, 0], 90 - 51.5, delta=0.1)
+        self.assertAlmostEqual(b.hour_angle[0, 0], 0, delta=0.01)
+
+class TestSiteEphemCache(unittest.TestCase):
+    def setUp(self):
+        self.time = greenwich.vernal_equinox_2012
+        self.site = greenwich.greenwich_site
+        self.cache = ephem.SiteEphemCache(self.site)
+
+    def test_matches_uncached_visibility(self):
+        for dec in range(-80, 90, 20):
+            for ra in range(0, 360, 30):
+                tgt = FK5Coordinates(ra, dec)
+                plain = ephem.visibility(tgt, self.site, self.time)
+                cached = ephem.visibility(tgt, self.site, self.time,
+                                          cache=self.cache)
+                self.assertEqual(plain[tkeys.type], cached[tkeys.type])
+                self.assertEqual(plain.get(tkeys.visible_now),
+                                 cached.get(tkeys.visible_now))
+                for key in (tkeys.rise_time, tkeys.set_time, tkeys.trans_time):
+                    if key in plain:
+                        diff = (plain[key] - cached[key]).total_seconds()
+                        self.assertTrue(abs(diff) < 1.0)
+
+    def test_lst(self):
+        self.assertAlmostEqual(self.cache.local_sidereal_time(self.time),
+                               greenwich.greenwish_lst_at_ve, places=3)
+        self.assertAlmostEqual(
+            self.cache.local_sidereal_time(greenwich.vernal_equinox_2012_p12h),
+            greenwich.greenwish_lst_at_ve_p12h, places=3)
+
+    def test_classify(self):
+        self.assertEqual(self.cache.classify(-70), 'never')
+        self.assertEqual(self.cache.classify(0), 'sometimes')
+        self.assertEqual(self.cache.classify(89), 'always')
+        anti = ephem.SiteEphemCache(greenwich.anti_site)
+        self.assertEqual(anti.classify(70), 'never')
+        self.assertEqual(anti.classify(-70), 'always')
+
+    def test_window_invalidation(self):
+        self.cache.local_sidereal_time(self.time)
+        self.cache.local_sidereal_time(greenwich.vernal_equinox_2012_p12h)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.cache.local_sidereal_time(self.time + datetime.timedelta(days=5))
+        self.assertEqual(self.cache.misses, 2)
+
+    def test_registry_bounded(self):
+        registry = ephem.SiteEphemCacheRegistry(max_sites=1)
+        self.assertTrue(registry[self.site] is registry[self.site])
+        registry[greenwich.anti_site]
+        self.assertEqual(len(registry._caches), 1)
+
+class TestSkyIndex(unittest.TestCase):
+    def setUp(self):
+        self.time = greenwich.vernal_equinox_2012
+        self.sites = [greenwich.greenwich_site, greenwich.anti_site]
+        self.index = ephem.SkyIndex(self.sites)
+
+    def test_candidates_match_classify(self):
+        caches = [ephem.SiteEphemCache(s) for s in self.sites]
+        for dec in range(-90, 91):
+            expected = [c.site for c in caches
+                        if c.classify(dec) != 'never']
+            self.assertEqual(self.index.candidates(dec), expected)
+
+    def test_observable(self):
+        north_only = ephem.SkyIndex([greenwich.greenwich_site])
+        self.assertFalse(north_only.observable(-70))
+        self.assertTrue(north_only.observable(-30))
+        self.assertTrue(self.index.observable(-70))
+
+    def test_visibility_reports_skip_non_candidates(self):
+        tgt = greenwich.never_visible_source
+        reports = dict((site.name, report) for site, report in
+                       ephem.visibility_reports(tgt, self.sites, self.time,
+                                                index=self.index))
+        for site in self.sites:
+            full = ephem.visibility(tgt, site, self.time)
+            self.assertEqual(reports[site.name][tkeys.type], full[tkeys.type])
+        self.assertEqual(reports['Greenwich'],
+                         ephem.visibility(tgt, greenwich.greenwich_site,
+                                          self.time))
+
+class TestVisibilityTimeline(unittest.TestCase):
+    def setUp(self):
+        self.time = greenwich.vernal_equinox_2012
+        self.sites = [greenwich.greenwich_site, greenwich.anti_site]
+        self.targets = [greenwich.equatorial_transiting_at_ve,
+                        greenwich.never_visible_source]
+
+    def test_shapes_and_start(self):
+        t = ephem.visibility_timeline(self.targets, self.sites, self.time,
+                                      span=datetime.timedelta(hours=2),
+                                      step=datetime.timedelta(minutes=10))
+        self.assertEqual(t.times.shape, (13,))
+        self.assertEqual(t.altitude.shape, (2, 2, 13))
+        self.assertEqual(t.observable.shape, (2, 2, 13))
+        batch = ephem.visibility_batch(self.targets, self.sites, self.time)
+        self.assertTrue(numpy.allclose(t.altitude[:, :, 0], batch.altitude,
+                                       atol=0.01))
+        self.assertAlmostEqual(t.airmass[0, 0, 0],
+                               1 / numpy.sin(numpy.radians(90 - 51.5)),
+                               delta=0.01)
+        self.assertTrue(numpy.isnan(t.airmass[1, 0, 0]))
+
+    def test_windows_match_rise_set(self):
+        tgt = greenwich.equatorial_transiting_at_ve
+        t = ephem.visibility_timeline([tgt], self.sites[:1], self.time,
+                                      span=datetime.timedelta(days=2),
+                                      step=datetime.timedelta(minutes=1))
+        vis = ephem.visibility(tgt, self.sites[0], self.time)
+        self.assertEqual(len(t.windows), 3)
+        self.assertEqual(t.windows[0]['start'], 0)
+        set_offset = (vis[tkeys.set_time] - self.time).total_seconds()
+        self.assertTrue(abs(t.windows[0]['end'] - set_offset) < 90)
+        self.assertFalse(ephem.visibility_timeline(
+                            [greenwich.never_visible_source], self.sites[:1],
+                            self.time).observable.any())
+
+    def test_sun_and_moon_masks(self):
+        #Sun near RA 0, Dec 0 at the equinox; so at local noon at Greenwich:
+        noon = self.time.replace(hour=12, minute=7)
+        t = ephem.visibility_timeline(self.targets, self.sites[:1], noon,
+                                      span=datetime.timedelta(hours=1),
+                                      sun_max_altitude=-12,
+                                      moon_min_separation=30)
+        self.assertAlmostEqual(t.sun_altitude[0, 0], 90 - 51.5, delta=0.5)
+        self.assertFalse(t.observable.any())
+        #Moon opposite the sun at full moon, near it at new moon:
+        jds = numpy.array([2455994.902, 2456009.109])
+        sun = ephem.sun_position(jds)
+        moon = ephem.moon_position(jds)
+        sep = ephem._separation(sun[0], sun[1], moon[0], moon[1])
+        self.assertTrue(sep[0] > 170)
+        self.assertTrue(sep[1] < 10)
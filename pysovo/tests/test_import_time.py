@@ -0,0 +1,49 @@
+import unittest
+import os
+import sys
+import json
+import subprocess
+import pysovo
+
+#Generous, to allow for slow / loaded test machines:
+import_time_budget = 0.5 #seconds
+
+heavy_modules = ('astropysics', 'scipy', 'numpy', 'jinja2', 'textmagic')
+
+probe_script = """
+import sys, time, json
+start = time.time()
+import %s
+elapsed = time.time() - start
+heavy = [m for m in %r if m in sys.modules]
+print json.dumps({'elapsed': elapsed, 'heavy': heavy})
+"""
+
+def probe_import(module_name):
+    """Import a module in a fresh interpreter; return (seconds, heavy modules)."""
+    package_root = os.path.dirname(os.path.dirname(pysovo.__file__))
+    env = dict(os.environ, PYTHONPATH=package_root)
+    output = subprocess.check_output(
+        [sys.executable, '-c', probe_script % (module_name, heavy_modules)],
+        env=env)
+    result = json.loads(output.strip().splitlines()[-1])
+    return result['elapsed'], result['heavy']
+
+
+class TestImportTime(unittest.TestCase):
+    def test_package_import_is_light(self):
+        elapsed, heavy = probe_import('pysovo')
+        self.assertEqual(heavy, [])
+        self.assertTrue(elapsed < import_time_budget,
+                        "import pysovo took %.3f s" % elapsed)
+
+    def test_comms_import_is_light(self):
+        elapsed, heavy = probe_import('pysovo.comms')
+        self.assertEqual(heavy, [])
+        self.assertTrue(elapsed < import_time_budget,
+                        "import pysovo.comms took %.3f s" % elapsed)
+
+    def test_submodules_load_on_access(self):
+        self.assertTrue(pysovo.ephem.visibility)
+        self.assertTrue('pysovo.ephem' in sys.modules)
+        self.assertRaises(AttributeError, getattr, pysovo, 'no_such_module')
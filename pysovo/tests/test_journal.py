@@ -0,0 +1,190 @@
+import unittest
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from pysovo.journal import ActionJournal, ActionState
+
+class TestActionJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'journal', 'actions.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_outcomes_and_history(self):
+        journal = ActionJournal(self.path)
+        a = journal.intent('ami_request', dict(request='body'),
+                           trigger='532871')
+        b = journal.intent('notification', dict(subject='GRB'))
+        c = journal.intent('ami_request', dict(request='body2'),
+                           trigger='532871')
+        journal.complete(a)
+        journal.fail(c, IOError("Server unavailable"))
+        self.assertEqual([r.action_id for r in journal.pending()], [b])
+        history = journal.history('532871')
+        self.assertEqual([(r.action_id, r.state) for r in history],
+                         [(a, ActionState.done), (c, ActionState.failed)])
+        self.assertEqual(history[1].error, 'Server unavailable')
+        self.assertEqual(journal.history('unknown'), [])
+
+    def test_reload(self):
+        journal = ActionJournal(self.path)
+        a = journal.intent('ami_request', dict(request='body'),
+                           trigger='532871')
+        b = journal.intent('notification', dict(subject='GRB'))
+        journal.complete(a)
+        journal.close()
+        reloaded = ActionJournal(self.path)
+        self.assertEqual(len(reloaded), 2)
+        [pending] = reloaded.pending()
+        self.assertEqual(pending.action_id, b)
+        self.assertEqual(pending.payload, dict(subject='GRB'))
+        self.assertEqual(reloaded.get(a).state, ActionState.done)
+        #IDs are not re-used:
+        self.assertTrue(reloaded.intent('notification', {}) not in (a, b))
+
+    def test_replay(self):
+        journal = ActionJournal(self.path)
+        a = journal.intent('notification', dict(subject='1'))
+        b = journal.intent('notification', dict(subject='2'))
+        journal.close()
+        journal = ActionJournal(self.path)
+        replayed = []
+        def resubmit(record):
+            if record.action_id == b:
+                raise ValueError("Unknown facility")
+            replayed.append(record.payload['subject'])
+            journal.complete(record.action_id)
+        self.assertEqual(journal.replay(resubmit), 2)
+        self.assertEqual(replayed, ['1'])
+        self.assertEqual(journal.get(a).state, ActionState.done)
+        self.assertEqual(journal.get(b).state, ActionState.failed)
+        self.assertEqual(journal.replay(resubmit), 0)
+
+    def test_replay_max_age(self):
+        journal = ActionJournal(self.path)
+        a = journal.intent('notification', dict(subject='1'))
+        journal.close()
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(dict(event='intent', id='old',
+                                    kind='notification', trigger=None,
+                                    description='Notification: 2',
+                                    payload=dict(subject='2'),
+                                    time=time.time() - 7200)) + '\n')
+        journal = ActionJournal(self.path)
+        replayed = []
+        def resubmit(record):
+            replayed.append(record.payload['subject'])
+            journal.complete(record.action_id)
+        self.assertEqual(journal.replay(resubmit, max_age=3600), 1)
+        self.assertEqual(replayed, ['1'])
+        self.assertEqual(journal.get(a).state, ActionState.done)
+        #Marked failed, then compacted away:
+        self.assertRaises(KeyError, journal.get, 'old')
+        journal.close()
+        self.assertEqual([r.action_id for r in
+                          ActionJournal(self.path)._actions.values()], [a])
+
+    def test_shared_between_processes(self):
+        #Two handles on the file stand in for two processes:
+        first = ActionJournal(self.path)
+        second = ActionJournal(self.path)
+        a = first.intent('notification', dict(subject='1'))
+        b = second.intent('notification', dict(subject='2'))
+        self.assertNotEqual(a, b)
+        second.close()
+        #The first is still open, so its pending action may be in progress:
+        third = ActionJournal(self.path)
+        replayed = []
+        def resubmit(record):
+            replayed.append(record.action_id)
+            third.complete(record.action_id)
+        self.assertEqual(third.replay(resubmit), 0)
+        first.complete(a)
+        first.close()
+        #Once it has gone, we pick up its outcome before replaying:
+        self.assertEqual(third.replay(resubmit), 1)
+        self.assertEqual(replayed, [b])
+        third.close()
+        self.assertEqual(ActionJournal(self.path).pending(), [])
+
+    def test_replay_compacts(self):
+        journal = ActionJournal(self.path)
+        for n in range(10):
+            journal.complete(journal.intent('notification',
+                                            dict(body='x' * 1000)))
+        a = journal.intent('notification', dict(subject='1'),
+                           trigger='532871')
+        journal.close()
+        journal = ActionJournal(self.path)
+        #Payloads of finished actions are not kept:
+        self.assertEqual(len([r for r in journal._actions.values()
+                              if r.payload is not None]), 1)
+        replayed = []
+        def resubmit(record):
+            replayed.append(record.action_id)
+        self.assertEqual(journal.replay(resubmit), 1)
+        journal.close()
+        with open(self.path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+        reloaded = ActionJournal(self.path)
+        [pending] = reloaded.pending()
+        self.assertEqual(pending.action_id, a)
+        self.assertEqual(pending.payload, dict(subject='1'))
+        self.assertEqual(reloaded.history('532871'), [pending])
+
+    def test_long_lines_from_processes(self):
+        def record(label):
+            journal = ActionJournal(self.path)
+            for n in range(20):
+                journal.intent('notification',
+                               dict(body=label * (200000 + n)))
+            journal.close()
+        workers = [multiprocessing.Process(target=record, args=(label,))
+                   for label in 'abc']
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join()
+            self.assertEqual(p.exitcode, 0)
+        pending = ActionJournal(self.path).pending()
+        self.assertEqual(len(pending), 60)
+        for r in pending:
+            body = r.payload['body']
+            self.assertEqual(body, body[0] * len(body))
+
+    def test_torn_line_skipped(self):
+        journal = ActionJournal(self.path)
+        a = journal.intent('notification', dict(subject='1'))
+        journal.close()
+        with open(self.path, 'a') as f:
+            f.write('{"event": "done", "id": ') #Crashed mid-write
+        journal = ActionJournal(self.path)
+        self.assertEqual(journal.get(a).state, ActionState.pending)
+        journal.complete(a)
+        journal.close()
+        self.assertEqual(ActionJournal(self.path).pending(), [])
+
+    def test_group_commit(self):
+        journal = ActionJournal(self.path)
+        start = threading.Event()
+        def record():
+            start.wait()
+            for n in range(20):
+                journal.complete(journal.intent('notification', {}))
+        threads = [threading.Thread(target=record) for _ in range(8)]
+        for t in threads:
+            t.start()
+        start.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(journal), 160)
+        #At most one sync per intent; outcomes are not synced on their own:
+        self.assertTrue(0 < journal.syncs <= 160)
+        journal.close()
+        self.assertEqual(len(ActionJournal(self.path)), 160)
@@ -0,0 +1,86 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pysovo.comms.outbound import OutboundQueue
+from pysovo.ephem import SiteEphemCacheRegistry
+from pysovo.journal import ActionJournal, ActionState
+from pysovo.observatories import Facility, FacilityDispatcher
+from pysovo.tests.resources import greenwich
+
+class TestFacilityDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.queue = OutboundQueue(workers=8, retries=0)
+        self.sent = []
+        self.now = greenwich.vernal_equinox_2012
+
+    def facility(self, name, site=greenwich.greenwich_site, delay=0,
+                 **kwargs):
+        def formatter(target, dtime):
+            time.sleep(delay)
+            return '%s: %s' % (name, target['name'])
+        return Facility(name, site, formatter, self.sent.append, **kwargs)
+
+    def test_default_predicate_uses_visibility(self):
+        dispatcher = FacilityDispatcher(
+                        [self.facility('north'),
+                         self.facility('south', greenwich.anti_site)],
+                        self.queue, site_caches=SiteEphemCacheRegistry())
+        target = {'name': 'never', 'position': greenwich.never_visible_source}
+        submitted = dispatcher.dispatch(target, self.now)
+        self.assertEqual([f.name for f, _ in submitted], ['south'])
+        self.assertTrue(self.queue.join(timeout=5))
+        self.assertEqual(self.sent, ['south: never'])
+
+    def test_facilities_prepared_concurrently(self):
+        facilities = [self.facility(str(i), delay=0.2,
+                                    predicate=lambda t, d: True)
+                      for i in range(5)]
+        dispatcher = FacilityDispatcher(facilities, self.queue)
+        start = time.time()
+        submitted = dispatcher.dispatch({'name': 'x'}, self.now)
+        self.assertTrue(time.time() - start < 0.6)
+        self.assertEqual(len(submitted), 5)
+        self.assertTrue(self.queue.join(timeout=5))
+        self.assertEqual(sorted(self.sent), ['%d: x' % i for i in range(5)])
+
+    def test_errors_isolated(self):
+        def broken(target, dtime):
+            raise ValueError("Bad predicate")
+        dispatcher = FacilityDispatcher(
+                        [self.facility('broken', predicate=broken),
+                         self.facility('ok', predicate=lambda t, d: True)],
+                        self.queue)
+        submitted = dispatcher.dispatch({'name': 'x'}, self.now)
+        self.assertEqual([f.name for f, _ in submitted], ['ok'])
+        self.assertEqual(dispatcher.stats(), [('broken', 0, 1), ('ok', 1, 0)])
+        self.assertRaises(ValueError, dispatcher.add, self.facility('ok'))
+
+    def test_requests_journalled(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'journal.jsonl')
+            journal = ActionJournal(path)
+            dispatcher = FacilityDispatcher(
+                            [self.facility('ok', predicate=lambda t, d: True)],
+                            self.queue, journal=journal)
+            dispatcher.dispatch({'name': 'x'}, self.now, trigger='532871')
+            self.assertTrue(self.queue.join(timeout=5))
+            [record] = journal.history('532871')
+            self.assertEqual(record.kind, 'ok_request')
+            self.assertEqual(record.state, ActionState.done)
+
+            #An intent left unfinished, e.g. by a crash, is sent on replay:
+            journal.intent('ok_request', dict(request='ok: y'),
+                           trigger='532872')
+            journal.close()
+            reloaded = ActionJournal(path)
+            dispatcher.journal = reloaded
+            self.assertEqual(reloaded.replay(dispatcher.resubmit), 1)
+            self.assertTrue(self.queue.join(timeout=5))
+            self.assertEqual(self.sent, ['ok: x', 'ok: y'])
+            self.assertEqual(reloaded.pending(), [])
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,62 @@
+import unittest
+import threading
+from pysovo.comms.outbound import OutboundQueue, Priority
+
+class TestOutboundQueue(unittest.TestCase):
+    def setUp(self):
+        self.queue = OutboundQueue(workers=1, retries=2, backoff=0.01)
+
+    def test_priority_order(self):
+        sent = []
+        release = threading.Event()
+        blocker = self.queue.submit(release.wait)
+        self.queue.submit(sent.append, ('notify',),
+                          priority=Priority.notification)
+        self.queue.submit(sent.append, ('sms',), priority=Priority.sms)
+        self.queue.submit(sent.append, ('telescope',),
+                          priority=Priority.telescope)
+        release.set()
+        self.assertTrue(self.queue.join(timeout=5))
+        self.assertTrue(blocker.succeeded())
+        self.assertEqual(sent, ['telescope', 'notify', 'sms'])
+
+    def test_retry_then_succeed(self):
+        calls = []
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise IOError("Server unavailable")
+            return 'sent'
+        handle = self.queue.submit(flaky)
+        self.assertEqual(handle.result(timeout=5), 'sent')
+        self.assertEqual(handle.attempts, 3)
+
+    def test_retries_bounded(self):
+        def broken():
+            raise IOError("Server unavailable")
+        handle = self.queue.submit(broken, retries=1)
+        self.assertTrue(handle.wait(timeout=5))
+        self.assertFalse(handle.succeeded())
+        self.assertEqual(handle.attempts, 2)
+        self.assertRaises(IOError, handle.result)
+        self.assertEqual(self.queue.pending(), 0)
+
+    def test_slow_send_does_not_block_others(self):
+        queue = OutboundQueue(workers=2)
+        hang = threading.Event()
+        slow = queue.submit(hang.wait, priority=Priority.notification)
+        fast = queue.submit(lambda: 'sent', priority=Priority.telescope)
+        self.assertEqual(fast.result(timeout=5), 'sent')
+        self.assertFalse(slow.done())
+        hang.set()
+        self.assertTrue(queue.join(timeout=5))
+
+    def test_callback(self):
+        finished = []
+        def broken():
+            raise IOError("Server unavailable")
+        self.queue.submit(broken, retries=1, callback=finished.append)
+        self.queue.submit(lambda: 'sent', callback=finished.append)
+        self.assertTrue(self.queue.join(timeout=5))
+        self.assertEqual(sorted(h.succeeded() for h in finished),
+                         [False, True])
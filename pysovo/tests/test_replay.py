@@ -0,0 +1,52 @@
+import unittest
+import time
+import shutil
+import tempfile
+import os
+from pysovo.replay import replay, packets_from_directory, packets_from_archive
+from pysovo.archive import ArchiveStore
+from pysovo.tests.resources import datapaths
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.handled = []
+
+    def handler(self, packet):
+        if packet == 'bad':
+            raise ValueError(packet)
+        self.handled.append(packet)
+
+    def test_burst(self):
+        packets = [(0, 'a'), (1000, 'bad'), (2000, 'c')]
+        start = time.time()
+        report = replay(packets, self.handler, speedup=None)
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual(self.handled, ['a', 'c'])
+        self.assertEqual(report.n_packets, 3)
+        self.assertEqual(report.errors, 1)
+        self.assertEqual(sum(report.histogram()), 3)
+        self.assertTrue(report.max_rss_kb > 0)
+        self.assertTrue('Packets: 3 (1 errors)' in report.format())
+
+    def test_speedup_paces_packets(self):
+        packets = [(0, 'a'), (10, 'b'), (20, 'c')]
+        report = replay(packets, self.handler, speedup=100)
+        self.assertTrue(report.elapsed >= 0.2)
+        self.assertEqual(self.handled, ['a', 'b', 'c'])
+
+    def test_sources(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            shutil.copy(datapaths.swift_bat_grb_pos_v2, tmpdir)
+            shutil.copy(datapaths.swift_bat_grb_low_dec, tmpdir)
+            from_dir = list(packets_from_directory(tmpdir))
+            self.assertEqual(len(from_dir), 2)
+            store = ArchiveStore(os.path.join(tmpdir, 'store'))
+            for i, (_, packet) in enumerate(from_dir):
+                store.append('ivo://test/stream#%d' % i, packet)
+            from_store = list(packets_from_archive(store))
+            self.assertEqual([p for _, p in from_store],
+                             [p for _, p in from_dir])
+            store.close()
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,55 @@
+import unittest
+import voeparse
+from pysovo.rules import Rule, RuleRegistry
+from pysovo.utils import IvornPrefixes
+from pysovo.tests.resources import datapaths
+
+class TestRuleRegistry(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.registry = RuleRegistry()
+        def record(name):
+            return lambda v: self.calls.append(name)
+        self.registry.add(Rule('swift', record('swift'),
+                               IvornPrefixes.swift_bat_grb_pos))
+        self.registry.add(Rule('all_swift', record('all_swift'),
+                               'ivo://nasa.gsfc.gcn/SWIFT#'))
+        self.registry.add(Rule('test', record('test'),
+                               IvornPrefixes.soton_test, roles=['test']))
+        self.registry.add(Rule('never', record('never'),
+                               'ivo://nasa.gsfc.gcn/SWIFT#',
+                               predicate=lambda v: False))
+
+    def names(self, rules):
+        return sorted(r.name for r in rules)
+
+    def test_match(self):
+        swift = 'ivo://nasa.gsfc.gcn/SWIFT#BAT_GRB_Pos_532871-729'
+        self.assertEqual(self.names(self.registry.match(swift)),
+                         ['all_swift', 'never', 'swift'])
+        self.assertEqual(
+            self.names(self.registry.match('ivo://nasa.gsfc.gcn/SWIFT#XRT_1')),
+            ['all_swift', 'never'])
+        self.assertEqual(self.registry.match('ivo://elsewhere#1'), [])
+        test_ivorn = IvornPrefixes.soton_test + '42'
+        self.assertEqual(self.names(self.registry.match(test_ivorn, 'test')),
+                         ['test'])
+        self.assertEqual(self.registry.match(test_ivorn, 'observation'), [])
+
+    def test_dispatch(self):
+        v = voeparse.load(datapaths.swift_bat_grb_pos_v2)
+        run = self.registry.dispatch(v)
+        self.assertEqual(self.calls, ['swift', 'all_swift'])
+        self.assertEqual(self.names(run), ['all_swift', 'swift'])
+        stats = dict((s[0], s[1:]) for s in self.registry.stats())
+        self.assertEqual(stats['swift'][0], 1)
+        self.assertEqual(stats['never'][0], 0)
+
+    def test_handler_decorator(self):
+        registry = RuleRegistry()
+        @registry.handler(ivorn_prefix=IvornPrefixes.soton_test)
+        def test_logic(v):
+            pass
+        self.assertEqual(registry.rules[0].name, 'test_logic')
+        self.assertRaises(ValueError, registry.handler(
+            ivorn_prefix='ivo://other#'), test_logic)
@@ -0,0 +1,97 @@
+import unittest
+import time
+from pysovo.comms import sms
+from pysovo.tests.resources.sms_standin import StandinSMSServer
+
+class TestSMSClient(unittest.TestCase):
+    def setUp(self):
+        self.server = StandinSMSServer().start()
+        self.account = self.server.account()
+
+    def tearDown(self):
+        sms.client_for(self.account).close_connection()
+        self.server.stop()
+
+    def test_client_reused(self):
+        self.assertTrue(sms.client_for(self.account) is
+                        sms.client_for(dict(self.account)))
+        self.assertEqual(sms.check_sms_balance(self.account), 100.0)
+        ids = sms.send_sms(self.account, ['4471', '4472'], 'Alert')
+        self.assertEqual(len(ids), 2)
+        statuses = sms.check_sms_statuses(self.account, ids)
+        self.assertEqual([s[2] for s in statuses], ['Sent', 'Sent'])
+        self.assertEqual(len(self.server.calls), 3)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_recipients_batched(self):
+        client = sms.SMSClient('test', 'secret', self.account['api_url'],
+                               batch_size=2)
+        ids = client.send('Alert', ['1', '2', '3', '4', '5'])
+        self.assertEqual(sorted(ids.values()), ['1', '2', '3', '4', '5'])
+        self.assertEqual([len(p) for _, p in self.server.sent()], [2, 2, 1])
+        client.close_connection()
+
+    def test_api_error(self):
+        client = sms.SMSClient('test', 'wrong', self.account['api_url'])
+        self.assertRaises(sms.SMSError, client.balance)
+        client.close_connection()
+
+    def test_retry_on_closed_connection(self):
+        client = sms.SMSClient('test', 'secret', self.account['api_url'])
+        self.server.drop_connections = True
+        client.balance()
+        client.send('Alert', ['4471'])
+        self.assertEqual(len(self.server.sent()), 1)
+        self.assertEqual(client.connections_opened, 2)
+        client.close_connection()
+
+    def test_no_resend_after_timeout(self):
+        client = sms.SMSClient('test', 'secret', self.account['api_url'],
+                               timeout=0.2)
+        client.balance()    #So the send reuses the connection
+        self.server.delay = 0.5
+        self.assertRaises(IOError, client.send, 'Alert', ['4471'])
+        time.sleep(0.5)
+        self.assertEqual(len(self.server.sent()), 1)
+        client.close_connection()
+
+
+class TestDeliveryTracker(unittest.TestCase):
+    def setUp(self):
+        self.server = StandinSMSServer().start()
+        self.client = sms.SMSClient('test', 'secret',
+                                    self.server.account()['api_url'])
+        self.escalated = []
+        self.tracker = sms.DeliveryTracker(self.client, self.escalated.append,
+                                           poll_interval=0.05,
+                                           escalate_after=60)
+
+    def tearDown(self):
+        self.tracker.stop()
+        self.client.close_connection()
+        self.server.stop()
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_delivered_and_failed(self):
+        messages = self.tracker.send('Alert', ['4471', '4472'])
+        by_phone = dict((m.phone, m) for m in messages)
+        self.server.statuses[by_phone['4471'].message_id] = 'd'
+        self.server.statuses[by_phone['4472'].message_id] = 'f'
+        self.assertTrue(self.wait_for(lambda: self.escalated))
+        self.assertEqual(self.tracker.pending(), 0)
+        self.assertEqual(self.tracker.delivered, 1)
+        self.assertEqual([m.phone for m in self.escalated], ['4472'])
+        status_calls = [c for c in self.server.calls
+                        if c['cmd'] == 'message_status']
+        self.assertEqual(len(status_calls[0]['ids'].split(',')), 2)
+
+    def test_escalate_after_timeout(self):
+        self.tracker.escalate_after = 0.1
+        self.tracker.send('Alert', ['4471'])
+        self.assertTrue(self.wait_for(lambda: self.escalated))
+        self.assertEqual(self.escalated[0].status, 'r')
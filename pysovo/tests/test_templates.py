@@ -1,23 +1,21 @@
 import unittest
+import os
+import shutil
+import tempfile
+import pytz
 from pysovo.tests.resources import greenwich
 import pysovo.ephem as ephem
 from pysovo.formatting import datetime_format_long, format_datetime
-
-import jinja2
-from jinja2 import Environment, PackageLoader
-
-env = Environment(loader=PackageLoader('pysovo', 'templates'),
-                  trim_blocks=True)
-env.filters['datetime'] = format_datetime
+import pysovo.reports
 
 #--------------------------------------------------------------
-basic_site_vis_report = env.get_template('visibility_report.txt')
-
 class TestSiteVisReport(unittest.TestCase):
     def setUp(self):
         self.time = greenwich.vernal_equinox_2012
         self.sites = [greenwich.greenwich_site,
                       greenwich.anti_site]
+        self.cache_dir = tempfile.mkdtemp()
+        env = pysovo.reports.make_environment(cache_dir=self.cache_dir)
         self.template = env.get_template('visibility_report.txt')
         def test_tgt(tgt):
 #            print "----------------------------"
@@ -35,9 +33,51 @@ class TestSiteVisReport(unittest.TestCase):
         self.test_tgt = test_tgt
         print
 
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
     def test_never_vis(self):
         self.test_tgt(greenwich.never_visible_source)
     def test_circumpolar(self):
         self.test_tgt(greenwich.circumpolar_north_transit_at_ve_m1hr)
     def test_equatorial_up_now(self):
         self.test_tgt(greenwich.equatorial_transiting_at_ve)
+
+class TestSharedEnvironment(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        #Keep the shared environment's cache out of the real config folder:
+        self.env = pysovo.reports.make_environment(cache_dir=self.cache_dir)
+        self.shared_env = pysovo.reports._env
+        pysovo.reports._env = self.env
+
+    def tearDown(self):
+        pysovo.reports._env = self.shared_env
+        shutil.rmtree(self.cache_dir)
+
+    def test_bytecode_cache_written(self):
+        self.env.get_template('notify_example.txt')
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        warm = pysovo.reports.make_environment(cache_dir=self.cache_dir)
+        self.assertEqual(warm.get_template('notify_example.txt').render(
+                            target={'description': 'test'},
+                            site_reports=[], actions_taken=[],
+                            note_time=greenwich.vernal_equinox_2012,
+                            dt_style=datetime_format_long)[:3], 'At ')
+
+    def test_datetime_filter_respects_timezone(self):
+        utc = greenwich.vernal_equinox_2012
+        local = utc.astimezone(pytz.timezone('Australia/Sydney'))
+        self.assertEqual(format_datetime(utc, "%H:%M"), "05:14")
+        self.assertEqual(format_datetime(local, "%H:%M"), "16:14")
+        self.assertEqual(format_datetime(utc, "%H:%M"), "05:14")
+
+    def test_crossmatches_listed(self):
+        from pysovo.crossmatch import Match
+        text = self.env.get_template('notify_example.txt').render(
+                    target={'description': 'test'},
+                    site_reports=[], actions_taken=[],
+                    matches=[Match('ivo://test#1', None, 0, 0, 0.1, 0.05)],
+                    note_time=greenwich.vernal_equinox_2012,
+                    dt_style=datetime_format_long)
+        self.assertTrue('ivo://test#1: 0.050 deg away' in text)
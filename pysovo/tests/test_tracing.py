@@ -0,0 +1,101 @@
+import unittest
+import os
+import shutil
+import tempfile
+import json
+import urllib2
+import StringIO
+from pysovo.tracing import Tracer, serve_metrics
+from pysovo.comms.outbound import OutboundQueue
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.tracer = Tracer()
+
+    def test_spans_attached_to_trace(self):
+        with self.tracer.trace('ivo://test#1'):
+            with self.tracer.span('parse'):
+                pass
+            with self.tracer.trace('ivo://test#2'):
+                self.tracer.record('parse', 0.5)
+            self.tracer.record('archive', 0.1)
+        self.tracer.record('untraced', 0.1)
+        spans = self.tracer.spans_for('ivo://test#1')
+        self.assertEqual([s['stage'] for s in spans], ['parse', 'archive'])
+        self.assertEqual(len(self.tracer.spans_for('ivo://test#2')), 1)
+        self.assertEqual(self.tracer.current_trace(), None)
+
+    def test_percentiles(self):
+        for i in range(100):
+            self.tracer.record('dispatch', i / 100.0)
+        summary = self.tracer.summary()['dispatch']
+        self.assertEqual(summary['count'], 100)
+        self.assertAlmostEqual(summary['quantiles'][0.5], 0.5)
+        self.assertAlmostEqual(summary['quantiles'][0.99], 0.99)
+        self.assertAlmostEqual(summary['max'], 0.99)
+
+    def test_drain_and_merge(self):
+        worker = Tracer(max_spans=3)
+        worker.record('parse', 0.1)
+        self.assertEqual([s['stage'] for s in worker.drain()], ['parse'])
+        self.assertEqual(worker.drain(), [])
+        for i in range(5):
+            worker.record('dispatch', i)
+        spans = worker.drain()
+        self.assertEqual([s['duration'] for s in spans], [2, 3, 4])
+        self.tracer.record('dispatch', 1)
+        self.tracer.merge(spans)
+        summary = self.tracer.summary()['dispatch']
+        self.assertEqual(summary['count'], 4)
+        self.assertEqual(summary['sum'], 10)
+
+    def test_exports(self):
+        with self.tracer.trace('ivo://test#1'):
+            self.tracer.record('render', 0.25)
+        out = StringIO.StringIO()
+        self.tracer.export_jsonl(out)
+        span = json.loads(out.getvalue().splitlines()[0])
+        self.assertEqual(span['trace'], 'ivo://test#1')
+        self.assertEqual(span['duration'], 0.25)
+        text = self.tracer.prometheus_text()
+        self.assertTrue('pysovo_stage_seconds{stage="render",quantile="0.5"} '
+                        '0.250000' in text)
+        self.assertTrue('pysovo_stage_seconds_count{stage="render"} 1' in text)
+
+    def test_jsonl_log(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self.tracer.jsonl_path = os.path.join(tmpdir, 'trace.jsonl')
+            with self.tracer.trace('ivo://test#1'):
+                for i in range(50):
+                    self.tracer.record('render', 0.25)
+            self.assertTrue(self.tracer.flush(timeout=5))
+            with open(self.tracer.jsonl_path) as f:
+                spans = [json.loads(line) for line in f]
+            self.assertEqual(len(spans), 50)
+            self.assertEqual(spans[0]['trace'], 'ivo://test#1')
+            #Switching files starts a new log:
+            self.tracer.jsonl_path = os.path.join(tmpdir, 'trace2.jsonl')
+            self.tracer.record('render', 0.25)
+            self.assertTrue(self.tracer.flush(timeout=5))
+            with open(self.tracer.jsonl_path) as f:
+                self.assertEqual(len(f.readlines()), 1)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_metrics_endpoint(self):
+        self.tracer.record('render', 0.25)
+        server = serve_metrics(self.tracer, port=0)
+        try:
+            url = 'http://127.0.0.1:%d/metrics' % server.server_address[1]
+            self.assertEqual(urllib2.urlopen(url).read(),
+                             self.tracer.prometheus_text())
+        finally:
+            server.shutdown()
+
+    def test_trace_follows_outbound_sends(self):
+        import pysovo.tracing
+        queue = OutboundQueue(workers=1)
+        with pysovo.tracing.tracer.trace('ivo://test#outbound'):
+            handle = queue.submit(pysovo.tracing.tracer.current_trace)
+        self.assertEqual(handle.result(timeout=5), 'ivo://test#outbound')
@@ -0,0 +1,25 @@
+import unittest
+from pysovo.triage import peek_root_attributes
+from pysovo.tests.resources import datapaths
+
+class TestPeekRootAttributes(unittest.TestCase):
+    def setUp(self):
+        with open(datapaths.swift_bat_grb_pos_v2) as f:
+            self.packet = f.read()
+
+    def test_swift_packet(self):
+        for chunk_size in (16, 512, 65536):
+            attrs = peek_root_attributes(self.packet, chunk_size)
+            self.assertEqual(attrs['ivorn'],
+                    'ivo://nasa.gsfc.gcn/SWIFT#BAT_GRB_Pos_532871-729')
+            self.assertEqual(attrs['role'], 'observation')
+
+    def test_stops_at_root(self):
+        #Trailing garbage is never read:
+        truncated = self.packet[:self.packet.index('<Who>')] + '<<<'
+        attrs = peek_root_attributes(truncated, chunk_size=64)
+        self.assertEqual(attrs['role'], 'observation')
+
+    def test_bad_packet(self):
+        self.assertRaises(ValueError, peek_root_attributes, 'Not XML at all')
+        self.assertRaises(ValueError, peek_root_attributes, '')
@@ -1,7 +1,7 @@
 from unittest import TestCase
 from astropysics.coords.coordsys import FK5Coordinates
 import voeparse
-from pysovo.utils import convert_voe_coords_to_fk5
+from pysovo.utils import convert_voe_coords_to_fk5, is_retraction
 from pysovo.tests.resources import datapaths
 
 class TestCoordConversion(TestCase):
@@ -13,8 +13,12 @@ class TestCoordConversion(TestCase):
         fk5 = convert_voe_coords_to_fk5(voe_coords)
         self.assertEqual(fk5, known_swift_grb_posn)
 
-
-
-
-
-
+class TestCitations(TestCase):
+    def test_retraction(self):
+        v = voeparse.Voevent(stream='voevent.astro.soton/TEST',
+                             stream_id='42', role=voeparse.roles.test)
+        self.assertFalse(is_retraction(v))
+        voeparse.add_citations(v, voeparse.Citation(
+            'ivo://voevent.astro.soton/TEST#41',
+            voeparse.cite_types.retraction))
+        self.assertTrue(is_retraction(v))
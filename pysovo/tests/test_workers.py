@@ -0,0 +1,218 @@
+import unittest
+import os
+import sys
+import signal
+import shutil
+import subprocess
+import tempfile
+import time
+import pysovo
+from pysovo.workers import ProcessPool, packet_key
+from pysovo.tracing import Tracer
+
+swift_ivorn = 'ivo://nasa.gsfc.gcn/SWIFT#BAT_GRB_Pos_%d-%d'
+test_ivorn = 'ivo://voevent.astro.soton/TEST#%d'
+
+class Recorder(object):
+    """Handler appending 'pid packet' lines to a shared log file."""
+    def __init__(self, path, delay=0.0):
+        self.path = path
+        self.delay = delay
+
+    def __call__(self, packet):
+        if packet == 'bad':
+            raise ValueError("Malformed packet")
+        time.sleep(self.delay)
+        with open(self.path, 'a') as f:
+            f.write('%d %s\n' % (os.getpid(), packet))
+
+
+#Run in its own process group, which it then sends SIGINT as Ctrl-C would:
+ctrl_c_script = """
+import os, sys, time, signal
+from pysovo.workers import ProcessPool
+from pysovo.tests.test_workers import Recorder
+log = sys.argv[1]
+def mark(label):
+    def hook(index):
+        with open(log, 'a') as f:
+            f.write('%s %d\\n' % (label, index))
+    return hook
+pool = ProcessPool(Recorder(log, delay=0.05), workers=2,
+                   initializer=mark('init'), finalizer=mark('final')).start()
+while not os.path.exists(log) or len(open(log).readlines()) < 2:
+    time.sleep(0.01)
+for n in range(4):
+    pool.submit('ivo://voevent.astro.soton/TEST#%d' % n, 'packet%d' % n)
+try:
+    os.killpg(os.getpgrp(), signal.SIGINT)
+    time.sleep(30)
+except KeyboardInterrupt:
+    sys.exit(0 if pool.close(timeout=20) else 1)
+sys.exit(2)
+"""
+
+class TestPacketKey(unittest.TestCase):
+    def test_swift_updates_share_key(self):
+        self.assertEqual(packet_key(swift_ivorn % (532871, 729)),
+                         packet_key(swift_ivorn % (532871, 730)))
+        self.assertEqual(packet_key(swift_ivorn % (532871, 729)),
+                         'trigger:SWIFT_532871')
+        self.assertNotEqual(packet_key(swift_ivorn % (532871, 729)),
+                            packet_key(swift_ivorn % (532872, 729)))
+
+    def test_stream_key(self):
+        self.assertEqual(packet_key(test_ivorn % 1),
+                         'stream:voevent.astro.soton/TEST')
+        self.assertEqual(packet_key(test_ivorn % 1), packet_key(test_ivorn % 2))
+
+
+class TestProcessPool(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.log = os.path.join(self.tmpdir, 'handled.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def handled(self):
+        with open(self.log) as f:
+            return [line.split() for line in f]
+
+    def test_per_key_order(self):
+        pool = ProcessPool(Recorder(self.log, delay=0.002), workers=3).start()
+        submitted = []
+        for update in range(10):
+            for trigger in range(6):
+                ivorn = swift_ivorn % (trigger, update)
+                submitted.append(ivorn)
+                pool.submit(ivorn, ivorn)
+        self.assertTrue(pool.join(timeout=30))
+        pool.close()
+        handled = self.handled()
+        self.assertEqual(sorted(i for _, i in handled), sorted(submitted))
+        for trigger in range(6):
+            key = packet_key(swift_ivorn % (trigger, 0))
+            seen = [(pid, i) for pid, i in handled if packet_key(i) == key]
+            #In submission order, all by the one worker:
+            self.assertEqual([i for _, i in seen],
+                             [swift_ivorn % (trigger, u) for u in range(10)])
+            self.assertEqual(len(set(pid for pid, _ in seen)), 1)
+
+    def test_stats(self):
+        pool = ProcessPool(Recorder(self.log), workers=2).start()
+        for n in range(5):
+            pool.submit(test_ivorn % n, test_ivorn % n)
+        pool.submit(test_ivorn % 5, 'bad')
+        self.assertTrue(pool.join(timeout=30))
+        self.assertEqual(pool.pending(), 0)
+        pool.close()
+        summary = pool.summary()
+        self.assertEqual(len(summary), 2)
+        #One stream, so one worker handled everything:
+        busy = [s for s in summary if s[2]]
+        self.assertEqual(len(busy), 1)
+        index, pid, handled, errors, rate, utilization = busy[0]
+        self.assertEqual(index, pool.worker_for(test_ivorn % 0))
+        self.assertEqual((handled, errors), (6, 1))
+        self.assertTrue(rate > 0)
+        self.assertEqual(len(self.handled()), 5)
+
+    def test_initializer_and_finalizer(self):
+        def mark(label):
+            def hook(index):
+                with open(self.log, 'a') as f:
+                    f.write('%s %d\n' % (label, index))
+            return hook
+        pool = ProcessPool(Recorder(self.log), workers=2,
+                           initializer=mark('init'),
+                           finalizer=mark('final')).start()
+        pool.close()
+        self.assertEqual(sorted(map(tuple, self.handled())),
+                         [('final', '0'), ('final', '1'),
+                          ('init', '0'), ('init', '1')])
+
+    def test_record_handled(self):
+        done = []
+        pool = ProcessPool(Recorder(self.log), workers=2,
+                           callback=lambda ivorn, ok: done.append((ivorn, ok)))
+        pool.start()
+        pool.submit(test_ivorn % 1, 'packet1')
+        pool.submit(test_ivorn % 2, 'bad')
+        self.assertTrue(pool.join(timeout=30))
+        pool.close()
+        self.assertEqual(done, [(test_ivorn % 1, True),
+                                (test_ivorn % 2, False)])
+
+    def test_spans_sent_back(self):
+        tracer = Tracer()
+        tracer.record('startup', 1.0)
+        def handler(packet):
+            with tracer.trace(packet):
+                tracer.record('dispatch', 0.5)
+        pool = ProcessPool(handler, workers=2, tracer=tracer,
+                           finalizer=lambda index: tracer.record('flush', 0.1))
+        pool.start()
+        for n in range(4):
+            pool.submit(test_ivorn % n, test_ivorn % n)
+        self.assertTrue(pool.close(timeout=30))
+        summary = tracer.summary()
+        self.assertEqual(summary['startup']['count'], 1)
+        self.assertEqual(summary['dispatch']['count'], 4)
+        self.assertEqual(summary['flush']['count'], 2)
+        self.assertEqual(len(tracer.spans_for(test_ivorn % 3)), 1)
+
+    def test_close_timeout(self):
+        pool = ProcessPool(Recorder(self.log, delay=60), workers=1).start()
+        pool.submit(test_ivorn % 1, 'packet1')
+        start = time.time()
+        self.assertFalse(pool.close(timeout=1))
+        self.assertTrue(time.time() - start < 10)
+
+    def test_worker_killed(self):
+        done = []
+        pool = ProcessPool(Recorder(self.log, delay=0.05), workers=2,
+                           callback=lambda ivorn, ok: done.append((ivorn, ok)))
+        pool.start()
+        index = pool.worker_for(test_ivorn % 0)
+        first_pid = pool.stats[index].pid
+        for n in range(20):
+            pool.submit(test_ivorn % n, 'packet%d' % n)
+        while len(done) < 5:
+            time.sleep(0.01)
+        os.kill(first_pid, signal.SIGKILL)
+        for n in range(20, 30):
+            pool.submit(test_ivorn % n, 'packet%d' % n)
+        self.assertTrue(pool.join(timeout=30))
+        self.assertTrue(pool.close(timeout=30))
+        #Restarted, with at most the packet in hand lost:
+        self.assertNotEqual(pool.stats[index].pid, first_pid)
+        self.assertEqual(pool.stats[index].restarts, 1)
+        self.assertEqual(len(done), 30)
+        failed = [ivorn for ivorn, ok in done if not ok]
+        self.assertTrue(len(failed) <= 1)
+        handled = [p for _, p in self.handled()]
+        self.assertTrue(len(handled) >= 29)
+        #...and the rest still in order:
+        self.assertEqual(handled, sorted(handled,
+                                         key=lambda p: int(p[len('packet'):])))
+
+    def test_ctrl_c(self):
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(
+                                    os.path.dirname(pysovo.__file__)))
+        proc = subprocess.Popen([sys.executable, '-c', ctrl_c_script,
+                                 self.log], env=env, preexec_fn=os.setpgrp)
+        deadline = time.time() + 60
+        while proc.poll() is None and time.time() < deadline:
+            time.sleep(0.1)
+        if proc.poll() is None:
+            os.killpg(proc.pid, signal.SIGKILL)
+            self.fail("Pool did not shut down on Ctrl-C")
+        self.assertEqual(proc.returncode, 0)
+        #The workers handled their queued packets, then ran the finalizer:
+        handled = self.handled()
+        self.assertEqual(sorted(p for _, p in handled
+                                if p.startswith('packet')),
+                         ['packet%d' % n for n in range(4)])
+        self.assertEqual(sorted(i for label, i in handled if label == 'final'),
+                         ['0', '1'])
@@ -0,0 +1,278 @@
+"""
+Lightweight timing of the alert-handling pipeline.
+
+Code under test wraps each stage in a span::
+
+    from pysovo.tracing import tracer
+
+    with tracer.trace(ivorn):
+        with tracer.span('parse'):
+            ...
+
+Spans are attached to the current trace (typically the packet IVORN),
+which is tracked per-thread. Completed spans can be written out as JSON
+lines, and per-stage percentiles are available as a dict or in the
+Prometheus text exposition format (optionally served over HTTP).
+Spans recorded in another process can be passed back with :meth:`Tracer.drain`
+and added with :meth:`Tracer.merge`.
+"""
+
+import os
+import json
+import time
+import atexit
+import threading
+import contextlib
+import collections
+import BaseHTTPServer
+import logging
+logger = logging.getLogger(__name__)
+
+default_quantiles = (0.5, 0.9, 0.99)
+
+
+def _quantile(sorted_values, q):
+    if not sorted_values:
+        return float('nan')
+    index = min(int(q * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class _LineWriter(object):
+    """Appends lines to a file from a background thread, holding the file
+    open, so callers never wait on file I/O."""
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self._lines = []
+        self._submitted = 0
+        self._written = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='trace-log')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, line):
+        with self._cond:
+            self._lines.append(line)
+            self._submitted += 1
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait until every line written so far is in the file."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            target = self._submitted
+            while self._written < target and self._thread.is_alive():
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        f = None
+        while True:
+            with self._cond:
+                while not self._lines and not self._closed:
+                    self._cond.wait()
+                lines, self._lines = self._lines, []
+                closed = self._closed
+            if lines:
+                try:
+                    if f is None:
+                        f = open(self.path, 'a')
+                    f.writelines(lines)
+                    f.flush()
+                except IOError:
+                    logger.exception("Could not write trace log %s", self.path)
+            with self._cond:
+                self._written += len(lines)
+                self._cond.notify_all()
+            if closed and not lines:
+                break
+        if f is not None:
+            f.close()
+
+
+class Tracer(object):
+    """Records stage timings, grouped by trace ID.
+
+    The most recent `history` durations per stage are kept for percentiles,
+    along with the most recent `max_spans` span records.
+    If `jsonl_path` is set, each completed span is also appended there, by
+    a background thread (see :meth:`flush`).
+    """
+    def __init__(self, history=1000, max_spans=10000, jsonl_path=None):
+        self.history = history
+        self.jsonl_path = jsonl_path
+        self.spans = collections.deque(maxlen=max_spans)
+        self._durations = collections.defaultdict(
+                                lambda: collections.deque(maxlen=self.history))
+        self._counts = collections.defaultdict(int)
+        self._sums = collections.defaultdict(float)
+        self._added = 0     #Spans added, and how many of those were drained
+        self._drained = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    def current_trace(self):
+        return getattr(self._local, 'trace_id', None)
+
+    @contextlib.contextmanager
+    def trace(self, trace_id):
+        """Attach spans recorded in this thread to `trace_id`."""
+        previous = self.current_trace()
+        self._local.trace_id = trace_id
+        try:
+            yield
+        finally:
+            self._local.trace_id = previous
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        """Time the enclosed block as `stage`."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(stage, time.time() - start, start)
+
+    def record(self, stage, duration, start=None):
+        """Record an externally timed span."""
+        span = dict(trace=self.current_trace(), stage=stage,
+                    start=start if start is not None else time.time() - duration,
+                    duration=duration)
+        with self._lock:
+            self._add(span)
+        if self.jsonl_path is not None:
+            self._log_writer().write(json.dumps(span) + '\n')
+
+    def merge(self, spans):
+        """Add spans recorded elsewhere, e.g. by :meth:`drain` in a worker
+        process. They are not logged to `jsonl_path` again."""
+        with self._lock:
+            for span in spans:
+                self._add(span)
+
+    def drain(self):
+        """Spans added since the last call (at most `max_spans`)."""
+        with self._lock:
+            n = min(self._added - self._drained, len(self.spans))
+            self._drained = self._added
+            return list(self.spans)[len(self.spans) - n:]
+
+    def _add(self, span):
+        self.spans.append(span)
+        self._durations[span['stage']].append(span['duration'])
+        self._counts[span['stage']] += 1
+        self._sums[span['stage']] += span['duration']
+        self._added += 1
+
+    def flush(self, timeout=None):
+        """Wait until all completed spans are written to `jsonl_path`."""
+        writer = self._writer
+        if writer is None or writer.pid != os.getpid():
+            return True
+        return writer.flush(timeout)
+
+    def _log_writer(self):
+        writer = self._writer
+        #New path, or a forked process, where the writer thread is gone:
+        if (writer is None or writer.path != self.jsonl_path
+                or writer.pid != os.getpid()):
+            with self._writer_lock:
+                writer = self._writer
+                if (writer is None or writer.path != self.jsonl_path
+                        or writer.pid != os.getpid()):
+                    if writer is not None and writer.pid == os.getpid():
+                        writer.close()
+                    writer = self._writer = _LineWriter(self.jsonl_path)
+        return writer
+
+    def spans_for(self, trace_id):
+        with self._lock:
+            return [s for s in self.spans if s['trace'] == trace_id]
+
+    def summary(self, quantiles=default_quantiles):
+        """Per-stage dict of count, sum and duration quantiles (seconds)."""
+        with self._lock:
+            stages = dict((k, sorted(v)) for k, v in self._durations.items())
+            counts = dict(self._counts)
+            sums = dict(self._sums)
+        result = {}
+        for stage, durations in stages.items():
+            result[stage] = dict(count=counts[stage], sum=sums[stage],
+                                 max=durations[-1] if durations else None,
+                                 quantiles=dict((q, _quantile(durations, q))
+                                                for q in quantiles))
+        return result
+
+    def export_jsonl(self, fileobj):
+        """Write retained spans to `fileobj`, one JSON object per line."""
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            fileobj.write(json.dumps(span) + '\n')
+
+    def prometheus_text(self, metric='pysovo_stage_seconds'):
+        """Per-stage summaries in the Prometheus text exposition format."""
+        lines = ['# HELP %s Time spent in each alert-handling stage.' % metric,
+                 '# TYPE %s summary' % metric]
+        for stage, s in sorted(self.summary().items()):
+            for q, value in sorted(s['quantiles'].items()):
+                lines.append('%s{stage="%s",quantile="%s"} %.6f'
+                             % (metric, stage, q, value))
+            lines.append('%s_sum{stage="%s"} %.6f' % (metric, stage, s['sum']))
+            lines.append('%s_count{stage="%s"} %d' % (metric, stage, s['count']))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self._durations.clear()
+            self._counts.clear()
+            self._sums.clear()
+            self._drained = self._added
+
+
+def serve_metrics(tracer, port, host='127.0.0.1'):
+    """Serve ``tracer.prometheus_text()`` at http://host:port/metrics
+    from a background thread. Returns the server (call `shutdown` to stop).
+    """
+    class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = tracer.prometheus_text()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    server = BaseHTTPServer.HTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics')
+    thread.daemon = True
+    thread.start()
+    logger.info("Serving metrics on http://%s:%d/metrics", host,
+                server.server_address[1])
+    return server
+
+
+#Default, shared tracer:
+tracer = Tracer()
+atexit.register(tracer.flush, 5.0)
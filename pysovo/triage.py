@@ -0,0 +1,27 @@
+"""
+Cheap first-pass inspection of raw packets.
+
+Most received packets come from streams we ignore, so rather than building
+a full object tree for each, we parse only as far as the root element and
+pull out its attributes (``ivorn``, ``role``). Packets that match no rule
+need never be fully parsed.
+"""
+
+from lxml import etree
+
+def peek_root_attributes(packet, chunk_size=512):
+    """Return a dict of the root element's attributes from raw packet bytes.
+
+    The packet is fed to the parser `chunk_size` bytes at a time, stopping as
+    soon as the root start tag has been read.
+    Raises ValueError if no root element is found.
+    """
+    parser = etree.XMLPullParser(events=('start',))
+    try:
+        for offset in xrange(0, len(packet), chunk_size):
+            parser.feed(packet[offset:offset + chunk_size])
+            for _, element in parser.read_events():
+                return dict(element.attrib)
+    except etree.XMLSyntaxError as e:
+        raise ValueError("Could not parse packet root element: " + str(e))
+    raise ValueError("No root element found in packet")
@@ -1,8 +1,13 @@
 import os
+import errno
 from collections import Sequence
-from astropysics.coords.coordsys import FK5Coordinates
 import voeparse
 
+class IvornPrefixes():
+    """Well-known stream IVORN prefixes."""
+    swift_bat_grb_pos = "ivo://nasa.gsfc.gcn/SWIFT#BAT_GRB_Pos"
+    soton_test = "ivo://voevent.astro.soton/TEST#"
+
 def listify(x):
     """
     Returns [x] if x is not already a list.
@@ -19,28 +24,39 @@ def ensure_dir(filename):
     """Ensure parent directory exists, so you can write to `filename`."""
     d = os.path.dirname(filename)
     if not os.path.exists(d):
-        os.makedirs(d)
+        try:
+            os.makedirs(d)
+        except OSError as e:
+            #Another process may have created it since we looked:
+            if e.errno != errno.EEXIST:
+                raise
 
 
 def convert_voe_coords_to_fk5(c):
     """Unit-checked conversion from voeparse.Position2D -> astropysics FK5"""
+    from astropysics.coords.coordsys import FK5Coordinates
     if (c.system != voeparse.sky_coord_system.fk5
         or c.units != 'deg'):
         raise ValueError("Unrecognised Coords type: %s, %s" % (c.system, c.units))
     return FK5Coordinates(ra=c.ra, dec=c.dec,
-                          raerror=c.err, decerror=c.err)
+                          raerr=c.err, decerr=c.err)
 
 def pull_swift_bat_id(voevent):
-    if voevent.attrib['ivorn'].find("ivo://nasa.gsfc.gcn/SWIFT#BAT_GRB_Pos") != 0:
+    ivorn = voevent.attrib['ivorn']
+    if not ivorn.startswith(IvornPrefixes.swift_bat_grb_pos):
         return None
-    alert_id = voevent.attrib['ivorn'][len('ivo://nasa.gsfc.gcn/SWIFT#BAT_GRB_Pos_'):]
+    alert_id = ivorn[len(IvornPrefixes.swift_bat_grb_pos + '_'):]
     alert_id_short = alert_id.split('-')[0]
     return alert_id, alert_id_short
 
-
-
-
-
-
-
-
+def pull_citations(voevent):
+    """Return a list of (ivorn, cite type) pairs from the Citations section."""
+    if voevent.find('Citations') is None:
+        return []
+    return [(c.text, c.attrib['cite'])
+            for c in voevent.Citations.iterchildren(tag='EventIVORN')]
+
+def is_retraction(voevent):
+    """True if the packet cites an earlier event as a retraction."""
+    return any(cite == voeparse.cite_types.retraction
+               for _, cite in pull_citations(voevent))
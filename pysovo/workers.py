@@ -0,0 +1,319 @@
+"""
+Parallel packet handling in a pool of worker processes.
+
+Each packet is routed by a key - the trigger ID for Swift alerts, otherwise
+the packet's stream - to a fixed worker, chosen by hashing the key. Each
+worker handles its packets strictly in order of submission, so packets
+about the same trigger (or from the same stream) are never reordered or
+handled concurrently, while independent packets run in parallel.
+
+Workers are forked from the parent, so inherit its loaded modules and
+state; use `initializer` to reset anything that must not be shared (e.g.
+background threads, which do not survive a fork).
+
+Workers ignore SIGINT, so Ctrl-C (which goes to the whole process group)
+leaves the parent to shut them down via :meth:`ProcessPool.close`, after
+their queued packets. Under a service manager, likewise send SIGTERM to
+the parent only (e.g. systemd's ``KillMode=mixed``).
+"""
+
+import zlib
+import time
+import signal
+import threading
+import collections
+import Queue
+import multiprocessing
+import logging
+logger = logging.getLogger(__name__)
+
+from pysovo.archive import split_ivorn
+from pysovo.utils import IvornPrefixes
+
+
+def packet_key(ivorn):
+    """Ordering key for a packet: 'trigger:<id>' for Swift BAT alerts,
+    else 'stream:<stream>'."""
+    if ivorn.startswith(IvornPrefixes.swift_bat_grb_pos + '_'):
+        alert_id = ivorn[len(IvornPrefixes.swift_bat_grb_pos + '_'):]
+        return 'trigger:SWIFT_' + alert_id.split('-')[0]
+    try:
+        return 'stream:' + split_ivorn(ivorn)[0]
+    except (IndexError, ValueError):
+        return 'stream:' + ivorn
+
+
+class WorkerStats(object):
+    """Counts for one worker process, updated as results come back."""
+    def __init__(self, index):
+        self.index = index
+        self.pid = None
+        self.submitted = 0
+        self.handled = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.restarts = 0
+        self.started = time.time()
+
+    def throughput(self):
+        """Packets handled per second since the pool started."""
+        elapsed = time.time() - self.started
+        return self.handled / elapsed if elapsed > 0 else 0.0
+
+    def utilization(self):
+        """Fraction of wall-clock time spent in the handler."""
+        elapsed = time.time() - self.started
+        return self.busy_time / elapsed if elapsed > 0 else 0.0
+
+
+def _worker_main(index, handler, inbox, results, initializer, finalizer,
+                 tracer):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    def new_spans():
+        return tracer.drain() if tracer is not None else []
+    new_spans()     #Those inherited from the parent
+    if initializer is not None:
+        initializer(index)
+    while True:
+        item = inbox.get()
+        if item is None:
+            break
+        ivorn, packet = item
+        start = time.time()
+        ok = True
+        try:
+            handler(packet)
+        except Exception:
+            ok = False
+            logger.exception("Worker %d: error handling packet", index)
+        results.put((index, ivorn, ok, time.time() - start, new_spans()))
+    if finalizer is not None:
+        finalizer(index)
+    results.put((index, None, None, 0.0, new_spans()))
+
+
+class ProcessPool(object):
+    """Runs `handler(packet)` in `workers` processes, ordered per key.
+
+    `initializer(worker_index)` and `finalizer(worker_index)`, if given,
+    are called in each worker process on start-up and on :meth:`close`.
+    `callback(ivorn, ok)`, if given, is called in the parent (from a
+    background thread) once each packet has been handled.
+    If `tracer` is given, spans it records in the workers are sent back
+    with the results, and merged into it in the parent.
+
+    A worker that dies (e.g. killed for lack of memory) is restarted, and
+    handed the packets still queued for it; the packet it was handling is
+    reported as failed.
+    """
+    #How often the results thread checks for workers that died:
+    poll_interval = 0.5
+
+    def __init__(self, handler, workers=4, key=packet_key, initializer=None,
+                 finalizer=None, callback=None, tracer=None, max_queue=1000):
+        self.handler = handler
+        self.n_workers = workers
+        self.key = key
+        self.initializer = initializer
+        self.finalizer = finalizer
+        self.callback = callback
+        self.tracer = tracer
+        self.max_queue = max_queue
+        self.stats = [WorkerStats(i) for i in range(workers)]
+        self._inboxes = [None] * workers
+        self._processes = [None] * workers
+        #Per worker, (ivorn, packet) submitted but not yet handled, in order:
+        self._unhandled = [collections.deque() for _ in range(workers)]
+        self._generations = [0] * workers
+        self._results = None
+        self._collector = None
+        self._outstanding = 0
+        self._running = 0
+        self._closing = False
+        self._cond = threading.Condition()
+        #Serializes putting packets in an inbox with replacing it:
+        self._inbox_lock = threading.Lock()
+
+    def start(self):
+        self._results = multiprocessing.Queue()
+        for i in range(self.n_workers):
+            self._start_worker(i)
+            self.stats[i].started = time.time()
+        self._running = self.n_workers
+        self._collector = threading.Thread(target=self._collect,
+                                           name='pool-results')
+        self._collector.daemon = True
+        self._collector.start()
+        logger.info("Started %d packet worker processes", self.n_workers)
+        return self
+
+    def _start_worker(self, index):
+        inbox = multiprocessing.Queue(self.max_queue)
+        p = multiprocessing.Process(target=_worker_main,
+                        name='packet-worker-%d' % index,
+                        args=(index, self.handler, inbox, self._results,
+                              self.initializer, self.finalizer, self.tracer))
+        p.daemon = True
+        p.start()
+        self.stats[index].pid = p.pid
+        self._inboxes[index] = inbox
+        self._processes[index] = p
+
+    def worker_for(self, ivorn):
+        return (zlib.crc32(self.key(ivorn)) & 0xffffffff) % self.n_workers
+
+    def submit(self, ivorn, packet):
+        """Queue a packet, to be handled after earlier ones with its key."""
+        index = self.worker_for(ivorn)
+        with self._inbox_lock:
+            with self._cond:
+                self._outstanding += 1
+                self.stats[index].submitted += 1
+                self._unhandled[index].append((ivorn, packet))
+                generation = self._generations[index]
+        #Don't wait on a full inbox for good, in case its worker has died:
+        while True:
+            with self._inbox_lock:
+                if self._generations[index] != generation:
+                    return index    #Handed to the restarted worker
+                try:
+                    self._inboxes[index].put((ivorn, packet),
+                                             timeout=self.poll_interval)
+                    return index
+                except Queue.Full:
+                    pass
+
+    def pending(self):
+        with self._cond:
+            return self._outstanding
+
+    def join(self, timeout=None):
+        """Wait until all submitted packets are handled.
+
+        Returns False on timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._outstanding:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """Handle all queued packets, run the finalizers and stop workers.
+
+        Workers still running after `timeout` seconds are terminated.
+        Returns False if any had to be.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        def remaining():
+            return None if deadline is None else max(0, deadline - time.time())
+        with self._inbox_lock:
+            self._closing = True
+        for p, inbox in zip(self._processes, self._inboxes):
+            #A dead worker's inbox may be full, and never drained:
+            if p.is_alive():
+                try:
+                    inbox.put(None, timeout=remaining())
+                except Queue.Full:
+                    pass
+        clean = True
+        for p in self._processes:
+            p.join(remaining())
+            if p.is_alive():
+                logger.warn("Worker %s (pid %d) did not stop, terminating",
+                            p.name, p.pid)
+                p.terminate()
+                p.join()
+                clean = False
+            elif p.exitcode:
+                logger.warn("Worker %s (pid %d) exited with status %d",
+                            p.name, p.pid, p.exitcode)
+                clean = False
+        if self._collector is not None:
+            self._collector.join()
+        return clean
+
+    def _collect(self):
+        while self._running:
+            try:
+                index, ivorn, ok, duration, spans = self._results.get(
+                                            timeout=self.poll_interval)
+            except Queue.Empty:
+                #All results sent by a dead worker have been read by now.
+                if self._closing:
+                    if not any(p.is_alive() for p in self._processes):
+                        #Killed, rather than stopped; nothing more will come.
+                        logger.warn("All packet workers have exited")
+                        return
+                else:
+                    for index, p in enumerate(self._processes):
+                        if not p.is_alive():
+                            self._restart(index)
+                continue
+            if spans:
+                self.tracer.merge(spans)
+            with self._cond:
+                stats = self.stats[index]
+                if ok is None:
+                    self._running -= 1
+                    continue
+                unhandled = self._unhandled[index]
+                if not unhandled or unhandled[0][0] != ivorn:
+                    continue    #Already reported lost, on a restart
+                unhandled.popleft()
+                stats.handled += 1
+                stats.busy_time += duration
+                if not ok:
+                    stats.errors += 1
+                self._outstanding -= 1
+                self._cond.notify_all()
+            self._report(ivorn, ok)
+
+    def _restart(self, index):
+        """Replace a dead worker, handing it the packets queued for the old
+        one; the packet the old one was handling is lost."""
+        with self._inbox_lock:
+            if self._closing:
+                return
+            old = self._processes[index]
+            with self._cond:
+                unhandled = self._unhandled[index]
+                lost = unhandled.popleft() if unhandled else None
+                backlog = list(unhandled)
+                self._generations[index] += 1
+                stats = self.stats[index]
+                stats.restarts += 1
+                if lost is not None:
+                    stats.handled += 1
+                    stats.errors += 1
+                    self._outstanding -= 1
+                    self._cond.notify_all()
+            logger.error("Worker %d (pid %d) died with status %s; restarting "
+                         "it, with %d packets queued", index, old.pid,
+                         old.exitcode, len(backlog))
+            #A worker killed in inbox.get() may hold the inbox's read lock:
+            self._inboxes[index].cancel_join_thread()
+            self._inboxes[index].close()
+            self._start_worker(index)
+            for item in backlog:
+                self._inboxes[index].put(item)
+        if lost is not None:
+            logger.error("Packet %s lost: worker %d died handling it",
+                         lost[0], index)
+            self._report(lost[0], False)
+
+    def _report(self, ivorn, ok):
+        if self.callback is not None:
+            try:
+                self.callback(ivorn, ok)
+            except Exception:
+                logger.exception("Error in packet pool callback")
+
+    def summary(self):
+        """Per-worker (index, pid, handled, errors, packets/s, utilization)."""
+        with self._cond:
+            return [(s.index, s.pid, s.handled, s.errors, s.throughput(),
+                     s.utilization()) for s in self.stats]
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+"""Replay archived VOEvents through the full alert_response pipeline.
+
+All email goes to a local stand-in SMTP server and SMS sends are recorded
+rather than made, so this is safe to run against real contact details.
+e.g.::
+
+ replay_alerts.py ~/comet/voe_archive --speedup 100
+ replay_alerts.py ~/comet/voe_store --store --burst
+"""
+import sys
+import os
+import shutil
+import tempfile
+import argparse
+import logging
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('source',
+                        help="Directory of XML packets, or an archive store.")
+    parser.add_argument('--store', action='store_true',
+                        help="Treat source as a pysovo.archive store.")
+    parser.add_argument('--stream', default=None,
+                        help="(With --store) only replay this stream prefix.")
+    rate = parser.add_mutually_exclusive_group()
+    rate.add_argument('--speedup', type=float, default=1.0,
+                      help="Replay N times faster than real time (default 1).")
+    rate.add_argument('--burst', action='store_true',
+                      help="Replay all packets back-to-back.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARN)
+
+    from pysovo.tests.resources.smtp_standin import StandinSMTPServer
+    import pysovo.replay
+    import pysovo.archive
+    import pysovo.dedup
+    import pysovo.journal
+    import pysovo.comms.email
+    import pysovo.comms.sms
+    import alert_response as ar
+    logging.getLogger().setLevel(logging.WARN)
+
+    smtp = StandinSMTPServer().start()
+    sms = pysovo.replay.RecordingSender()
+    workdir = tempfile.mkdtemp()
+    ar.default_email_account = smtp.account()
+    ar.ps.comms.email.default_pool = pysovo.comms.email.SMTPConnectionPool(
+                                                            require_tls=False)
+    ar.ps.comms.sms.send_sms = sms
+    ar.default_archive_root = os.path.join(workdir, 'archive')
+    ar.packet_index = pysovo.dedup.PacketIndex()
+    ar.journal = pysovo.journal.ActionJournal(os.path.join(workdir,
+                                                           'journal.jsonl'))
+    ar.facilities.journal = ar.journal
+
+    if args.store:
+        store = pysovo.archive.ArchiveStore(args.source)
+        packets = pysovo.replay.packets_from_archive(store, stream=args.stream)
+    else:
+        packets = pysovo.replay.packets_from_directory(args.source)
+    try:
+        report = pysovo.replay.replay(packets, ar.process_packet,
+                            speedup=None if args.burst else args.speedup)
+        ar.notifications.flush()
+        ar.outbound_queue.join()
+        ar.journal.close()
+        ar.close_archives()
+    finally:
+        smtp.stop()
+        shutil.rmtree(workdir)
+
+    print report.format()
+    print "Emails sent: %d, SMS sent: %d" % (len(smtp.messages), len(sms.calls))
+    print "Stage timings:"
+    print ar.tracer.prometheus_text()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+"""Time each stage of the alert hot path, and check for regressions.
+
+Besides the stages in pysovo.benchmarks, the 'pipeline' stage times
+alert_response's handling of a Swift alert end to end.
+
+The run fails (exit status 1) if any stage is slower than the baseline's
+by more than its threshold. The baseline is the saved results for the
+commit this branch forked from main (``git merge-base HEAD main``), unless
+one is given; only results recorded on this machine are used. Results are
+saved per commit, for use as a baseline later, if the run passes.
+e.g.::
+
+ run_benchmarks.py
+ run_benchmarks.py --stage visibility_10 --stage render --repeats 50
+ run_benchmarks.py --baseline 0c6315a --thresholds thresholds.json
+"""
+import sys
+import os
+import argparse
+import logging
+logging.basicConfig(level=logging.WARN)
+
+import pysovo
+import pysovo.benchmarks as bench
+
+default_results_dir = os.path.join(pysovo.config_folder, 'benchmarks')
+
+@bench.stage('pipeline')
+def pipeline_benchmark(workdir):
+    """A Swift alert through alert_response.voevent_logic, from parsing to
+    sent notification, with emails sent to a stand-in.
+
+    alert_response's journal, archive and packet index are swapped for
+    ones in `workdir`; each run starts with an empty packet index, so the
+    alert is handled as new.
+    """
+    import voeparse
+    import pysovo.comms.email
+    from pysovo.comms.digest import NotificationDigester
+    from pysovo.dedup import PacketIndex
+    from pysovo.journal import ActionJournal
+    from pysovo.replay import RecordingSender
+    import alert_response as ar
+
+    ar.default_archive_root = os.path.join(workdir, 'archive')
+    ar.position_index = None
+    ar.journal = ActionJournal(os.path.join(workdir, 'action_journal.jsonl'))
+    ar.facilities.journal = ar.journal
+    ar.contacts = {'benchmark': {'email': 'standin@example.com'},
+                   'ami': {'email': 'standin@example.com',
+                           'requester': 'Benchmark'}}
+    ar.notify_contacts = ['benchmark']
+    ar.notifications = NotificationDigester(ar.send_notification, window=0,
+                                            default_rate_limit=(10 ** 9, 1))
+    sent = RecordingSender()
+    packet = bench.sample_packets()[0]
+
+    def run():
+        ar.packet_index = PacketIndex()
+        send_email = pysovo.comms.email.send_email
+        pysovo.comms.email.send_email = sent
+        try:
+            ar.voevent_logic(voeparse.loads(packet))
+            ar.notifications.flush()
+            ar.outbound_queue.join()
+        finally:
+            pysovo.comms.email.send_email = send_email
+
+    def close():
+        ar.close_archives()
+        ar.journal.close()
+        if ar.position_index is not None:
+            ar.position_index.close_log()
+            ar.position_index = None
+    run.close = close
+    return run
+
+#End to end, so noisier than the other stages:
+bench.default_thresholds['pipeline'] = 1.5
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--stage', action='append', dest='stages',
+                        choices=bench.stages.keys(),
+                        help="Only run this stage (may be repeated).")
+    parser.add_argument('--repeats', type=int, default=20,
+                        help="Timed runs per stage (default 20).")
+    parser.add_argument('--results-dir', default=default_results_dir,
+                        help="Where results are saved, one file per commit "
+                             "(default %(default)s).")
+    parser.add_argument('--baseline', metavar='COMMIT',
+                        help="Compare against this commit's results "
+                             "(default: those for the merge base with "
+                             "--upstream).")
+    parser.add_argument('--upstream', default='main', metavar='BRANCH',
+                        help="Branch whose merge base with HEAD is the "
+                             "default baseline (default %(default)s).")
+    parser.add_argument('--thresholds', metavar='PATH',
+                        help="JSON file of per-stage slowdown ratios, "
+                             "e.g. {\"render\": 1.5}.")
+    parser.add_argument('--no-save', action='store_true',
+                        help="Don't save the results.")
+    args = parser.parse_args()
+
+    store = bench.ResultsStore(args.results_dir)
+    commit = bench.current_commit()
+    baseline_commit = args.baseline or bench.merge_base(args.upstream)
+    baseline = None
+    if baseline_commit is not None:
+        baseline = store.find(baseline_commit,
+                              machine=bench.current_machine())
+    thresholds = dict(bench.default_thresholds)
+    if args.thresholds:
+        thresholds.update(bench.load_thresholds(args.thresholds))
+
+    results = bench.run_suite(args.stages, repeats=args.repeats)
+
+    print "Commit %s" % commit,
+    regressions = []
+    if baseline is None:
+        if baseline_commit is None:
+            print "(no baseline: no merge base with %s)" % args.upstream
+        else:
+            print "(no baseline: no results for %s from this machine)" % (
+                    baseline_commit[:7])
+        print bench.format_results(results)
+    else:
+        print "vs baseline %s" % baseline['commit']
+        print bench.format_results(results, baseline['results'])
+        regressions = bench.check_regressions(results, baseline['results'],
+                                              thresholds)
+    for r in regressions:
+        print "REGRESSION: %s %.3f ms -> %.3f ms (x%.2f, threshold x%.2f)" % (
+                r.stage, 1e3 * r.baseline, 1e3 * r.current, r.ratio,
+                r.threshold)
+    #Only passing runs may become baselines:
+    if not regressions and not args.no_save:
+        store.save(commit, results)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())